@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Benchmark del índice aproximado (IVF) contra la búsqueda exacta.
+
+Reporta recall@k y latencia p50/p99 por consulta para distintos nprobe, sobre
+embeddings sintéticos (clusters gaussianos, del tamaño que se quiera simular)
+y sobre los embeddings reales del índice MIA (o del CSV si no hay índice).
+
+Ejemplos:
+    python benchmark_ann.py
+    python benchmark_ann.py --n 200000 --dim 1536 --nprobe 1 4 16 64
+    python benchmark_ann.py --real plataforma/mia_data/mia_index.json --json resultados.json
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from plataforma import index_store
+from plataforma.ann import IVFIndex, recall, sample_queries
+from plataforma.retrieval import VectorIndex, normalize_rows
+
+REAL_SOURCES = [
+    Path("plataforma/mia_data/mia_index.json"),
+    Path("plataforma/mia_data/mia_embeddings.csv"),
+]
+
+
+def synthetic_embeddings(n, dim, clusters=256, spread=0.5, seed=0):
+    """Vectores unitarios agrupados en clusters, parecidos a embeddings de textos temáticos"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    matrix = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 50_000):
+        stop = min(n, start + 50_000)
+        labels = rng.integers(0, clusters, stop - start)
+        matrix[start:stop] = centers[labels] + spread * rng.standard_normal((stop - start, dim), dtype=np.float32)
+    return normalize_rows(matrix)
+
+
+def real_embeddings(path=None):
+    """Matriz de embeddings del índice real (manifiesto JSON o CSV)"""
+    candidates = [Path(path)] if path else REAL_SOURCES
+    for candidate in candidates:
+        if candidate.exists():
+            if candidate.suffix == ".json":
+                return np.asarray(index_store.load_index(candidate).matrix), candidate
+            _, embeddings, _ = index_store.read_embeddings_csv(candidate)
+            return normalize_rows(embeddings), candidate
+    return None, None
+
+
+def timed_search(index, queries, k, exact):
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        indices, _ = index.search(query, top_n=k, exact=exact)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append(indices)
+    return results, np.array(latencies)
+
+
+def benchmark(name, matrix, n_queries, k, nlist, nprobes):
+    print(f"\n📐 {name}: {matrix.shape[0]} vectores de dimensión {matrix.shape[1]}")
+    index = VectorIndex([""] * matrix.shape[0], matrix, normalized=True)
+
+    started = time.perf_counter()
+    index.ann = IVFIndex.build(matrix, nlist=nlist)
+    build_s = time.perf_counter() - started
+    print(f"🏗️ IVF con {index.ann.nlist} listas construido en {build_s:.1f}s")
+
+    queries = sample_queries(matrix, n_queries)
+    truth, exact_ms = timed_search(index, queries, k, exact=True)
+    rows = [{
+        "corpus": name, "method": "exact", "nprobe": None, f"recall@{k}": 1.0,
+        "p50_ms": float(np.percentile(exact_ms, 50)), "p99_ms": float(np.percentile(exact_ms, 99)),
+    }]
+    for nprobe in sorted({min(nprobe, index.ann.nlist) for nprobe in nprobes}):
+        index.ann.nprobe = nprobe
+        found, ann_ms = timed_search(index, queries, k, exact=False)
+        rows.append({
+            "corpus": name, "method": "ivf", "nprobe": nprobe, f"recall@{k}": recall(found, truth),
+            "p50_ms": float(np.percentile(ann_ms, 50)), "p99_ms": float(np.percentile(ann_ms, 99)),
+        })
+
+    print(f"{'método':<8}{'nprobe':>8}{f'recall@{k}':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for row in rows:
+        nprobe = "-" if row["nprobe"] is None else row["nprobe"]
+        print(f"{row['method']:<8}{nprobe:>8}{row[f'recall@{k}']:>12.3f}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}")
+    return rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark ANN (IVF) vs búsqueda exacta")
+    parser.add_argument("--n", type=int, default=100_000, help="Vectores sintéticos (0 para omitirlos)")
+    parser.add_argument("--dim", type=int, default=1536, help="Dimensión de los vectores sintéticos")
+    parser.add_argument("--real", metavar="PATH", help="Índice (.json) o CSV de embeddings reales")
+    parser.add_argument("--queries", type=int, default=200, help="Consultas por corpus")
+    parser.add_argument("-k", type=int, default=10, help="k de recall@k")
+    parser.add_argument("--nlist", type=int, help="Listas del IVF (por defecto 4·√n)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--json", metavar="PATH", help="Guarda los resultados en un archivo JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print("=== Benchmark ANN (IVF) vs búsqueda exacta ===")
+    results = []
+
+    if args.n:
+        results += benchmark("sintético", synthetic_embeddings(args.n, args.dim), args.queries, args.k,
+                             args.nlist, args.nprobe)
+
+    matrix, source = real_embeddings(args.real)
+    if matrix is None:
+        print("⚠️ No se encontraron embeddings reales; ejecuta generate_mia_embeddings.py")
+    else:
+        results += benchmark(f"real ({source})", matrix, args.queries, args.k, args.nlist, args.nprobe)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"\n✅ Resultados guardados en: {args.json}")
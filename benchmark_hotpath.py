@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks del camino crítico del chat, comparados contra una línea base.
+
+Mide tiempo por llamada, memoria máxima y memoria retenida (tracemalloc) de
+strings_ranked_by_relatedness y query_message (con el embedding simulado) sobre
+corpus sintéticos de 32 a 100k chunks, y de num_tokens, format_response y
+process_course_to_text. Termina con código 1 si alguna métrica empeora más que
+la tolerancia respecto de plataforma/mia_data/hotpath_baseline.json.
+
+Los tiempos dependen de la máquina: genera la línea base en la misma máquina
+donde se compara (--update-baseline).
+
+Ejemplos:
+    python benchmark_hotpath.py
+    python benchmark_hotpath.py --sizes 32 1000 --json resultados.json
+    python benchmark_hotpath.py --update-baseline
+"""
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "luminousoceans_v0.settings")
+django.setup()
+
+from plataforma import microbench  # noqa: E402
+
+
+def print_header(baseline):
+    print(f"{'caso':<38}{'µs/llamada':>12}{'pico KB':>12}{'retenido KB':>12}{'vs base' if baseline else '':>11}")
+
+
+def print_row(case, metrics, previous=None):
+    line = f"{case:<38}{metrics['time_us']:>12.1f}{metrics['peak_bytes'] / 1024:>12.1f}{metrics['retained_bytes'] / 1024:>12.1f}"
+    if previous:
+        line += f"{(metrics['time_us'] / previous['time_us'] - 1) * 100:>+10.1f}%"
+    print(line, flush=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks del camino crítico del chat")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(microbench.SIZES), help="Chunks de cada corpus")
+    parser.add_argument("--repeat", type=int, default=7, help="Rondas por caso (se toma la mejor)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Segundos de medición por caso")
+    parser.add_argument("--baseline", default=microbench.BASELINE_PATH, help="Archivo de la línea base")
+    parser.add_argument("--update-baseline", action="store_true", help="Guarda esta corrida como línea base")
+    parser.add_argument("--time-tolerance", type=float, default=microbench.TIME_TOLERANCE,
+                        help="Aumento relativo de tiempo permitido")
+    parser.add_argument("--memory-tolerance", type=float, default=microbench.MEMORY_TOLERANCE,
+                        help="Aumento relativo de memoria permitido")
+    parser.add_argument("--json", metavar="PATH", help="Guarda los resultados en un archivo JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print("=== Micro-benchmarks del chat ===")
+    baseline = microbench.load_baseline(args.baseline)
+    previous = (baseline or {}).get("results", {})
+
+    def progress(case, metrics):
+        if case == "num_tokens":
+            print_header(baseline)
+        print_row(case, metrics, previous.get(case))
+
+    results = microbench.run_suite(args.sizes, args.repeat, args.min_time, progress=progress)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"\n✅ Resultados guardados en: {args.json}")
+
+    if args.update_baseline:
+        microbench.save_baseline(results, args.baseline)
+        print(f"\n📌 Línea base actualizada: {args.baseline}")
+    elif baseline is None:
+        print(f"\n⚠️ No existe {args.baseline}; créala con --update-baseline")
+    else:
+        regressions = microbench.compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regresiones respecto de la línea base:")
+            for regression in regressions:
+                print(f"  {regression['case']} {regression['metric']}: {regression['baseline']:.1f} -> "
+                      f"{regression['current']:.1f} (x{regression['ratio']:.2f})")
+            sys.exit(1)
+        print("\n✅ Sin regresiones respecto de la línea base")
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Benchmark de calidad y latencia de la recuperación sobre el catálogo MIA.
+
+Evalúa las preguntas de plataforma/mia_data/gold_questions.json (pregunta ->
+códigos de curso esperados) con BM25, con los vectores y con el ranking
+híbrido del chat, y reporta recall@k, MRR, tokens del contexto que arma
+query_message y latencia por etapa. Sirve para comparar cambios en
+process_course_to_text, el chunking o el scoring.
+
+Los embeddings de las preguntas se graban una vez (--record, llama a OpenAI)
+en plataforma/mia_data/gold_embeddings.json; después el benchmark corre sin
+red. Sin ese archivo solo se evalúa BM25.
+
+Ejemplos:
+    python benchmark_retrieval.py --record
+    python benchmark_retrieval.py --json resultados.json
+    python benchmark_retrieval.py --json nuevo.json --compare resultados.json
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "luminousoceans_v0.settings")
+django.setup()
+
+from plataforma import evaluation, index_store  # noqa: E402
+
+INDEX_SOURCES = [
+    Path("plataforma/mia_data/mia_index.json"),
+    Path("plataforma/mia_data/mia_embeddings.csv"),
+]
+
+
+def load_benchmark_index(path=None):
+    """Índice a evaluar: el indicado o el que usaría el chat (índice binario o CSV de respaldo)"""
+    for candidate in ([Path(path)] if path else INDEX_SOURCES):
+        if candidate.exists():
+            if candidate.suffix == ".json":
+                return index_store.load_index(candidate), candidate
+            index = index_store.load_csv_index(candidate)
+            index.version = f"csv-{candidate.stem}-{candidate.stat().st_mtime_ns}"
+            return index, candidate
+    raise FileNotFoundError("No se encontró el índice; ejecuta generate_mia_embeddings.py")
+
+
+def record_embeddings(gold, fixture_path):
+    """Graba los embeddings de las preguntas que aún no están en el fixture"""
+    from plataforma.views import EMBEDDING_MODEL
+    import openai
+
+    embeddings = evaluation.RecordedEmbeddings.load(fixture_path) or evaluation.RecordedEmbeddings(EMBEDDING_MODEL)
+    if embeddings.model != EMBEDDING_MODEL:
+        raise SystemExit(f"❌ El fixture fue grabado con {embeddings.model}; bórralo para grabarlo con {EMBEDDING_MODEL}")
+
+    def create(text):
+        response = openai.Embedding.create(model=EMBEDDING_MODEL, input=text)
+        return response["data"][0]["embedding"]
+
+    recorded = embeddings.record([item["question"] for item in gold], create)
+    embeddings.save(fixture_path)
+    print(f"🎙️ {len(recorded)} preguntas grabadas en {fixture_path} ({len(embeddings.vectors)} en total)")
+
+
+def print_report(results, k_values):
+    index = results["index"]
+    print(f"\n📚 Índice {index['version']} ({index['rows']} textos, chunking por {index['chunking']})")
+    print(f"❓ {results['gold_questions']} preguntas; embeddings: {results['embedding_model'] or 'sin fixture'}")
+
+    header = "".join(f"{f'R@{k}':>8}" for k in k_values)
+    print(f"\n{'método':<8}{'n':>5}{header}{'MRR':>8}")
+    for method, metrics in results["methods"].items():
+        values = "".join(f"{metrics[f'recall@{k}']:>8.3f}" for k in k_values)
+        print(f"{method:<8}{metrics['questions']:>5}{values}{metrics['mrr']:>8.3f}")
+
+    context = results["context"]
+    if context["tokens"]["n"]:
+        print(f"\n🧾 Contexto: {context['tokens']['mean']:.0f} tokens en promedio (máx. {context['tokens']['max']:.0f}"
+              f" de {results['token_budget']}); cursos esperados en el contexto: {context['recall']:.1%}")
+
+    print(f"\n{'etapa':<8}{'n':>5}{'p50 ms':>10}{'p99 ms':>10}")
+    for stage, summary in results["latency_ms"].items():
+        if summary["n"]:
+            print(f"{stage:<8}{summary['n']:>5}{summary['p50']:>10.2f}{summary['p99']:>10.2f}")
+    recorded = results["recorded_embedding_ms"]
+    if recorded["n"]:
+        print(f"(embedding de la pregunta al grabar: p50 {recorded['p50']:.0f} ms, p99 {recorded['p99']:.0f} ms)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de recuperación (recall@k, MRR, tokens, latencia)")
+    parser.add_argument("--index", metavar="PATH", help="Índice (.json) o CSV a evaluar")
+    parser.add_argument("--gold", default=evaluation.GOLD_PATH, help="Preguntas con los cursos esperados")
+    parser.add_argument("--fixture", default=evaluation.FIXTURE_PATH, help="Embeddings grabados de las preguntas")
+    parser.add_argument("--record", action="store_true", help="Graba con OpenAI los embeddings que falten y termina")
+    parser.add_argument("-k", type=int, nargs="+", default=list(evaluation.K_VALUES), help="Valores de k para recall@k")
+    parser.add_argument("--token-budget", type=int, default=4096 - 500, help="Presupuesto de tokens del mensaje")
+    parser.add_argument("--json", metavar="PATH", help="Guarda los resultados en un archivo JSON")
+    parser.add_argument("--compare", metavar="PATH", help="JSON de una corrida anterior para comparar")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print("=== Benchmark de recuperación MIA ===")
+    gold = evaluation.load_gold(args.gold)
+
+    if args.record:
+        record_embeddings(gold, args.fixture)
+        raise SystemExit(0)
+
+    unknown = sorted({code for item in gold for code in item["expected"]} - evaluation.catalog_codes())
+    if unknown:
+        print(f"⚠️ Códigos esperados que no están en el catálogo: {', '.join(unknown)}")
+
+    index, source = load_benchmark_index(args.index)
+    embeddings = evaluation.RecordedEmbeddings.load(args.fixture)
+    if embeddings is None:
+        print(f"⚠️ No existe {args.fixture}: solo se evalúa BM25 (graba los embeddings con --record)")
+    elif index.model and embeddings.model != index.model:
+        print(f"⚠️ Las preguntas se grabaron con {embeddings.model} pero el índice usa {index.model}")
+
+    results = evaluation.run(index, gold, embeddings, ks=tuple(args.k), token_budget=args.token_budget)
+    results["index"]["source"] = str(source)
+    print_report(results, args.k)
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        print(f"\n📊 Diferencias con {args.compare}:")
+        for name, delta in evaluation.compare(results, baseline).items():
+            print(f"  {name:<28}{delta:>+10.3f}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"\n✅ Resultados guardados en: {args.json}")
@@ -6,10 +6,19 @@ Coloca este archivo en la raíz de tu proyecto Django y ejecuta
 
 import os
 import json
-import pandas as pd
+import argparse
+import hashlib
+import random
+import time
+import numpy as np
 import openai
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+from plataforma import index_store, tokens
+from plataforma.ann import ANN_TYPES, evaluate as evaluate_ann, pca_sweep
+from plataforma.courses import COURSE_FIELDS, course_metadata_fields, process_course_to_chunks, process_course_to_text
+
 # Cargar variables de entorno desde .env
 try:
     from dotenv import load_dotenv
@@ -24,6 +33,25 @@ openai.organization = os.getenv('OPENAI_ORG')
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
 EMBEDDING_MODEL = "text-embedding-ada-002"
+GPT_MODEL = "gpt-3.5-turbo-0125"  # Modelo del chat, para precalcular tokens por texto
+DATA_DIR = Path("plataforma/mia_data")
+INDEX_NAME = "mia_index"
+CSV_PATH = DATA_DIR / "mia_embeddings.csv"
+CHECKPOINT_PATH = DATA_DIR / ".embeddings_checkpoint.jsonl"
+CHUNKING_LABELS = {"course": "curso", "section": "sección"}
+PCA_SWEEP_DIMS = (32, 64, 128, 256, 512)
+
+# Envío de batches: límites por request, paralelismo y reintentos
+MAX_INPUT_TOKENS = 8191  # Máximo por texto de text-embedding-ada-002
+MAX_BATCH_ITEMS = 100
+MAX_BATCH_TOKENS = 50_000
+EMBEDDING_CONCURRENCY = 4
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0  # segundos
+BACKOFF_MAX = 30.0
+# Errores transitorios de la API; los demás (clave inválida, texto demasiado largo...) no se reintentan
+RETRYABLE_ERRORS = (openai.error.RateLimitError, openai.error.APIError, openai.error.Timeout,
+                    openai.error.ServiceUnavailableError)
 
 
 def load_mia_data():
@@ -44,154 +72,320 @@ def load_mia_data():
     return courses_data
 
 
-def process_course_to_text(course_code, course_info):
-    """Convierte un curso a texto para embedding (mismo formato que tu sistema)"""
-    parts = []
-
-    metadata = course_info.get('metadata', {})
-
-    # Información básica
-    if metadata.get('nombre'):
-        parts.append(f"Curso: {metadata['nombre']}")
-    if metadata.get('codigo'):
-        parts.append(f"Código: {metadata['codigo']}")
-    if metadata.get('disciplina'):
-        parts.append(f"Disciplina: {metadata['disciplina']}")
-    if metadata.get('creditos'):
-        parts.append(f"Créditos: {metadata['creditos']}")
-
-    # Descripción
-    if course_info.get('descripcion'):
-        parts.append(f"Descripción: {course_info['descripcion']}")
-
-    # Resultados de aprendizaje
-    if course_info.get('resultados_aprendizaje'):
-        resultados = ' '.join(course_info['resultados_aprendizaje'])
-        parts.append(f"Resultados de aprendizaje: {resultados}")
-
-    # Contenidos - CORREGIDO para manejar la nueva estructura
-    if course_info.get('contenidos'):
-        contenidos_text = []
-        contenidos = course_info['contenidos']
-
-        # Si contenidos es un diccionario con estructura jerárquica
-        if isinstance(contenidos, dict):
-            for key, value in contenidos.items():
-                if isinstance(value, dict) and 'titulo' in value:
-                    # Nueva estructura jerárquica
-                    contenidos_text.append(value['titulo'])
-                    # Agregar subsecciones si existen
-                    if 'subsecciones' in value and isinstance(value['subsecciones'], dict):
-                        for sub_key, sub_value in value['subsecciones'].items():
-                            if isinstance(sub_value, dict) and 'titulo' in sub_value:
-                                contenidos_text.append(sub_value['titulo'])
-                elif isinstance(value, str):
-                    # Estructura simple
-                    contenidos_text.append(value)
-
-        if contenidos_text:
-            parts.append(f"Contenidos: {' '.join(contenidos_text)}")
-
-    # Metodologías
-    if course_info.get('metodologias') and isinstance(course_info['metodologias'], list):
-        metodologias = ' '.join(course_info['metodologias'])
-        parts.append(f"Metodologías: {metodologias}")
-
-    # Evaluación - CORREGIDO para manejar la nueva estructura
-    if course_info.get('evaluacion'):
-        evaluacion = course_info['evaluacion']
-        if isinstance(evaluacion, dict) and 'items' in evaluacion:
-            # Nueva estructura
-            eval_items = []
-            for item, porcentaje in evaluacion['items'].items():
-                eval_items.append(f"{item} {porcentaje}%")
-            if eval_items:
-                parts.append(f"Evaluación: {' '.join(eval_items)}")
-        elif isinstance(evaluacion, dict):
-            # Estructura simple (diccionario directo)
-            eval_items = []
-            for item, porcentaje in evaluacion.items():
-                eval_items.append(f"{item} {porcentaje}")
-            if eval_items:
-                parts.append(f"Evaluación: {' '.join(eval_items)}")
-
-    # Bibliografía
-    bibliography = course_info.get('bibliography') or course_info.get('bibliografia', {})
-    bib_texts = []
-
-    for entry in bibliography.get('minima', []):
-        if isinstance(entry, dict) and entry.get('raw_text'):
-            bib_texts.append(entry['raw_text'])
-    for entry in bibliography.get('complementaria', []):
-        if isinstance(entry, dict) and entry.get('raw_text'):
-            bib_texts.append(entry['raw_text'])
-
-    if bib_texts:
-        parts.append(f"Bibliografía: {' '.join(bib_texts[:5])}")  # Primeras 5 entradas
-
-    return ' '.join(parts)
+def save_index(output_dir, name, texts, embeddings, metadata, ann=None):
+    """Publica el índice, precalculando los tokens de cada texto para armar el contexto del chat"""
+    metadata = dict(metadata, n_tokens=tokens.count_tokens(texts, GPT_MODEL))
+    return index_store.save_index(output_dir, name, texts, embeddings, metadata=metadata,
+                                  model=EMBEDDING_MODEL,
+                                  tokenizer=tokens.encoding_for_model(GPT_MODEL).name,
+                                  ann=ann)
 
 
-def create_embeddings_csv():
-    """Crea CSV de embeddings compatible con tu sistema existente"""
+def content_hash(text):
+    """Hash del texto que se envía a la API: si no cambia, su embedding tampoco"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def load_previous_embeddings():
+    """Vectores del índice (o CSV) anterior por hash de contenido, y sus códigos de curso"""
+    manifest = index_store.manifest_path(DATA_DIR, INDEX_NAME)
+    try:
+        if manifest.exists():
+            previous = index_store.load_index(manifest)
+            if previous.model != EMBEDDING_MODEL:
+                print(f"⚠️ El índice anterior usa {previous.model}; se re-embeben todos los cursos")
+                return {}, set()
+            texts, embeddings, metadata = previous.texts, previous.matrix, previous.metadata
+        elif CSV_PATH.exists():
+            texts, embeddings, metadata = index_store.read_embeddings_csv(CSV_PATH)
+        else:
+            return {}, set()
+    except (OSError, ValueError) as e:
+        print(f"⚠️ No se pudo leer el índice anterior ({e}); se re-embeben todos los cursos")
+        return {}, set()
+
+    hashes = metadata.get('content_hash') or [content_hash(text) for text in texts]
+    vectors = {h: np.array(vector, dtype=np.float32) for h, vector in zip(hashes, embeddings)}
+    return vectors, set(metadata.get('course_code', []))
+
+
+class EmbeddingError(Exception):
+    pass
+
+
+def truncate_to_tokens(text, max_tokens=MAX_INPUT_TOKENS):
+    """Recorta un texto al máximo de tokens que acepta el modelo de embeddings"""
+    encoding = tokens.encoding_for_model(EMBEDDING_MODEL)
+    ids = encoding.encode(text)
+    if len(ids) <= max_tokens:
+        return text
+    print(f"⚠️ Texto de {len(ids)} tokens recortado a {max_tokens} para el embedding")
+    return encoding.decode(ids[:max_tokens])
+
+
+def make_batches(items, max_items=MAX_BATCH_ITEMS, max_tokens=MAX_BATCH_TOKENS):
+    """Agrupa (hash, texto) en batches limitados por cantidad de textos y de tokens.
+
+    Los textos se recortan antes de contar, así los tokens de cada batch son
+    los que efectivamente se envían.
+    """
+    items = [(h, truncate_to_tokens(text)) for h, text in items]
+    counts = tokens.count_tokens([text for _, text in items], EMBEDDING_MODEL)
+    batches, batch, batch_tokens = [], [], 0
+    for item, n in zip(items, counts):
+        if batch and (len(batch) >= max_items or batch_tokens + n > max_tokens):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(item)
+        batch_tokens += n
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def load_checkpoint(path=CHECKPOINT_PATH):
+    """Vectores ya creados por una ejecución anterior que no alcanzó a publicar el índice"""
+    vectors = {}
+    if not path.exists():
+        return vectors
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Línea incompleta si la ejecución se interrumpió escribiendo
+            if entry.get('model') == EMBEDDING_MODEL:
+                vectors[entry['hash']] = np.array(entry['embedding'], dtype=np.float32)
+    return vectors
+
+
+def embed_batch(batch, max_retries=MAX_RETRIES):
+    """Embebe un batch (ya recortado por make_batches), reintentando los errores transitorios con backoff"""
+    inputs = [text for _, text in batch]
+    for attempt in range(max_retries + 1):
+        try:
+            response = openai.Embedding.create(
+                model=EMBEDDING_MODEL,
+                input=inputs
+            )
+            vectors = [np.array(item['embedding'], dtype=np.float32)
+                       for item in sorted(response['data'], key=lambda item: item['index'])]
+            if len(vectors) != len(batch) or any(not np.isfinite(v).all() or not v.any() for v in vectors):
+                raise EmbeddingError("respuesta con vectores vacíos o inválidos")
+            return vectors
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"   ⚠️ Error en batch ({e}); reintento {attempt + 1}/{max_retries} en {delay:.1f}s")
+            time.sleep(delay)
+
+
+def embed_texts(items, checkpoint_path=CHECKPOINT_PATH, concurrency=EMBEDDING_CONCURRENCY):
+    """Crea los embeddings de (hash, texto) enviando varios batches en paralelo.
+
+    Cada batch terminado se agrega al checkpoint, así una ejecución
+    interrumpida o con batches fallidos retoma donde quedó. Si algún batch
+    falla tras los reintentos se lanza EmbeddingError: nunca se guardan
+    vectores vacíos.
+    """
+    vectors = {}
+    if not items:
+        return vectors
+    batches = make_batches(items)
+    failed = []
+
+    with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(embed_batch, batch): batch for batch in batches}
+        for done, future in enumerate(as_completed(futures), start=1):
+            batch = futures[future]
+            try:
+                batch_vectors = future.result()
+            except RETRYABLE_ERRORS + (EmbeddingError,) as e:
+                print(f"❌ Batch {done}/{len(batches)} falló: {e}")
+                failed.extend(h for h, _ in batch)
+                continue
+            except Exception:
+                # Error permanente: los demás batches fallarían igual
+                for pending in futures:
+                    pending.cancel()
+                raise
+            # Solo este hilo escribe en vectors y en el checkpoint
+            for (h, _), vector in zip(batch, batch_vectors):
+                vectors[h] = vector
+                checkpoint.write(json.dumps({'hash': h, 'model': EMBEDDING_MODEL,
+                                             'embedding': vector.tolist()}) + '\n')
+            checkpoint.flush()
+            print(f"   Batch {done}/{len(batches)} listo ({len(batch)} textos)")
+
+    if failed:
+        raise EmbeddingError(
+            f"{len(failed)} textos sin embedding; vuelve a ejecutar el script para reintentar solo esos "
+            f"(checkpoint en {checkpoint_path})"
+        )
+    return vectors
+
+
+def create_embeddings_index(export_csv: bool = False, full: bool = False, chunking: str = 'course', ann=None):
+    """Crea el índice binario de embeddings (y opcionalmente el CSV compatible con tu sistema).
+
+    Solo se envían a la API los cursos nuevos o cuyo texto cambió; el resto
+    reutiliza el vector del índice anterior (salvo con full=True).
+    Con chunking='section' cada sección del curso es un texto, etiquetado con
+    su course_code y section para que el chat pueda reagruparlas por curso.
+    ann (p. ej. {"type": "ivf", "nprobe": 8}) construye además un índice
+    aproximado para corpus grandes (ver plataforma/ann.py).
+    """
     print("🔄 Cargando datos MIA...")
     courses_data = load_mia_data()
 
-    # Procesar cursos
+    # Procesar cursos (un texto por curso, o uno por sección)
     texts = []
     course_codes = []
+    sections = []
+    fields = {column: [] for column in COURSE_FIELDS}
 
     for course_code, course_info in courses_data.items():
         text = process_course_to_text(course_code, course_info)
-        if len(text.strip()) > 50:  # Solo textos con contenido
-            texts.append(text)
+        if len(text.strip()) <= 50:  # Solo textos con contenido
+            continue
+        if chunking == 'section':
+            chunks = process_course_to_chunks(course_code, course_info)
+        else:
+            chunks = [(None, text)]
+        course_fields = course_metadata_fields(course_info)
+        for section, chunk in chunks:
+            texts.append(chunk)
             course_codes.append(course_code)
+            sections.append(section)
+            for column in COURSE_FIELDS:
+                fields[column].append(course_fields[column])
+
+    print(f"📚 Procesados {len(set(course_codes))} cursos ({len(texts)} textos, chunking por {CHUNKING_LABELS[chunking]})")
+
+    hashes = [content_hash(text) for text in texts]
+    previous_vectors, previous_codes = ({}, set()) if full else load_previous_embeddings()
+
+    # Crear embeddings solo para textos nuevos o modificados (retomando un checkpoint si existe)
+    checkpoint_vectors = load_checkpoint(CHECKPOINT_PATH)
+    pending = sorted({h: text for h, text in zip(hashes, texts) if h not in previous_vectors}.items())
+    missing = [(h, text) for h, text in pending if h not in checkpoint_vectors]
+    if len(missing) < len(pending):
+        print(f"♻️ {len(pending) - len(missing)} embeddings recuperados del checkpoint")
+    print(f"🧠 Creando embeddings para {len(missing)} textos nuevos o modificados...")
+    new_vectors = {**checkpoint_vectors, **embed_texts(missing, CHECKPOINT_PATH)}
+
+    embeddings = [previous_vectors[h] if h in previous_vectors else new_vectors[h] for h in hashes]
+    reused = sum(1 for h in hashes if h in previous_vectors)
+    removed = len(previous_codes - set(course_codes))
+
+    metadata = {'course_code': course_codes, 'content_hash': hashes, **fields}
+    if chunking == 'section':
+        metadata['section'] = sections
+
+    # Índice binario: vectores float32 memory-mapped + manifiesto JSON (con tokens por texto)
+    output_path = save_index(DATA_DIR, INDEX_NAME, texts, embeddings, metadata, ann=ann)
+    print(f"✅ Índice guardado en: {output_path}")
+    if ann:
+        print_ann_report(output_path)
+
+    if export_csv:
+        # Guardar también en el formato CSV original
+        index_store.write_embeddings_csv(CSV_PATH, texts, embeddings, metadata=metadata)
+        print(f"✅ Embeddings CSV guardados en: {CSV_PATH}")
+
+    # El índice ya está publicado: el checkpoint no se necesita más
+    CHECKPOINT_PATH.unlink(missing_ok=True)
+
+    recovered = len(pending) - len(missing)
+    print(f"📊 Total: {len(texts)} textos ({reused} reutilizados, {len(missing)} embebidos con la API, "
+          f"{recovered} recuperados del checkpoint, {removed} cursos eliminados)")
 
-    print(f"📚 Procesados {len(texts)} cursos")
-
-    # Crear embeddings
-    print("🧠 Creando embeddings...")
-    embeddings = []
-
-    batch_size = 100
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i + batch_size]
-        print(f"   Procesando batch {i // batch_size + 1}/{(len(texts) - 1) // batch_size + 1}")
-
-        try:
-            response = openai.Embedding.create(
-                model=EMBEDDING_MODEL,
-                input=batch
-            )
+    return output_path
 
-            batch_embeddings = [item['embedding'] for item in response['data']]
-            embeddings.extend(batch_embeddings)
 
-        except Exception as e:
-            print(f"❌ Error en batch: {e}")
-            # Embeddings vacíos para este batch
-            embeddings.extend([[0.0] * 1536] * len(batch))
+def create_embeddings_csv():
+    """Crea el índice y además el CSV de embeddings compatible con tu sistema existente"""
+    return create_embeddings_index(export_csv=True)
 
-    # Crear DataFrame compatible con tu formato original
-    df = pd.DataFrame({
-        'text': texts,
-        'embedding': embeddings,
-        'course_code': course_codes
-    })
 
-    # Guardar en formato compatible
-    output_path = Path("plataforma/mia_data/mia_embeddings.csv")
-    df.to_csv(output_path, index=False)
+def convert_csv_to_index(csv_path, name=INDEX_NAME, output_dir=DATA_DIR, ann=None):
+    """Importa un CSV de embeddings existente al formato de índice binario (sin llamar a la API)"""
+    texts, embeddings, metadata = index_store.read_embeddings_csv(csv_path)
+    output_path = save_index(output_dir, name, texts, embeddings, metadata, ann=ann)
+    print(f"✅ {len(texts)} embeddings importados desde {csv_path} a {output_path}")
+    if ann:
+        print_ann_report(output_path)
+    return output_path
 
-    print(f"✅ Embeddings guardados en: {output_path}")
-    print(f"📊 Total: {len(df)} cursos")
 
-    return output_path
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generador de embeddings MIA UC")
+    parser.add_argument("--csv", action="store_true",
+                        help=f"Exporta también {CSV_PATH} en el formato CSV original")
+    parser.add_argument("--full", action="store_true",
+                        help="Re-embebe todos los cursos, sin reutilizar vectores del índice anterior")
+    parser.add_argument("--chunking", choices=sorted(CHUNKING_LABELS), default="course",
+                        help="Un texto por curso completo (course) o uno por sección del programa (section)")
+    parser.add_argument("--ann", choices=sorted(ANN_TYPES),
+                        help="Primera etapa aproximada: índice IVF, copia float16/int8 de los vectores o "
+                             "vectores reducidos con PCA, con re-ranking exacto de los mejores candidatos")
+    parser.add_argument("--nlist", type=int, help="Listas del índice IVF (por defecto 4·√n)")
+    parser.add_argument("--nprobe", type=int, help="Listas revisadas por consulta en el índice IVF")
+    parser.add_argument("--pca-dim", type=int, help="pca: dimensión de los vectores reducidos (por defecto 128)")
+    parser.add_argument("--rescore", type=int,
+                        help="float16/int8: candidatos re-evaluados en float32, como múltiplo de top_n (por defecto 4)")
+    parser.add_argument("--from-csv", metavar="PATH",
+                        help="Convierte un CSV de embeddings existente al índice binario, sin llamar a OpenAI")
+    parser.add_argument("--name", default=INDEX_NAME, help="Nombre del índice (para --from-csv)")
+    parser.add_argument("--output-dir", default=str(DATA_DIR), help="Directorio del índice (para --from-csv)")
+    return parser.parse_args()
+
+
+def ann_options(args):
+    """Parámetros del índice aproximado pedidos por línea de comandos"""
+    if not args.ann:
+        return None
+    options = {"type": args.ann}
+    if args.nlist:
+        options["nlist"] = args.nlist
+    if args.nprobe:
+        options["nprobe"] = args.nprobe
+    if args.pca_dim:
+        options["dim"] = args.pca_dim
+    if args.rescore:
+        options["rescore"] = args.rescore
+    return options
+
+
+def print_ann_report(index_path, k=10):
+    """Recall@k del índice aproximado frente a la búsqueda exacta (y memoria, si está cuantizado)"""
+    index = index_store.load_index(index_path)
+    if index.ann is None:
+        return
+    print(f"📏 Índice aproximado '{index.ann.kind}' comparado con búsqueda exacta en float32:")
+    for key, value in evaluate_ann(index, k=k).items():
+        print(f"   {key}: {value:.4g}" if isinstance(value, float) else f"   {key}: {value}")
+
+    if index.ann.kind == 'pca':
+        # Para elegir la dimensión con evidencia: varianza y recall en otras dimensiones
+        print("📐 PCA por dimensión:")
+        print(f"   {'dim':>6}{'varianza':>10}{'recall reducido':>17}{'recall re-rankeado':>20}")
+        for row in pca_sweep(np.asarray(index.matrix), PCA_SWEEP_DIMS + (index.ann.dim,), k=k,
+                             rescore=index.ann.rescore):
+            print(f"   {row['dim']:>6}{row['variance_kept']:>10.3f}{row[f'recall@{k}_reduced']:>17.3f}"
+                  f"{row[f'recall@{k}_reranked']:>20.3f}")
 
 
 if __name__ == "__main__":
+    args = parse_args()
     print("=== Generador de Embeddings MIA UC ===")
 
+    if args.from_csv:
+        convert_csv_to_index(args.from_csv, name=args.name, output_dir=args.output_dir, ann=ann_options(args))
+        exit(0)
+
     # Debug de variables de entorno
     print(f"🔍 OPENAI_API_KEY configurada: {'✅ Sí' if os.getenv('OPENAI_API_KEY') else '❌ No'}")
     print(f"🔍 OPENAI_ORG configurada: {'✅ Sí' if os.getenv('OPENAI_ORG') else '❌ No'}")
@@ -214,7 +408,8 @@ if __name__ == "__main__":
         exit(1)
 
     try:
-        create_embeddings_csv()
+        create_embeddings_index(export_csv=args.csv, full=args.full, chunking=args.chunking,
+                                ann=ann_options(args))
         print("\n🎉 ¡Listo! Ahora puedes usar el chat MIA UC")
 
     except Exception as e:
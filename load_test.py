@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga del chat (capital_semilla_chat) sin gastar en OpenAI.
+
+Cada usuario virtual inicia sesión (GET + POST /login/) y envía preguntas del
+gold set (plataforma/mia_data/gold_questions.json) al chat en paralelo con los
+demás. Al final se reporta el throughput y la latencia p50/p95/p99 por
+endpoint (y el tiempo al primer token con --stream).
+
+Las llamadas a OpenAI las responde plataforma/fake_openai.py (RAG_FAKE_OPENAI=1),
+con latencia y tasa de errores configurables (RAG_FAKE_OPENAI_*). Sus embeddings
+se guardan en rag_cache_fake.sqlite3, nunca en el cache del servidor real.
+
+Los usuarios de prueba (carga{i}@example.com) se crean con la contraseña que
+se indique en --password, y solo con DEBUG = True.
+
+Ejemplos:
+    # En este mismo proceso, por la aplicación WSGI o ASGI del proyecto (sin servidor)
+    python load_test.py --inprocess wsgi --users 8 --requests 200 --password "$CLAVE"
+    python load_test.py --inprocess asgi --users 32 --requests 500 --stream --password "$CLAVE"
+
+    # Contra un servidor levantado con el sustituto de OpenAI
+    RAG_FAKE_OPENAI=1 gunicorn -w 4 --threads 8 luminousoceans_v0.wsgi
+    RAG_FAKE_OPENAI=1 uvicorn luminousoceans_v0.asgi:application --workers 2
+    python load_test.py --url http://127.0.0.1:8000 --create-users --password "$CLAVE" --users 16 --duration 60 --json carga.json
+"""
+
+import argparse
+import asyncio
+import http.client
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+
+HOST = "127.0.0.1"
+USER_EMAIL = "carga{}@example.com"
+CHAT_PATH = "/capital-semilla-chat/"
+LOGIN_PATH = "/login/"
+
+
+class Response:
+    def __init__(self, status, headers, body, first_token_s=None):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        # Segundos hasta el primer evento "token" de un stream SSE
+        self.first_token_s = first_token_s
+
+    def cookies(self) -> dict:
+        cookies = {}
+        for key, value in self.headers:
+            if key.lower() == "set-cookie":
+                name, _, rest = value.partition("=")
+                cookies[name.strip()] = rest.split(";", 1)[0]
+        return cookies
+
+
+def _first_token(started, chunk, seen):
+    if seen is None and b"event: token" in chunk:
+        return time.perf_counter() - started
+    return seen
+
+
+class HTTPTransport:
+    """Peticiones HTTP reales contra un servidor (una conexión keep-alive por usuario)"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.local = threading.local()
+
+    def request(self, method, path, headers, body=b""):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=120)
+        started = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self.local.connection = None
+            raise
+        chunks, first_token = [], None
+        while chunk := response.read1(65536):
+            first_token = _first_token(started, chunk, first_token)
+            chunks.append(chunk)
+        return Response(response.status, response.getheaders(), b"".join(chunks), first_token)
+
+
+def _environ(method, path, headers, body):
+    environ = {
+        "REQUEST_METHOD": method, "PATH_INFO": path, "QUERY_STRING": "", "SCRIPT_NAME": "",
+        "SERVER_NAME": HOST, "SERVER_PORT": "80", "SERVER_PROTOCOL": "HTTP/1.1", "REMOTE_ADDR": HOST,
+        "CONTENT_LENGTH": str(len(body)), "wsgi.input": io.BytesIO(body), "wsgi.errors": sys.stderr,
+        "wsgi.url_scheme": "http", "wsgi.version": (1, 0), "wsgi.multithread": True,
+        "wsgi.multiprocess": False, "wsgi.run_once": False,
+    }
+    for key, value in headers.items():
+        if key.lower() == "content-type":
+            environ["CONTENT_TYPE"] = value
+        else:
+            environ["HTTP_" + key.upper().replace("-", "_")] = value
+    return environ
+
+
+class WSGITransport:
+    """Llama directamente a luminousoceans_v0.wsgi.application (como un servidor WSGI con hilos)"""
+
+    def __init__(self):
+        from luminousoceans_v0.wsgi import application
+        self.application = application
+
+    def request(self, method, path, headers, body=b""):
+        status_headers = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            status_headers["status"] = int(status.split()[0])
+            status_headers["headers"] = response_headers
+
+        started = time.perf_counter()
+        result = self.application(_environ(method, path, {"Host": HOST, **headers}, body), start_response)
+        chunks, first_token = [], None
+        try:
+            for chunk in result:
+                first_token = _first_token(started, chunk, first_token)
+                chunks.append(chunk)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return Response(status_headers["status"], status_headers["headers"], b"".join(chunks), first_token)
+
+
+class ASGITransport:
+    """Llama a luminousoceans_v0.asgi.application en un único event loop (como uvicorn)"""
+
+    def __init__(self):
+        from luminousoceans_v0.asgi import application
+        self.application = application
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    async def _call(self, method, path, headers, body):
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+            "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+            "headers": [(key.lower().encode(), value.encode()) for key, value in {"Host": HOST, **headers}.items()],
+            "client": (HOST, 50000), "server": (HOST, 80),
+        }
+        finished = asyncio.Event()
+        response = {"chunks": [], "first_token": None}
+        started = time.perf_counter()
+        sent_body = False
+
+        async def receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # Como uvicorn: la desconexión se informa cuando la respuesta terminó
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [(k.decode(), v.decode()) for k, v in message.get("headers", [])]
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                response["first_token"] = _first_token(started, chunk, response["first_token"])
+                response["chunks"].append(chunk)
+                if not message.get("more_body", False):
+                    finished.set()
+
+        await self.application(scope, receive, send)
+        return Response(response["status"], response["headers"], b"".join(response["chunks"]),
+                        response["first_token"])
+
+    def request(self, method, path, headers, body=b""):
+        return asyncio.run_coroutine_threadsafe(self._call(method, path, headers, body), self.loop).result()
+
+
+class VirtualUser:
+    """Un usuario con su propia sesión (cookies)"""
+
+    def __init__(self, transport, email, password):
+        self.transport = transport
+        self.email = email
+        self.password = password
+        self.cookies = {}
+
+    def request(self, method, path, data=None):
+        headers = {}
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{name}={value}" for name, value in self.cookies.items())
+        body = b""
+        if data is not None:
+            body = urlencode(data).encode()
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        response = self.transport.request(method, path, headers, body)
+        self.cookies.update(response.cookies())
+        return response
+
+    def login(self):
+        self.request("GET", LOGIN_PATH)
+        response = self.request("POST", LOGIN_PATH, {
+            "mail": self.email, "password": self.password,
+            "csrfmiddlewaretoken": self.cookies.get("csrftoken", ""),
+        })
+        return response.status == 302 and "sessionid" in self.cookies
+
+
+def chat_ok(response, stream):
+    if response.status != 200:
+        return False
+    if stream:
+        return b"event: done" in response.body
+    answer = json.loads(response.body).get("response", "")
+    return bool(answer) and not answer.startswith("Usuario no autenticado")
+
+
+def ensure_users(count, password):
+    """Crea (o actualiza la contraseña de) los usuarios de prueba carga{i}@example.com"""
+    from django.conf import settings
+    from django.db.utils import OperationalError
+    from profiles.models import CustomUser, Profile
+
+    if not settings.DEBUG:
+        raise SystemExit("❌ Los usuarios de prueba solo se crean con DEBUG = True (base de datos de desarrollo)")
+    try:
+        for i in range(count):
+            user, _ = CustomUser.objects.get_or_create(username=USER_EMAIL.format(i), defaults={"email": USER_EMAIL.format(i)})
+            user.set_password(password)
+            user.save()
+            Profile.objects.get_or_create(user=user, defaults={"name": f"Carga {i}"})
+    except OperationalError as e:
+        raise SystemExit(f"❌ La base de datos no está lista ({e}); ejecuta python manage.py migrate")
+
+
+def percentiles(values) -> dict:
+    if not values:
+        return {"n": 0}
+    values = np.asarray(values) * 1000
+    return {"n": len(values), "p50_ms": float(np.percentile(values, 50)), "p95_ms": float(np.percentile(values, 95)),
+            "p99_ms": float(np.percentile(values, 99)), "max_ms": float(values.max())}
+
+
+def run_load(transport, args, questions):
+    endpoint = "chat_stream" if args.stream else "chat"
+    samples = {"login": [], endpoint: []}
+    errors = {"login": 0, endpoint: 0}
+    first_tokens = []
+    lock = threading.Lock()
+    counter = iter(range(sys.maxsize))
+    deadline = None
+
+    def record(name, elapsed, ok, first_token=None):
+        with lock:
+            samples[name].append(elapsed)
+            errors[name] += not ok
+            if first_token is not None:
+                first_tokens.append(first_token)
+
+    def worker(i):
+        user = VirtualUser(transport, USER_EMAIL.format(i), args.password)
+        started = time.perf_counter()
+        logged_in = user.login()
+        record("login", time.perf_counter() - started, logged_in)
+        if not logged_in:
+            return
+        while True:
+            with lock:
+                n = next(counter)
+            if (args.requests and n >= args.requests) or (deadline and time.perf_counter() > deadline):
+                return
+            query = questions[n % len(questions)]
+            if args.unique:
+                # Evita los caches de embeddings y respuestas
+                query = f"{query} (consulta {n})"
+            data = {"query": query, **({"stream": "1"} if args.stream else {})}
+            started = time.perf_counter()
+            try:
+                response = user.request("POST", CHAT_PATH, data)
+                ok = chat_ok(response, args.stream)
+                first_token = response.first_token_s
+            except Exception:
+                ok, first_token = False, None
+            record(endpoint, time.perf_counter() - started, ok, first_token)
+
+    started = time.perf_counter()
+    if args.duration:
+        deadline = started + args.duration
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(worker, range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    results = {"users": args.users, "stream": args.stream, "elapsed_s": elapsed, "endpoints": {}}
+    for name, values in samples.items():
+        results["endpoints"][name] = {
+            "requests": len(values), "errors": errors[name],
+            "throughput_rps": len(values) / elapsed if elapsed else 0.0,
+            "latency": percentiles(values),
+        }
+    if args.stream:
+        results["endpoints"][endpoint]["first_token"] = percentiles(first_tokens)
+    return results
+
+
+def print_report(results):
+    print(f"\n⏱️ {results['elapsed_s']:.1f}s con {results['users']} usuarios concurrentes")
+    print(f"{'endpoint':<20}{'n':>6}{'errores':>9}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = []
+    for name, endpoint in results["endpoints"].items():
+        rows.append((name, endpoint, endpoint["latency"]))
+        if "first_token" in endpoint:
+            rows.append((f"{name} (1er)", endpoint, endpoint["first_token"]))
+    for name, endpoint, latency in rows:
+        if latency["n"]:
+            print(f"{name:<20}{endpoint['requests']:>6}{endpoint['errors']:>9}{endpoint['throughput_rps']:>9.1f}"
+                  f"{latency['p50_ms']:>10.1f}{latency['p95_ms']:>10.1f}{latency['p99_ms']:>10.1f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Prueba de carga del chat con un sustituto local de OpenAI")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Servidor a probar, p. ej. http://127.0.0.1:8000")
+    target.add_argument("--inprocess", choices=("wsgi", "asgi"), help="Llamar a la aplicación en este proceso")
+    parser.add_argument("--users", type=int, default=8, help="Usuarios concurrentes")
+    parser.add_argument("--requests", type=int, default=100, help="Total de preguntas (0: sin límite)")
+    parser.add_argument("--duration", type=float, help="Segundos de prueba (además de --requests)")
+    parser.add_argument("--stream", action="store_true", help="Pedir respuestas en streaming (SSE)")
+    parser.add_argument("--unique", action="store_true", help="Preguntas distintas en cada petición (sin caches)")
+    parser.add_argument("--create-users", action="store_true", help="Crear los usuarios de prueba en la base de datos")
+    parser.add_argument("--password", required=True, help="Contraseña de los usuarios de prueba")
+    parser.add_argument("--json", metavar="PATH", help="Guarda los resultados en un archivo JSON")
+    args = parser.parse_args()
+    if not args.requests and not args.duration:
+        parser.error("indica --requests o --duration")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "luminousoceans_v0.settings")
+    if args.inprocess:
+        # La aplicación corre en este proceso: se activa aquí el sustituto de OpenAI
+        os.environ["RAG_FAKE_OPENAI"] = "1"
+
+    import django
+    django.setup()
+    from plataforma.evaluation import load_gold
+
+    print("=== Prueba de carga del chat ===")
+    if args.inprocess or args.create_users:
+        ensure_users(args.users, args.password)
+    if args.inprocess == "wsgi":
+        transport = WSGITransport()
+    elif args.inprocess == "asgi":
+        transport = ASGITransport()
+    else:
+        transport = HTTPTransport(args.url)
+    print(f"🎯 {args.url or f'{args.inprocess.upper()} en este proceso'}; "
+          f"{'stream' if args.stream else 'JSON'}, {args.users} usuarios")
+
+    results = run_load(transport, args, [item["question"] for item in load_gold()])
+    results["target"] = args.url or args.inprocess
+    print_report(results)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"\n✅ Resultados guardados en: {args.json}")
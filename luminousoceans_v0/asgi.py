@@ -7,10 +7,60 @@ For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
 
+import asyncio
 import os
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'luminousoceans_v0.settings')
 
-application = get_asgi_application()
+
+class CancelOnDisconnect:
+    """Cancel the request handler when the client disconnects.
+
+    Django 4.2 stops listening to the ASGI channel once the request body has
+    been read, so an abandoned chat keeps waiting on OpenAI. This wrapper keeps
+    listening and cancels the handler task on ``http.disconnect``; the
+    CancelledError propagates into the view (or its streaming generator) and
+    closes the upstream call.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        body_received = asyncio.Event()
+        disconnected = False
+
+        async def app_receive():
+            message = await receive()
+            if message['type'] != 'http.request' or not message.get('more_body', False):
+                body_received.set()
+            return message
+
+        app_task = asyncio.ensure_future(self.app(scope, app_receive, send))
+
+        async def watch_disconnect():
+            nonlocal disconnected
+            await body_received.wait()
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    disconnected = True
+                    app_task.cancel()
+                    return
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            await app_task
+        except asyncio.CancelledError:
+            if not disconnected:
+                raise
+        finally:
+            watcher.cancel()
+
+
+application = CancelOnDisconnect(get_asgi_application())
@@ -44,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primero, para que el total de Server-Timing incluya a los demás middlewares
+    'plataforma.middleware.server_timing_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -129,3 +131,69 @@ STATICFILES_DIRS = [
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Chat RAG (plataforma)
+
+# Cargar el índice de embeddings al iniciar cada worker (si es False, se carga en la primera pregunta)
+RAG_PRELOAD_INDEX = os.getenv('RAG_PRELOAD_INDEX', '0') == '1'
+# Cada cuántos segundos revisar si se publicó una nueva versión del índice
+RAG_INDEX_CHECK_INTERVAL = 2.0
+# Corpus que usa el chat si la petición no indica otro (los corpus se definen en
+# RAG_CORPORA; por defecto plataforma.index_registry.DEFAULT_CORPORA: mia y sercotec)
+RAG_DEFAULT_CORPUS = 'mia'
+# Bytes de vectores que pueden estar cargados entre todos los corpus (None: sin límite);
+# al superarlo se descargan los corpus usados hace más tiempo
+RAG_INDEX_MEMORY_BUDGET = None
+# Al precargar, registrar en el log el tamaño del índice y cuánto está residente/compartido (sin leer sus páginas)
+RAG_INDEX_SELF_CHECK = True
+
+# Sustituto local de OpenAI (plataforma/fake_openai.py) para pruebas de carga sin costo ni límites de tasa.
+# Latencias en segundos; ERROR_RATE es la fracción de llamadas que fallan con RateLimitError
+RAG_FAKE_OPENAI = os.getenv('RAG_FAKE_OPENAI', '0') == '1'
+RAG_FAKE_OPENAI_OPTIONS = {
+    'embedding_latency': float(os.getenv('RAG_FAKE_OPENAI_EMBEDDING_LATENCY', '0.05')),
+    'chat_latency': float(os.getenv('RAG_FAKE_OPENAI_CHAT_LATENCY', '0.5')),
+    'token_latency': float(os.getenv('RAG_FAKE_OPENAI_TOKEN_LATENCY', '0.01')),
+    'error_rate': float(os.getenv('RAG_FAKE_OPENAI_ERROR_RATE', '0')),
+}
+
+# Cache de embeddings de preguntas: entradas en memoria por worker y archivo SQLite compartido (None lo desactiva)
+# con a lo más RAG_EMBEDDING_CACHE_MAX_ROWS filas (se borran las usadas hace más tiempo).
+# Con el sustituto de OpenAI se usa otro archivo: sus vectores no deben llegar nunca a un servidor real
+RAG_EMBEDDING_CACHE_SIZE = 1024
+RAG_EMBEDDING_CACHE_PATH = BASE_DIR / ('rag_cache_fake.sqlite3' if RAG_FAKE_OPENAI else 'rag_cache.sqlite3')
+RAG_EMBEDDING_CACHE_MAX_ROWS = 100_000
+
+# Las consultas que llegan dentro de la ventana (ms) se embeben juntas en una llamada a la API (0 lo desactiva);
+# una consulta sola, sin otras en curso, se envía sin esperar. Textos por llamada y llamadas en curso por worker
+RAG_EMBEDDING_BATCH_WINDOW_MS = 5
+RAG_EMBEDDING_BATCH_SIZE = 100
+RAG_EMBEDDING_BATCH_CONCURRENCY = 4
+
+# Cache semántico de respuestas: similitud coseno mínima, vigencia (segundos) y tamaño (0 lo desactiva)
+RAG_ANSWER_CACHE_THRESHOLD = 0.97
+RAG_ANSWER_CACHE_TTL = 60 * 60
+RAG_ANSWER_CACHE_SIZE = 256
+
+# Historia de las conversaciones (en la base de datos): tokens de la ventana de turnos recientes, del resumen
+# de los anteriores y conversaciones en memoria por worker
+RAG_HISTORY_TOKEN_BUDGET = 1000
+RAG_HISTORY_SUMMARY_BUDGET = 200
+RAG_CONVERSATION_CACHE_SIZE = 1000
+# Segundos que un worker usa la ventana en memoria sin verificar en la base de datos si otro agregó turnos
+# (0: verificar en cada pregunta). Guardar un turno siempre parte de los turnos ya guardados
+RAG_CONVERSATION_CHECK_INTERVAL = 1.0
+# Días sin actividad tras los que python manage.py prune_conversations borra una conversación
+RAG_CONVERSATION_RETENTION_DAYS = 30
+
+# Preguntas idénticas que llegan mientras otra se está respondiendo esperan esa respuesta (por proceso). Con
+# RAG_SINGLE_FLIGHT_DB también entre workers, con una tabla de locks en la base de datos (segundos de vigencia)
+RAG_SINGLE_FLIGHT = True
+RAG_SINGLE_FLIGHT_DB = os.getenv('RAG_SINGLE_FLIGHT_DB', '0') == '1'
+RAG_SINGLE_FLIGHT_LOCK_TTL = 120
+
+# /metrics/ (latencias por etapa, aciertos de los caches, tokens): desactivado fuera de DEBUG salvo RAG_METRICS_ENABLED=1.
+# Solo responde a estas IP (REMOTE_ADDR; detrás de un proxy es la del proxy) o a usuarios staff
+RAG_METRICS_ENABLED = os.getenv('RAG_METRICS_ENABLED', '1' if DEBUG else '0') == '1'
+RAG_METRICS_ALLOWED_IPS = [ip for ip in os.getenv('RAG_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip]
@@ -17,7 +17,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import re_path, path
 from .views import home, login_view, register_view, user_profile
-from plataforma.views import semilla, capital_semilla_chat
+from plataforma.views import semilla, capital_semilla_chat, prometheus_metrics
 
 urlpatterns = [
     path('capital-semilla-chat/', capital_semilla_chat, name='capital-semilla-chat'),
@@ -26,5 +26,6 @@ urlpatterns = [
     path('login/', login_view, name='login'),
     path('register/', register_view, name='register'),
     path('user-profile/', user_profile, name='user-profile'),
+    path('metrics/', prometheus_metrics, name='metrics'),
     path('admin/', admin.site.urls),
 ]
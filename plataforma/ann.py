@@ -0,0 +1,395 @@
+"""
+Approximate nearest neighbour search for large indexes.
+
+An ANN structure is a first stage that returns candidate rows for a query;
+`VectorIndex.search` then scores only those candidates against the full
+vectors, so results keep the exact cosine scores and the same interface.
+
+- ``ivf``: inverted file. Rows are clustered with spherical k-means into
+  ``nlist`` lists; a query scans the ``nprobe`` lists whose centroids are
+  closest (and further lists while it has fewer than ``top_n`` candidates).
+  More probes give higher recall and higher latency.
+- ``float16`` / ``int8``: every row is scored on a quantized copy of the
+  matrix kept in memory (1/2 or 1/4 of float32) and the best
+  ``top_n * rescore`` are rescored at full precision. The float32 file stays
+  memory-mapped, so only the shortlisted rows are read from it. This saves
+  resident memory per worker, not scan time: NumPy widens the codes to
+  float32 block by block (int8 is close to float32 speed, float16 slower).
+- ``pca``: rows are projected onto their first ``dim`` principal components
+  (e.g. 128 of 1536); the shortlist is taken in the reduced space and
+  reranked with the full vectors.
+
+Structures are built by ``index_store.save_index(ann={...})`` and stored next
+to the vector file, one ``.npy`` per array, so they are memory-mapped too.
+"""
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from .retrieval import normalize_rows, top_k
+
+
+def spherical_kmeans(matrix: np.ndarray, k: int, n_iter: int = 10, seed: int = 0,
+                     sample_size: int = 100_000) -> np.ndarray:
+    """Unit-length centroids of `k` clusters of the (unit-length) rows of `matrix`.
+
+    Centroids are fitted on a random sample of at most `sample_size` rows.
+    """
+    rng = np.random.default_rng(seed)
+    n = matrix.shape[0]
+    sample = matrix if n <= sample_size else matrix[np.sort(rng.choice(n, sample_size, replace=False))]
+    sample = np.asarray(sample, dtype=np.float32)
+    k = min(k, sample.shape[0])
+    centroids = sample[rng.choice(sample.shape[0], k, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        clusters, starts = np.unique(assignment[order], return_index=True)
+        sums = np.zeros_like(centroids)
+        sums[clusters] = np.add.reduceat(sample[order], starts, axis=0)
+        empty = ~sums.any(axis=1)
+        if empty.any():
+            # Listas vacías: se reinician en filas al azar
+            sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def sample_queries(matrix: np.ndarray, n_queries: int = 200, noise: float = 0.3, seed: int = 1) -> np.ndarray:
+    """Synthetic queries close to random rows (like questions about a document)."""
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, matrix.shape[0], n_queries)
+    noise = noise * rng.standard_normal((n_queries, matrix.shape[1])).astype(np.float32) / np.sqrt(matrix.shape[1])
+    return normalize_rows(np.asarray(matrix[rows], dtype=np.float32) + noise)
+
+
+def recall(found, truth) -> float:
+    """Mean fraction of the true top-k rows that were found."""
+    return float(np.mean([len(np.intersect1d(a, b)) / max(1, len(b)) for a, b in zip(found, truth)]))
+
+
+def assign(matrix: np.ndarray, centroids: np.ndarray, batch_size: int = 65_536) -> np.ndarray:
+    """Index of the closest centroid of every row, in batches to bound memory."""
+    assignment = np.empty(matrix.shape[0], dtype=np.int32)
+    for start in range(0, matrix.shape[0], batch_size):
+        block = np.asarray(matrix[start:start + batch_size], dtype=np.float32)
+        assignment[start:start + batch_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignment
+
+
+class IVFIndex:
+    """Inverted file over spherical k-means clusters."""
+
+    kind = "ivf"
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray, nprobe: int = 8):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        # Filas ordenadas por lista: la lista i son order[offsets[i]:offsets[i + 1]]
+        self.order = np.asarray(order, dtype=np.intp)
+        self.offsets = np.asarray(offsets, dtype=np.intp)
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, nlist: int | None = None, nprobe: int | None = None,
+              n_iter: int = 10, seed: int = 0) -> "IVFIndex":
+        n = matrix.shape[0]
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(n)))
+        centroids = spherical_kmeans(matrix, nlist, n_iter=n_iter, seed=seed)
+        assignment = assign(matrix, centroids)
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=len(centroids)))])
+        if nprobe is None:
+            nprobe = max(1, len(centroids) // 16)
+        return cls(centroids, order, offsets, nprobe=nprobe)
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @property
+    def params(self) -> dict:
+        return {"nlist": self.nlist, "nprobe": self.nprobe}
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {"centroids": self.centroids, "order": self.order, "offsets": self.offsets}
+
+    @classmethod
+    def from_arrays(cls, arrays, params: dict) -> "IVFIndex":
+        return cls(arrays["centroids"], arrays["order"], arrays["offsets"], nprobe=params.get("nprobe", 8))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays().values())
+
+    def report(self, matrix, queries, truth, k) -> dict:
+        scanned = [len(self.candidates(query, k)) for query in queries]
+        return {"scanned_fraction": float(np.mean(scanned)) / matrix.shape[0]}
+
+    def candidates(self, query: np.ndarray, top_n: int, rows=None, nprobe: int | None = None) -> np.ndarray:
+        """Rows in the `nprobe` lists closest to the (unit-length) `query`.
+
+        Further lists are probed, closest first, until there are at least
+        `top_n` candidates (among `rows`, if given) or every list was probed.
+        """
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        ranked = top_k(self.centroids @ query, self.nlist)
+        allowed = None
+        if rows is not None:
+            allowed = np.zeros(len(self.order), dtype=bool)
+            allowed[rows] = True
+        found, count = [], 0
+        for probed, i in enumerate(ranked):
+            if probed >= nprobe and count >= top_n:
+                break
+            members = self.order[self.offsets[i]:self.offsets[i + 1]]
+            if allowed is not None:
+                members = members[allowed[members]]
+            found.append(members)
+            count += len(members)
+        return np.concatenate(found) if found else np.empty(0, dtype=np.intp)
+
+
+def blocked_scores(codes: np.ndarray, query: np.ndarray, rows=None, block_size: int = 256) -> np.ndarray:
+    """`codes @ query` in float32, converting `block_size` rows at a time.
+
+    NumPy has no low-precision mat-vec, so each block is widened into a small
+    reusable float32 buffer that stays in cache.
+    """
+    if rows is not None:
+        return codes[rows].astype(np.float32) @ query
+    scores = np.empty(codes.shape[0], dtype=np.float32)
+    buffer = np.empty((block_size, codes.shape[1]), dtype=np.float32)
+    for start in range(0, codes.shape[0], block_size):
+        block = codes[start:start + block_size]
+        widened = buffer[:block.shape[0]]
+        np.copyto(widened, block, casting="unsafe")
+        np.dot(widened, query, out=scores[start:start + block.shape[0]])
+    return scores
+
+
+class ShortlistScan(ABC):
+    """Scores every row approximately and shortlists ``top_n * rescore`` rows for exact rescoring."""
+
+    kind = None
+
+    def __init__(self, rescore: int = 4):
+        self.rescore = rescore
+
+    @property
+    def params(self) -> dict:
+        return {"rescore": self.rescore}
+
+    @abstractmethod
+    def approximate_scores(self, query: np.ndarray, rows=None) -> np.ndarray:
+        """Approximate score of every row (or of `rows`, in that order) against a unit-length `query`."""
+
+    @abstractmethod
+    def arrays(self) -> dict[str, np.ndarray]:
+        """Arrays to store next to the vector file, one ``.npy`` each."""
+
+    def candidates(self, query: np.ndarray, top_n: int, rows=None) -> np.ndarray:
+        scores = self.approximate_scores(query, rows=rows)
+        shortlist = top_k(scores, top_n * self.rescore)
+        return shortlist if rows is None else np.asarray(rows, dtype=np.intp)[shortlist]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays().values())
+
+    def report(self, matrix, queries, truth, k) -> dict:
+        approximate = [top_k(self.approximate_scores(query), k) for query in queries]
+        full_bytes = matrix.shape[0] * matrix.shape[1] * 4
+        return {
+            "memory_mb": self.nbytes / 2 ** 20,
+            "float32_mb": full_bytes / 2 ** 20,
+            f"recall@{k}_without_rescoring": recall(approximate, truth),
+            "top1_agreement_without_rescoring": float(np.mean([a[0] == b[0] for a, b in zip(approximate, truth)])),
+        }
+
+
+class Float16Scan(ShortlistScan):
+    """Shortlist on a float16 copy of the matrix."""
+
+    kind = "float16"
+
+    def __init__(self, codes: np.ndarray, rescore: int = 4):
+        super().__init__(rescore)
+        self.codes = np.asarray(codes, dtype=np.float16)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, rescore: int = 4) -> "Float16Scan":
+        return cls(np.asarray(matrix).astype(np.float16), rescore=rescore)
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {"codes": self.codes}
+
+    @classmethod
+    def from_arrays(cls, arrays, params: dict) -> "Float16Scan":
+        return cls(arrays["codes"], rescore=params.get("rescore", 4))
+
+    def approximate_scores(self, query: np.ndarray, rows=None) -> np.ndarray:
+        return blocked_scores(self.codes, query, rows=rows)
+
+
+class Int8Scan(ShortlistScan):
+    """Shortlist on an int8 scalar-quantized copy of the matrix.
+
+    Each dimension d is mapped linearly from [low_d, high_d] to [-128, 127], so
+    ``x ≈ (code + 128) * scale + low`` and a dot product with the query is
+    ``code · (scale * query) + (128 * scale + low) · query``.
+    """
+
+    kind = "int8"
+
+    def __init__(self, codes: np.ndarray, low: np.ndarray, scale: np.ndarray, rescore: int = 4):
+        super().__init__(rescore)
+        self.codes = np.asarray(codes, dtype=np.int8)
+        self.low = np.asarray(low, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, rescore: int = 4, block_size: int = 65_536) -> "Int8Scan":
+        low = np.min(matrix, axis=0).astype(np.float32)
+        scale = (np.max(matrix, axis=0) - low).astype(np.float32) / 255
+        scale[scale == 0] = 1.0
+        codes = np.empty(matrix.shape, dtype=np.int8)
+        for start in range(0, matrix.shape[0], block_size):
+            block = np.asarray(matrix[start:start + block_size], dtype=np.float32)
+            codes[start:start + block_size] = np.clip(np.rint((block - low) / scale) - 128, -128, 127)
+        return cls(codes, low, scale, rescore=rescore)
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {"codes": self.codes, "low": self.low, "scale": self.scale}
+
+    @classmethod
+    def from_arrays(cls, arrays, params: dict) -> "Int8Scan":
+        return cls(arrays["codes"], arrays["low"], arrays["scale"], rescore=params.get("rescore", 4))
+
+    def approximate_scores(self, query: np.ndarray, rows=None) -> np.ndarray:
+        offset = float((128 * self.scale + self.low) @ query)
+        return blocked_scores(self.codes, self.scale * query, rows=rows) + offset
+
+
+def fit_pca(matrix: np.ndarray, sample_size: int = 50_000, seed: int = 0):
+    """Mean, principal axes (rows) and variance of each axis, fitted on a sample of rows."""
+    rng = np.random.default_rng(seed)
+    n = matrix.shape[0]
+    sample = matrix if n <= sample_size else matrix[np.sort(rng.choice(n, sample_size, replace=False))]
+    sample = np.asarray(sample, dtype=np.float32)
+    mean = sample.mean(axis=0, dtype=np.float64)
+    centered = sample - mean.astype(np.float32)
+    if centered.shape[0] < centered.shape[1]:
+        _, singular_values, axes = np.linalg.svd(centered.astype(np.float64), full_matrices=False)
+        return mean.astype(np.float32), axes.astype(np.float32), singular_values ** 2
+    # Con muchas filas es más barato descomponer la covarianza (dim x dim)
+    variances, vectors = np.linalg.eigh((centered.T @ centered).astype(np.float64))
+    order = np.argsort(variances)[::-1]
+    return mean.astype(np.float32), vectors[:, order].T.astype(np.float32), np.clip(variances[order], 0, None)
+
+
+class PCAScan(ShortlistScan):
+    """Shortlist on vectors projected onto their first principal components."""
+
+    kind = "pca"
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray, reduced: np.ndarray,
+                 variance_kept: float, rescore: int = 4):
+        super().__init__(rescore)
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        self.reduced = np.ascontiguousarray(reduced, dtype=np.float32)
+        self.variance_kept = float(variance_kept)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, dim: int = 128, rescore: int = 4, block_size: int = 65_536) -> "PCAScan":
+        mean, axes, variances = fit_pca(matrix)
+        dim = min(dim, axes.shape[0])
+        components = axes[:dim]
+        reduced = np.empty((matrix.shape[0], dim), dtype=np.float32)
+        for start in range(0, matrix.shape[0], block_size):
+            block = np.asarray(matrix[start:start + block_size], dtype=np.float32)
+            reduced[start:start + block_size] = (block - mean) @ components.T
+        return cls(mean, components, reduced, variances[:dim].sum() / variances.sum(), rescore=rescore)
+
+    @property
+    def dim(self) -> int:
+        return self.components.shape[0]
+
+    @property
+    def params(self) -> dict:
+        return {"dim": self.dim, "rescore": self.rescore, "variance_kept": self.variance_kept}
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {"mean": self.mean, "components": self.components, "reduced": self.reduced}
+
+    @classmethod
+    def from_arrays(cls, arrays, params: dict) -> "PCAScan":
+        return cls(arrays["mean"], arrays["components"], arrays["reduced"],
+                   params.get("variance_kept", 0.0), rescore=params.get("rescore", 4))
+
+    def approximate_scores(self, query: np.ndarray, rows=None) -> np.ndarray:
+        # x ≈ mean + componentsᵀ·r  =>  x·q ≈ mean·q + r·(components·q)
+        reduced = self.reduced if rows is None else self.reduced[rows]
+        return reduced @ (self.components @ query) + float(self.mean @ query)
+
+
+def pca_sweep(matrix: np.ndarray, dims, k: int = 10, rescore: int = 4, n_queries: int = 200) -> list[dict]:
+    """Variance kept and recall@k (before and after reranking) for each reduced dimension."""
+    queries = sample_queries(matrix, n_queries)
+    truth = [top_k(matrix @ query, k) for query in queries]
+    mean, axes, variances = fit_pca(matrix)
+    results = []
+    for dim in sorted({min(dim, axes.shape[0]) for dim in dims}):
+        components = axes[:dim]
+        structure = PCAScan(mean, components, (np.asarray(matrix) - mean) @ components.T,
+                            variances[:dim].sum() / variances.sum(), rescore=rescore)
+        reduced_only = [top_k(structure.approximate_scores(query), k) for query in queries]
+        reranked = []
+        for query in queries:
+            candidates = structure.candidates(query, k)
+            reranked.append(candidates[top_k(matrix[candidates] @ query, k)])
+        results.append({
+            "dim": dim,
+            "variance_kept": structure.variance_kept,
+            f"recall@{k}_reduced": recall(reduced_only, truth),
+            f"recall@{k}_reranked": recall(reranked, truth),
+        })
+    return results
+
+
+ANN_TYPES = {
+    IVFIndex.kind: IVFIndex,
+    Float16Scan.kind: Float16Scan,
+    Int8Scan.kind: Int8Scan,
+    PCAScan.kind: PCAScan,
+}
+
+
+def build_ann(matrix: np.ndarray, type: str, **params):
+    """Build the ANN structure `type` (see ANN_TYPES) over a normalized matrix."""
+    if type not in ANN_TYPES:
+        raise ValueError(f"Unknown ANN type '{type}'. Options: {', '.join(ANN_TYPES)}")
+    return ANN_TYPES[type].build(matrix, **params)
+
+
+def load_ann(type: str, arrays, params: dict):
+    return ANN_TYPES[type].from_arrays(arrays, params)
+
+
+def evaluate(index, k: int = 10, n_queries: int = 200) -> dict:
+    """Compare `index` searches with its ANN structure against exact search.
+
+    Returns the structure parameters, recall@k of `index.search` and the
+    structure's own figures (memory, recall before rescoring, ...).
+    """
+    matrix = index.matrix
+    queries = sample_queries(matrix, n_queries)
+    truth = [index.search(query, k, exact=True)[0] for query in queries]
+    found = [index.search(query, k, exact=False)[0] for query in queries]
+    return {
+        "type": index.ann.kind,
+        **index.ann.params,
+        f"recall@{k}": recall(found, truth),
+        **index.ann.report(matrix, queries, truth, k),
+    }
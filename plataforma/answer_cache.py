@@ -0,0 +1,138 @@
+"""
+Semantic cache of chat answers keyed by query embedding.
+
+A cached answer is returned when a new question's embedding has cosine
+similarity >= ``threshold`` with a previously answered one and both were
+answered in the same ``scope`` (index version + chat model), so publishing a
+new index never serves answers built from the old one. Entries expire after
+``ttl`` seconds and the least recently used one is evicted when the cache is
+full. Embeddings are scored only against those of the same scope and
+dimension (one matrix each), so corpora embedded with different models can
+share the cache. Questions answered without an embedding (a course code
+resolved by the lexical index) are cached by their normalized text instead.
+"""
+import threading
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from .embedding_cache import normalize_query
+from .retrieval import normalize_rows
+
+
+@dataclass
+class CachedAnswer:
+    query: str
+    answer: str
+    scope: str
+    embedding: np.ndarray | None = field(repr=False)
+    # Texto normalizado de las preguntas cacheadas sin embedding
+    key: str | None = None
+    created_at: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+    hits: int = 0
+
+
+class SemanticAnswerCache:
+    def __init__(self, threshold: float = 0.97, ttl: float = 3600, max_entries: int = 256):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: list[CachedAnswer] = []
+        # (scope, dimensión) -> (entradas, matriz con sus embeddings)
+        self._groups: dict[tuple[str, int], tuple[list[CachedAnswer], np.ndarray]] = {}
+        # (scope, texto normalizado) -> entrada
+        self._keyed: dict[tuple[str, str], CachedAnswer] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _rebuild(self) -> None:
+        # Debe llamarse con _lock tomado
+        groups: dict[tuple[str, int], list[CachedAnswer]] = {}
+        self._keyed = {}
+        for entry in self._entries:
+            if entry.embedding is None:
+                self._keyed[entry.scope, entry.key] = entry
+                continue
+            groups.setdefault((entry.scope, entry.embedding.shape[0]), []).append(entry)
+        self._groups = {
+            key: (entries, np.vstack([entry.embedding for entry in entries])) for key, entries in groups.items()
+        }
+
+    def _expire(self, now: float) -> None:
+        alive = [entry for entry in self._entries if now - entry.created_at < self.ttl]
+        if len(alive) != len(self._entries):
+            self._entries = alive
+            self._rebuild()
+
+    def lookup(self, query_embedding, scope: str) -> CachedAnswer | None:
+        """Return the most similar cached answer in `scope`, if it clears the threshold."""
+        if self.max_entries <= 0:
+            return None
+        query = normalize_rows(query_embedding)[0]
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            best = None
+            group = self._groups.get((scope, query.shape[0]))
+            if group is not None:
+                entries, matrix = group
+                scores = matrix @ query
+                i = int(np.argmax(scores))
+                if scores[i] >= self.threshold:
+                    best = entries[i]
+            return self._record(best, now)
+
+    def lookup_text(self, query: str, scope: str) -> CachedAnswer | None:
+        """Return the answer cached in `scope` for the same normalized `query` (stored without an embedding)."""
+        if self.max_entries <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            return self._record(self._keyed.get((scope, normalize_query(query))), now)
+
+    def _record(self, best: CachedAnswer | None, now: float) -> CachedAnswer | None:
+        # Debe llamarse con _lock tomado
+        if best is None:
+            self.misses += 1
+            return None
+        best.last_used = now
+        best.hits += 1
+        self.hits += 1
+        return best
+
+    def store(self, query: str, query_embedding, answer: str, scope: str) -> None:
+        """Cache `answer`; with `query_embedding` None it is found by lookup_text() instead of lookup()."""
+        if self.max_entries <= 0:
+            return
+        if query_embedding is None:
+            entry = CachedAnswer(query=query, answer=answer, scope=scope, embedding=None, key=normalize_query(query))
+        else:
+            entry = CachedAnswer(query=query, answer=answer, scope=scope, embedding=normalize_rows(query_embedding)[0])
+        with self._lock:
+            self._expire(entry.created_at)
+            if entry.key is not None and (scope, entry.key) in self._keyed:
+                self._entries.remove(self._keyed[scope, entry.key])
+            if len(self._entries) >= self.max_entries:
+                oldest = min(range(len(self._entries)), key=lambda i: self._entries[i].last_used)
+                del self._entries[oldest]
+            self._entries.append(entry)
+            self._rebuild()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries = []
+            self._rebuild()
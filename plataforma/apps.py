@@ -1,6 +1,24 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class PlataformaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'plataforma'
+
+    def ready(self):
+        # Pruebas de carga: responder las llamadas a OpenAI en el proceso, sin red
+        if getattr(settings, 'RAG_FAKE_OPENAI', False):
+            from . import fake_openai
+            fake_openai.install(fake_openai.FakeOpenAI(**getattr(settings, 'RAG_FAKE_OPENAI_OPTIONS', {})))
+
+        # Cargar los índices marcados con preload al iniciar el worker en vez de en la primera pregunta
+        if getattr(settings, 'RAG_PRELOAD_INDEX', False):
+            from .index_registry import index_registry
+            index_registry.preload()
+
+            # Autochequeo: tamaño del índice y cuánto está residente/compartido, sin leer sus páginas
+            # (para recorrerlas todas: python manage.py index_memory --touch)
+            if getattr(settings, 'RAG_INDEX_SELF_CHECK', True):
+                from .memory import log_index_memory
+                log_index_memory(index_registry)
@@ -0,0 +1,211 @@
+"""
+Server-side chat history: a rolling window of turns per conversation.
+
+Each load of the chat page starts a ``Conversation`` bound to the browser
+session, so the client only sends the new question. Turns are persisted in the
+database; each worker keeps the window of its recently used conversations in
+an in-process LRU and reloads one from the database only when another worker
+added turns to it (its ``turn_count`` moved). That check is skipped for
+``check_interval`` seconds after the last one, so a turn added by another
+worker may be missing from the history for that long; append() always works
+on the current turns, under the conversation's row lock.
+
+The window passed to ask() holds the latest turns that fit ``token_budget``.
+Older turns are compacted into an extractive summary (the user's questions and
+the course codes mentioned in each turn), bounded by ``summary_budget``, so
+compacting never calls ChatCompletion.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import lexical, tokens
+from .models import Conversation, Turn
+
+SUMMARY_HEADER = "Resumen de la conversación anterior (preguntas del usuario y cursos mencionados):"
+# Tokens de cada mensaje del chat además de su contenido (rol y separadores)
+TOKENS_PER_MESSAGE = 4
+MAX_SUMMARY_QUESTION = 200
+
+
+@dataclass
+class ConversationWindow:
+    turn_count: int = 0
+    summary: str = ""
+    # (pregunta, respuesta, tokens) de los turnos que aún no están en el resumen
+    turns: list[tuple[str, str, int]] = field(default_factory=list)
+
+    def messages(self) -> list[dict]:
+        """The window as ChatCompletion messages, oldest first."""
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"{SUMMARY_HEADER}\n{self.summary}"})
+        for question, answer, _ in self.turns:
+            messages.append({"role": "user", "content": question})
+            messages.append({"role": "assistant", "content": answer})
+        return messages
+
+
+def summary_line(question: str, answer: str) -> str:
+    """Summary of a compacted turn: its question and the courses it mentioned."""
+    question = " ".join(question.split())
+    if len(question) > MAX_SUMMARY_QUESTION:
+        question = question[:MAX_SUMMARY_QUESTION] + "…"
+    codes = lexical.course_codes_in(f"{question}\n{answer}")
+    return f"- {question}" + (f" (cursos: {', '.join(codes)})" if codes else "")
+
+
+def delete_inactive(before) -> int:
+    """Delete the conversations (and their turns) not updated since `before`. Returns how many were deleted."""
+    conversations = Conversation.objects.filter(updated_at__lt=before)
+    count = conversations.count()
+    conversations.delete()
+    return count
+
+
+class ConversationStore:
+    def __init__(self, model: str, token_budget: int = 1000, summary_budget: int = 200, max_entries: int = 1000,
+                 check_interval: float = 1.0):
+        self.model = model
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        # id -> (ventana, momento en que se verificó contra la base de datos)
+        self._windows: OrderedDict[int, tuple[ConversationWindow, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def turn_tokens(self, question: str, answer: str) -> int:
+        return (tokens.num_tokens(question, self.model) + tokens.num_tokens(answer, self.model)
+                + 2 * TOKENS_PER_MESSAGE)
+
+    def _remember(self, conversation_id: int, window: ConversationWindow) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._windows[conversation_id] = (window, time.monotonic())
+            self._windows.move_to_end(conversation_id)
+            while len(self._windows) > self.max_entries:
+                self._windows.popitem(last=False)
+
+    def start(self, session_key: str, user=None, current: int | None = None) -> int:
+        """Start an empty conversation for a session. Returns its id.
+
+        `current` (the session's conversation) is reused while it has no turns,
+        so reloading the page does not add a row each time.
+        """
+        if current is not None and Conversation.objects.filter(pk=current, turn_count=0).update(
+                updated_at=timezone.now()):
+            self._remember(current, ConversationWindow())
+            return current
+        conversation = Conversation.objects.create(session_key=session_key, user=user)
+        self._remember(conversation.pk, ConversationWindow())
+        return conversation.pk
+
+    def _cached(self, conversation_id: int, turn_count: int | None = None) -> ConversationWindow | None:
+        """The LRU window if it has `turn_count` turns (or, with None, if it was checked within `check_interval`)."""
+        with self._lock:
+            entry = self._windows.get(conversation_id)
+            if entry is None:
+                return None
+            window, checked_at = entry
+            now = time.monotonic()
+            if turn_count is None:
+                if now - checked_at >= self.check_interval:
+                    return None
+            elif window.turn_count != turn_count:
+                return None
+            else:
+                checked_at = now
+            self._windows[conversation_id] = (window, checked_at)
+            self._windows.move_to_end(conversation_id)
+            return window
+
+    def _load(self, conversation: Conversation) -> ConversationWindow:
+        turns = conversation.turns.all()[conversation.summarized_turns:]
+        return ConversationWindow(conversation.turn_count, conversation.summary,
+                                  [(turn.question, turn.answer, turn.n_tokens) for turn in turns])
+
+    def window(self, conversation_id: int) -> ConversationWindow | None:
+        """Current window of a conversation, or None if it does not exist. Do not mutate it."""
+        window = self._cached(conversation_id)
+        if window is None:
+            conversation = Conversation.objects.filter(pk=conversation_id).first()
+            if conversation is None:
+                return None
+            window = self._cached(conversation_id, conversation.turn_count)
+            if window is None:
+                with self._lock:
+                    self.misses += 1
+                window = self._load(conversation)
+                self._remember(conversation_id, window)
+                return window
+        with self._lock:
+            self.hits += 1
+        return window
+
+    def history(self, conversation_id: int) -> list[dict]:
+        """Messages to pass as ask(history=...); empty for a new or missing conversation."""
+        window = self.window(conversation_id)
+        return window.messages() if window is not None else []
+
+    def bounded_summary(self, lines: list[str]) -> str:
+        """Join summary lines, dropping the oldest ones until the summary fits `summary_budget`."""
+        while lines and tokens.num_tokens("\n".join(lines), self.model) > self.summary_budget:
+            lines = lines[1:]
+        return "\n".join(lines)
+
+    def append(self, conversation_id: int, question: str, answer: str) -> ConversationWindow | None:
+        """Save a turn, compacting the oldest turns into the summary while the window is over budget.
+
+        The turn count is incremented first, which locks the conversation's row
+        until the transaction ends: concurrent appends to the same conversation
+        run one after the other, each on the turns saved by the previous one.
+        """
+        n_tokens = self.turn_tokens(question, answer)
+        with transaction.atomic():
+            if not Conversation.objects.filter(pk=conversation_id).update(turn_count=F("turn_count") + 1):
+                return None
+            conversation = Conversation.objects.get(pk=conversation_id)
+            conversation.turn_count -= 1  # Turnos antes de este
+            window = self._cached(conversation_id, conversation.turn_count) or self._load(conversation)
+
+            turns = window.turns + [(question, answer, n_tokens)]
+            lines = window.summary.splitlines() if window.summary else []
+            compacted = 0
+            while turns and sum(n for _, _, n in turns) > self.token_budget:
+                old_question, old_answer, _ = turns.pop(0)
+                lines.append(summary_line(old_question, old_answer))
+                compacted += 1
+            summary = self.bounded_summary(lines) if compacted else window.summary
+
+            Turn.objects.create(conversation_id=conversation_id, question=question, answer=answer, n_tokens=n_tokens)
+            Conversation.objects.filter(pk=conversation_id).update(
+                summarized_turns=F("summarized_turns") + compacted,
+                summary=summary,
+                updated_at=timezone.now(),
+            )
+        window = ConversationWindow(window.turn_count + 1, summary, turns)
+        self._remember(conversation_id, window)
+        return window
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._windows),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._windows.clear()
@@ -0,0 +1,141 @@
+"""
+Course texts of the MIA catalog (mia_data/cursos_completo_*.json).
+
+Shared by generate_mia_embeddings.py, which embeds them, and the benchmarks,
+which build corpora the same way without importing the script.
+"""
+
+# Campos del curso que se guardan en la metadata del índice (ver course_metadata_fields)
+COURSE_FIELDS = ("palabras_clave", "creditos", "modulos", "disciplina", "caracter", "tipo")
+
+
+def process_course_to_sections(course_code, course_info):
+    """Convierte un curso a una lista de (tipo de sección, texto), en el orden de process_course_to_text"""
+    parts = []
+
+    metadata = course_info.get('metadata', {})
+
+    # Información básica
+    general = []
+    if metadata.get('nombre'):
+        general.append(f"Curso: {metadata['nombre']}")
+    if metadata.get('codigo'):
+        general.append(f"Código: {metadata['codigo']}")
+    if metadata.get('disciplina'):
+        general.append(f"Disciplina: {metadata['disciplina']}")
+    if metadata.get('creditos'):
+        general.append(f"Créditos: {metadata['creditos']}")
+    if general:
+        parts.append(('general', ' '.join(general)))
+
+    # Descripción
+    if course_info.get('descripcion'):
+        parts.append(('descripcion', f"Descripción: {course_info['descripcion']}"))
+
+    # Resultados de aprendizaje
+    if course_info.get('resultados_aprendizaje'):
+        resultados = ' '.join(course_info['resultados_aprendizaje'])
+        parts.append(('resultados_aprendizaje', f"Resultados de aprendizaje: {resultados}"))
+
+    # Contenidos - CORREGIDO para manejar la nueva estructura
+    if course_info.get('contenidos'):
+        contenidos_text = []
+        contenidos = course_info['contenidos']
+
+        # Si contenidos es un diccionario con estructura jerárquica
+        if isinstance(contenidos, dict):
+            for key, value in contenidos.items():
+                if isinstance(value, dict) and 'titulo' in value:
+                    # Nueva estructura jerárquica
+                    contenidos_text.append(value['titulo'])
+                    # Agregar subsecciones si existen
+                    if 'subsecciones' in value and isinstance(value['subsecciones'], dict):
+                        for sub_key, sub_value in value['subsecciones'].items():
+                            if isinstance(sub_value, dict) and 'titulo' in sub_value:
+                                contenidos_text.append(sub_value['titulo'])
+                elif isinstance(value, str):
+                    # Estructura simple
+                    contenidos_text.append(value)
+
+        if contenidos_text:
+            parts.append(('contenidos', f"Contenidos: {' '.join(contenidos_text)}"))
+
+    # Metodologías
+    if course_info.get('metodologias') and isinstance(course_info['metodologias'], list):
+        metodologias = ' '.join(course_info['metodologias'])
+        parts.append(('metodologias', f"Metodologías: {metodologias}"))
+
+    # Evaluación - CORREGIDO para manejar la nueva estructura
+    if course_info.get('evaluacion'):
+        evaluacion = course_info['evaluacion']
+        if isinstance(evaluacion, dict) and 'items' in evaluacion:
+            # Nueva estructura
+            eval_items = []
+            for item, porcentaje in evaluacion['items'].items():
+                eval_items.append(f"{item} {porcentaje}%")
+            if eval_items:
+                parts.append(('evaluacion', f"Evaluación: {' '.join(eval_items)}"))
+        elif isinstance(evaluacion, dict):
+            # Estructura simple (diccionario directo)
+            eval_items = []
+            for item, porcentaje in evaluacion.items():
+                eval_items.append(f"{item} {porcentaje}")
+            if eval_items:
+                parts.append(('evaluacion', f"Evaluación: {' '.join(eval_items)}"))
+
+    # Bibliografía
+    bibliography = course_info.get('bibliography') or course_info.get('bibliografia', {})
+    bib_texts = []
+
+    for entry in bibliography.get('minima', []):
+        if isinstance(entry, dict) and entry.get('raw_text'):
+            bib_texts.append(entry['raw_text'])
+    for entry in bibliography.get('complementaria', []):
+        if isinstance(entry, dict) and entry.get('raw_text'):
+            bib_texts.append(entry['raw_text'])
+
+    if bib_texts:
+        parts.append(('bibliografia', f"Bibliografía: {' '.join(bib_texts[:5])}"))  # Primeras 5 entradas
+
+    return parts
+
+
+def process_course_to_text(course_code, course_info):
+    """Convierte un curso a texto para embedding (mismo formato que tu sistema)"""
+    return ' '.join(text for _, text in process_course_to_sections(course_code, course_info))
+
+
+def course_metadata_fields(course_info):
+    """Campos estructurados del curso que se guardan por texto en el índice.
+
+    palabras_clave no forma parte del texto embebido, pero sí del índice léxico
+    (BM25); el resto permite filtrar antes de buscar (ver plataforma/filters.py).
+    Los campos con varios valores se guardan como "A, B" para que también
+    sobrevivan al CSV.
+    """
+    metadata = course_info.get('metadata', {})
+    tipo = metadata.get('tipo')
+    return {
+        'palabras_clave': ' '.join(metadata.get('palabras_clave') or []),
+        'creditos': metadata.get('creditos'),
+        'modulos': metadata.get('modulos'),
+        'disciplina': metadata.get('disciplina') or '',
+        'caracter': metadata.get('caracter') or '',
+        'tipo': ', '.join(tipo) if isinstance(tipo, list) else (tipo or ''),
+    }
+
+
+def process_course_to_chunks(course_code, course_info):
+    """Un chunk por sección, encabezado con el nombre y código del curso para que se entienda solo"""
+    metadata = course_info.get('metadata', {})
+    header = ' '.join(part for part in [
+        f"Curso: {metadata['nombre']}" if metadata.get('nombre') else '',
+        f"Código: {metadata['codigo']}" if metadata.get('codigo') else '',
+    ] if part)
+
+    chunks = []
+    for section, text in process_course_to_sections(course_code, course_info):
+        if section != 'general' and header:
+            text = f"{header} {text}"
+        chunks.append((section, text))
+    return chunks
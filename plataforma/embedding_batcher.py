@@ -0,0 +1,108 @@
+"""
+Micro-batching of query embeddings across concurrent requests.
+
+Queries that miss the embedding cache while other queries are being embedded
+are sent to the embeddings endpoint together, as one ``Embedding.create``
+call with a list input (up to ``max_batch`` texts, the batch size the index
+builder uses), and every caller gets its own vector back. A collector thread
+forms the batches: a query that arrives when nothing is queued or in flight
+is sent right away; otherwise the batch waits up to ``window`` seconds for
+more queries. Up to ``max_concurrent`` batches are in flight at once, and
+while all are busy new queries keep queueing, so batches grow with the load.
+Callers wait on a future: threads block on it (at most ``timeout`` seconds)
+and async views await it without blocking their event loop.
+
+metrics.py exports the size of each batch (``rag_embedding_batch_size``) and
+the number of queries waiting for one (``rag_embedding_queue_depth``).
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from . import metrics
+
+
+class EmbeddingBatcher:
+    def __init__(self, create_batch, window: float = 0.005, max_batch: int = 100, max_concurrent: int = 4,
+                 timeout: float = 60):
+        """`create_batch(texts)` returns the embedding of each text, in the same order."""
+        self.create_batch = create_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pid = None
+        # Lotes enviados a la API que aún no terminan
+        self._in_flight = 0
+
+    def _start(self) -> None:
+        # Debe llamarse con _lock tomado. Se arranca en el primer uso y de nuevo tras un fork
+        # (gunicorn --preload): los hilos del proceso padre no existen en el hijo
+        self._pid = os.getpid()
+        self._in_flight = 0
+        self._queue = queue.SimpleQueue()
+        slots = threading.BoundedSemaphore(self.max_concurrent)
+        executor = ThreadPoolExecutor(self.max_concurrent, thread_name_prefix="embedding-batch")
+        threading.Thread(target=self._collect, args=(self._queue, slots, executor),
+                         name="embedding-batcher", daemon=True).start()
+
+    def _collect(self, pending: queue.SimpleQueue, slots: threading.BoundedSemaphore, executor) -> None:
+        while True:
+            # Con todos los lotes ocupados las consultas se acumulan para el siguiente
+            slots.acquire()
+            batch = [pending.get()]
+            with self._lock:
+                # Una consulta sola, sin otras en cola ni lotes en curso, no espera la ventana
+                alone = self._in_flight == 0 and pending.empty()
+                self._in_flight += 1
+            deadline = time.monotonic() + (0 if alone else self.window)
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(pending.get(timeout=remaining) if remaining > 0 else pending.get_nowait())
+                except queue.Empty:
+                    break
+            metrics.EMBEDDING_QUEUE_DEPTH.set(pending.qsize())
+            executor.submit(self._run, batch, slots)
+
+    def _run(self, batch: list[tuple[str, Future]], slots: threading.BoundedSemaphore) -> None:
+        error = None
+        try:
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            metrics.EMBEDDING_BATCH_SIZE.observe(len(texts))
+            embeddings = list(self.create_batch(texts))
+            if len(embeddings) != len(texts):
+                raise ValueError(f"Got {len(embeddings)} embeddings for {len(texts)} texts")
+            vectors = dict(zip(texts, embeddings))
+            for text, future in batch:
+                future.set_result(vectors[text])
+        except Exception as e:
+            error = e
+        finally:
+            # Ningún llamador queda esperando: los futuros sin resultado reciben el error
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error or RuntimeError("Embedding batch failed"))
+            with self._lock:
+                self._in_flight -= 1
+            slots.release()
+
+    def submit(self, text: str) -> Future:
+        """Queue `text` for the next batch; the future resolves to its embedding."""
+        future = Future()
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            self._queue.put((text, future))
+            metrics.EMBEDDING_QUEUE_DEPTH.set(self._queue.qsize())
+        return future
+
+    def embed(self, text: str):
+        return self.submit(text).result(self.timeout)
+
+    async def aembed(self, text: str):
+        return await asyncio.wait_for(asyncio.wrap_future(self.submit(text)), self.timeout)
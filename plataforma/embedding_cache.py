@@ -0,0 +1,199 @@
+"""
+Two-level cache for query embeddings.
+
+- L1: in-process LRU (``OrderedDict``) bounded by number of entries.
+- L2: optional SQLite file shared by every worker on the host, bounded by
+  ``max_rows`` (least recently used rows are evicted every ``EVICT_EVERY``
+  writes of a worker).
+
+Entries are keyed by the embedding model, the vector dimension and the
+normalized query text, so changing the model or the index (e.g. a test index
+with other dimensions) never returns a stale vector, and a cached vector whose
+shape does not match is dropped instead of returned. Rows written for other
+models are purged from the SQLite tier when the cache is opened.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+# Columnas de la tabla; un archivo con otro esquema (versión anterior) se recrea
+COLUMNS = ("key", "model", "dim", "embedding", "created_at", "last_used")
+# Escrituras de cada worker entre dos pasadas de expulsión del SQLite
+EVICT_EVERY = 100
+# Un acierto en SQLite actualiza last_used solo si pasó más que esto (segundos), para no escribir en cada lectura
+TOUCH_INTERVAL = 60
+
+
+def normalize_query(text: str) -> str:
+    """Canonical form of a query for cache keys: NFC, lowercase, single spaces."""
+    text = unicodedata.normalize("NFC", text)
+    return " ".join(text.lower().split())
+
+
+class QueryEmbeddingCache:
+    def __init__(self, model: str, max_entries: int = 1024, path=None, max_rows: int = 100_000):
+        self.model = model
+        self.max_entries = max_entries
+        self.path = Path(path) if path else None
+        self.max_rows = max_rows
+        self._entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._purged = False
+        self._writes = 0
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+
+    def key(self, text: str, dim: int) -> str:
+        return hashlib.sha256(f"{self.model}\0{dim}\0{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+    # SQLite (una conexión por hilo)
+    def _connection(self) -> sqlite3.Connection | None:
+        if self.path is None:
+            return None
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                columns = tuple(row[1] for row in connection.execute("PRAGMA table_info(query_embeddings)"))
+                if columns and columns != COLUMNS:
+                    connection.execute("DROP TABLE query_embeddings")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                    "key TEXT PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL, embedding BLOB NOT NULL, "
+                    "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+                )
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS query_embeddings_last_used ON query_embeddings (last_used)"
+                )
+            if not self._purged:
+                # Invalidar vectores de otros modelos
+                with connection:
+                    connection.execute("DELETE FROM query_embeddings WHERE model != ?", (self.model,))
+                self._purged = True
+            self._local.connection = connection
+        return connection
+
+    def _l2_get(self, key: str, dim: int) -> np.ndarray | None:
+        connection = self._connection()
+        if connection is None:
+            return None
+        row = connection.execute(
+            "SELECT embedding, last_used FROM query_embeddings WHERE key = ? AND model = ?", (key, self.model)
+        ).fetchone()
+        if row is None:
+            return None
+        embedding = np.frombuffer(row[0], dtype=np.float32)
+        now = time.time()
+        with connection:
+            if embedding.shape != (dim,):
+                connection.execute("DELETE FROM query_embeddings WHERE key = ?", (key,))
+                return None
+            if now - row[1] > TOUCH_INTERVAL:
+                connection.execute("UPDATE query_embeddings SET last_used = ? WHERE key = ?", (now, key))
+        return embedding
+
+    def _l2_put(self, key: str, embedding: np.ndarray) -> None:
+        connection = self._connection()
+        if connection is None:
+            return
+        now = time.time()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, model, dim, embedding, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, self.model, embedding.shape[0], embedding.tobytes(), now, now),
+            )
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """Delete the least recently used SQLite rows beyond `max_rows`. Returns how many were deleted."""
+        connection = self._connection()
+        if connection is None:
+            return 0
+        with connection:
+            return connection.execute(
+                "DELETE FROM query_embeddings WHERE key IN "
+                "(SELECT key FROM query_embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_rows,),
+            ).rowcount
+
+    # LRU en memoria
+    def _l1_put(self, key: str, embedding: np.ndarray) -> None:
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, text: str, dim: int) -> np.ndarray | None:
+        """Cached embedding of `text` with `dim` dimensions (those of the index it will be compared with)."""
+        key = self.key(text, dim)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None and embedding.shape == (dim,):
+                self._entries.move_to_end(key)
+                self.l1_hits += 1
+                return embedding
+        try:
+            embedding = self._l2_get(key, dim)
+        except sqlite3.Error:
+            embedding = None
+        if embedding is not None:
+            with self._lock:
+                self.l2_hits += 1
+            self._l1_put(key, embedding)
+            return embedding
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, text: str, embedding) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype=np.float32)
+        key = self.key(text, embedding.shape[0])
+        self._l1_put(key, embedding)
+        try:
+            self._l2_put(key, embedding)
+        except sqlite3.Error:
+            # La capa persistente es opcional; el L1 sigue funcionando
+            pass
+        return embedding
+
+    def get_or_create(self, text: str, embed_fn, dim: int) -> np.ndarray:
+        """Return the cached embedding for `text`, calling `embed_fn(text)` on a miss."""
+        embedding = self.get(text, dim)
+        if embedding is None:
+            embedding = self.put(text, embed_fn(text))
+        return embedding
+
+    def stats(self) -> dict:
+        lookups = self.l1_hits + self.l2_hits + self.misses
+        return {
+            "model": self.model,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "l1_hits": self.l1_hits,
+            "l2_hits": self.l2_hits,
+            "misses": self.misses,
+            "hit_rate": (self.l1_hits + self.l2_hits) / lookups if lookups else 0.0,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        connection = self._connection()
+        if connection is not None:
+            with connection:
+                connection.execute("DELETE FROM query_embeddings")
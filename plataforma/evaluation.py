@@ -0,0 +1,219 @@
+"""
+Offline retrieval benchmark over the MIA catalog.
+
+A gold set of Spanish questions (``mia_data/gold_questions.json``) lists, for
+each question, the course codes a good retrieval should return. Questions are
+embedded once with the OpenAI API and stored in a fixture
+(``mia_data/gold_embeddings.json``) so later runs are offline and repeatable.
+For each question the benchmark ranks courses with BM25, with the vectors and
+with the production hybrid ranking (``views.ranked_rows``) and reports:
+
+- recall@k and MRR of the expected courses, per method;
+- tokens of the context ``views.query_message`` packs, and how many expected
+  courses made it into that context;
+- latency per stage (BM25, vector search, full ranking, packing).
+
+Questions missing from the fixture are evaluated with BM25 only.
+"""
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from . import lexical
+
+DATA_DIR = Path(__file__).resolve().parent / "mia_data"
+GOLD_PATH = DATA_DIR / "gold_questions.json"
+FIXTURE_PATH = DATA_DIR / "gold_embeddings.json"
+K_VALUES = (1, 3, 5, 10)
+METHODS = ("bm25", "vector", "hybrid")
+STAGES = ("bm25", "vector", "rank", "pack")
+
+
+def load_gold(path=GOLD_PATH) -> list[dict]:
+    """Gold questions as ``[{"question": str, "expected": [course codes]}]``."""
+    with open(path, encoding="utf-8") as f:
+        gold = json.load(f)
+    for item in gold:
+        if not item.get("question") or not item.get("expected"):
+            raise ValueError(f"Entrada inválida en {path}: {item!r}")
+        item["expected"] = [code.upper() for code in item["expected"]]
+    return gold
+
+
+def catalog_codes(data_dir=DATA_DIR) -> set[str]:
+    """Course codes of the latest ``cursos_completo_*.json``."""
+    files = sorted(Path(data_dir).glob("cursos_completo_*.json"), key=lambda p: p.stat().st_mtime)
+    if not files:
+        raise FileNotFoundError(f"No se encontró cursos_completo_*.json en {data_dir}")
+    with open(files[-1], encoding="utf-8") as f:
+        return {code.upper() for code in json.load(f)}
+
+
+class RecordedEmbeddings:
+    """Question embeddings recorded from the API, replayed offline."""
+
+    def __init__(self, model: str, vectors: dict[str, list[float]] | None = None,
+                 latencies_ms: dict[str, float] | None = None):
+        self.model = model
+        self.vectors = dict(vectors or {})
+        self.latencies_ms = dict(latencies_ms or {})
+
+    @classmethod
+    def load(cls, path=FIXTURE_PATH) -> "RecordedEmbeddings | None":
+        path = Path(path)
+        if not path.exists():
+            return None
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["model"], data["embeddings"], data.get("latencies_ms"))
+
+    def save(self, path=FIXTURE_PATH) -> None:
+        data = {"model": self.model, "embeddings": self.vectors, "latencies_ms": self.latencies_ms}
+        Path(path).write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+    def get(self, question: str) -> np.ndarray | None:
+        vector = self.vectors.get(question)
+        return None if vector is None else np.asarray(vector, dtype=np.float32)
+
+    def record(self, questions, create) -> list[str]:
+        """Embed the questions not recorded yet with `create(text) -> list[float]`; returns them."""
+        missing = [question for question in questions if question not in self.vectors]
+        for question in missing:
+            started = time.perf_counter()
+            self.vectors[question] = [float(x) for x in create(question)]
+            self.latencies_ms[question] = (time.perf_counter() - started) * 1000
+        return missing
+
+
+def row_courses(index) -> list[str | None]:
+    """Course code of every row (from metadata, or from the text of imported indexes)."""
+    codes = index.metadata.get("course_code")
+    if codes is None:
+        codes = [(lexical.CODE_IN_TEXT_RE.search(text) or [None, None])[1] for text in index.texts]
+    return [str(code).upper() if code else None for code in codes]
+
+
+def ranked_courses(rows, codes: list[str | None]) -> list[str]:
+    """Courses in the order their first row appears in `rows` (sections collapse to their course)."""
+    courses = []
+    for row in rows:
+        code = codes[int(row)]
+        if code and code not in courses:
+            courses.append(code)
+    return courses
+
+
+def recall_at_k(ranked: list[str], expected: list[str], k: int) -> float:
+    return len(set(ranked[:k]) & set(expected)) / len(expected)
+
+
+def reciprocal_rank(ranked: list[str], expected: list[str]) -> float:
+    for rank, code in enumerate(ranked, start=1):
+        if code in expected:
+            return 1.0 / rank
+    return 0.0
+
+
+def _timed(stage: str, latencies: dict, call):
+    started = time.perf_counter()
+    result = call()
+    latencies[stage].append((time.perf_counter() - started) * 1000)
+    return result
+
+
+def _summary(values) -> dict:
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return {"n": 0}
+    return {
+        "n": int(len(values)), "mean": float(values.mean()), "p50": float(np.percentile(values, 50)),
+        "p99": float(np.percentile(values, 99)), "max": float(values.max()),
+    }
+
+
+def run(index, gold: list[dict], embeddings: RecordedEmbeddings | None, ks=K_VALUES, top_n: int = 100,
+        model: str | None = None, token_budget: int = 4096 - 500) -> dict:
+    """Evaluate retrieval on `index` for every gold question. Returns a JSON-serializable dict."""
+    from . import views
+
+    model = model or views.GPT_MODEL
+    bm25 = lexical.lexical_index(index)
+    codes = row_courses(index)
+    latencies = {stage: [] for stage in STAGES}
+    scores = {method: {"rr": [], **{k: [] for k in ks}} for method in METHODS}
+    context_tokens, context_recall, questions = [], [], []
+
+    for item in gold:
+        query, expected = item["question"], item["expected"]
+        embedding = embeddings.get(query) if embeddings is not None else None
+        # Igual que lookup_answer: una pregunta por código se responde sin embedding
+        exact = bm25.exact_matches(query)
+        ranking_embedding = None if exact else embedding
+
+        rankings = {"bm25": _timed("bm25", latencies, lambda: bm25.search(query, top_n)[0])}
+        if embedding is not None:
+            rankings["vector"] = _timed("vector", latencies, lambda: index.search(embedding, top_n)[0])
+        if exact or embedding is not None:
+            rankings["hybrid"] = _timed("rank", latencies, lambda: views.ranked_rows(
+                query, index, top_n, query_embedding=ranking_embedding))
+
+        result = {"question": query, "expected": expected, "ranked": {}}
+        for method, rows in rankings.items():
+            ranked = ranked_courses(rows, codes)
+            result["ranked"][method] = ranked[:max(ks)]
+            scores[method]["rr"].append(reciprocal_rank(ranked, expected))
+            for k in ks:
+                scores[method][k].append(recall_at_k(ranked, expected, k))
+
+        if "hybrid" in rankings:
+            message = _timed("pack", latencies, lambda: views.query_message(
+                query, index, model, token_budget, query_embedding=ranking_embedding))
+            result["context_tokens"] = views.num_tokens(message, model=model)
+            result["context_recall"] = sum(code in message for code in expected) / len(expected)
+            context_tokens.append(result["context_tokens"])
+            context_recall.append(result["context_recall"])
+        questions.append(result)
+
+    methods = {}
+    for method, values in scores.items():
+        if values["rr"]:
+            methods[method] = {
+                "questions": len(values["rr"]),
+                **{f"recall@{k}": float(np.mean(values[k])) for k in ks},
+                "mrr": float(np.mean(values["rr"])),
+            }
+    recorded = [embeddings.latencies_ms[q["question"]] for q in questions
+                if embeddings is not None and q["question"] in embeddings.latencies_ms]
+    return {
+        "index": {"version": index.version, "rows": len(index), "model": index.model,
+                  "chunking": "section" if "section" in index.metadata else "course"},
+        "embedding_model": embeddings.model if embeddings is not None else None,
+        "gold_questions": len(gold),
+        "token_budget": token_budget,
+        "methods": methods,
+        "context": {"tokens": _summary(context_tokens),
+                    "recall": float(np.mean(context_recall)) if context_recall else None},
+        "latency_ms": {stage: _summary(values) for stage, values in latencies.items()},
+        "recorded_embedding_ms": _summary(recorded),
+        "questions": questions,
+    }
+
+
+def compare(current: dict, baseline: dict) -> dict:
+    """Differences (current - baseline) of every metric both runs report."""
+    deltas = {}
+    for method, metrics in current["methods"].items():
+        for name, value in metrics.items():
+            previous = baseline.get("methods", {}).get(method, {}).get(name)
+            if name != "questions" and previous is not None:
+                deltas[f"{method}.{name}"] = value - previous
+    for stage, summary in current["latency_ms"].items():
+        previous = baseline.get("latency_ms", {}).get(stage, {}).get("p50")
+        if "p50" in summary and previous is not None:
+            deltas[f"latency.{stage}.p50"] = summary["p50"] - previous
+    previous = baseline.get("context", {}).get("tokens", {}).get("mean")
+    if "mean" in current["context"]["tokens"] and previous is not None:
+        deltas["context.tokens.mean"] = current["context"]["tokens"]["mean"] - previous
+    return deltas
@@ -0,0 +1,199 @@
+"""
+In-process stand-in for the OpenAI API, for load tests and offline demos.
+
+``install()`` replaces ``openai.Embedding.create/acreate`` and
+``openai.ChatCompletion.create/acreate`` in the current process, so every
+caller (views, caches, generate_mia_embeddings.py) gets deterministic answers
+without network, cost or rate limits. It is enabled at startup with
+``RAG_FAKE_OPENAI=1`` (see ``PlataformaConfig.ready``) and works the same
+under WSGI and ASGI: the async variants sleep with ``asyncio.sleep`` so they
+do not block the event loop, like the real client.
+
+- Embeddings are hashed bags of words: the same text always gets the same
+  unit vector and texts sharing words are similar, so the caches behave as
+  they would with real embeddings.
+- Chat completions echo the question with the size of the context, streamed
+  word by word when ``stream=True``.
+- Latency (to the first token and between tokens) and a rate of failed calls
+  (``openai.error.RateLimitError``) are configurable.
+"""
+import asyncio
+import hashlib
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import openai
+
+EMBEDDING_DIM = 1536
+_WORD_RE = re.compile(r"\w+")
+
+
+class FakeOpenAI:
+    """Deterministic embeddings and chat completions with configurable latency and errors."""
+
+    def __init__(
+            self,
+            dim: int = EMBEDDING_DIM,
+            embedding_latency: float = 0.05,
+            chat_latency: float = 0.5,
+            token_latency: float = 0.01,
+            error_rate: float = 0.0,
+            seed: int = 0,
+    ):
+        self.dim = dim
+        self.embedding_latency = embedding_latency
+        self.chat_latency = chat_latency
+        self.token_latency = token_latency
+        self.error_rate = error_rate
+        self.calls = {"embedding": 0, "chat": 0, "errors": 0}
+        self._random = random.Random(seed)
+        self._word_vectors: dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def _word_vector(self, word: str) -> np.ndarray:
+        vector = self._word_vectors.get(word)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            self._word_vectors[word] = vector
+        return vector
+
+    def embed(self, text: str) -> list[float]:
+        words = _WORD_RE.findall(text.lower()) or [""]
+        vector = np.sum([self._word_vector(word) for word in words], axis=0)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def answer(self, messages: list[dict]) -> str:
+        question = messages[-1]["content"] if messages else ""
+        question = question.rsplit("Pregunta:", 1)[-1].strip()
+        context = sum(len(message["content"]) for message in messages)
+        return (f"Respuesta de prueba para: {question}. "
+                f"El contexto tenía {context} caracteres. Esta respuesta fue generada sin llamar a OpenAI.")
+
+    def _count(self, kind: str) -> None:
+        with self._lock:
+            self.calls[kind] += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.calls["errors"] += 1
+        if failed:
+            raise openai.error.RateLimitError("Error simulado por FakeOpenAI (error_rate)")
+
+    # Embedding
+
+    def _embedding_response(self, input, model=None):
+        texts = [input] if isinstance(input, str) else list(input)
+        return {
+            "object": "list",
+            "model": model,
+            "data": [{"object": "embedding", "index": i, "embedding": self.embed(text)} for i, text in enumerate(texts)],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }
+
+    def embedding_create(self, input, model=None, **kwargs):
+        self._count("embedding")
+        time.sleep(self.embedding_latency)
+        return self._embedding_response(input, model)
+
+    async def embedding_acreate(self, input, model=None, **kwargs):
+        self._count("embedding")
+        await asyncio.sleep(self.embedding_latency)
+        return self._embedding_response(input, model)
+
+    # ChatCompletion
+
+    @staticmethod
+    def _chunk(content=None, finish_reason=None):
+        delta = {} if content is None else {"content": content}
+        return {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": delta,
+                                                                "finish_reason": finish_reason}]}
+
+    @staticmethod
+    def _completion(messages: list[dict], answer: str, model=None):
+        # Uso aproximado: una palabra por token
+        prompt_tokens = sum(len(message["content"].split()) for message in messages)
+        completion_tokens = len(answer.split())
+        return {
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def _stream(self, words):
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.token_latency)
+            yield self._chunk(word)
+        yield self._chunk(finish_reason="stop")
+
+    async def _astream(self, words):
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            yield self._chunk(word)
+        yield self._chunk(finish_reason="stop")
+
+    def chat_create(self, messages, model=None, stream=False, **kwargs):
+        self._count("chat")
+        answer = self.answer(messages)
+        time.sleep(self.chat_latency)
+        if stream:
+            return self._stream(re.findall(r"\S+\s*", answer))
+        time.sleep(self.token_latency * len(answer.split()))
+        return self._completion(messages, answer, model)
+
+    async def chat_acreate(self, messages, model=None, stream=False, **kwargs):
+        self._count("chat")
+        answer = self.answer(messages)
+        await asyncio.sleep(self.chat_latency)
+        if stream:
+            return self._astream(re.findall(r"\S+\s*", answer))
+        await asyncio.sleep(self.token_latency * len(answer.split()))
+        return self._completion(messages, answer, model)
+
+
+_originals: dict | None = None
+current: FakeOpenAI | None = None
+
+
+def install(fake: FakeOpenAI | None = None) -> FakeOpenAI:
+    """Route the openai module's Embedding and ChatCompletion calls to `fake`."""
+    global _originals, current
+    fake = fake or FakeOpenAI()
+    if _originals is None:
+        _originals = {
+            (cls, name): cls.__dict__[name]
+            for cls in (openai.Embedding, openai.ChatCompletion)
+            for name in ("create", "acreate")
+        }
+    openai.Embedding.create = staticmethod(fake.embedding_create)
+    openai.Embedding.acreate = staticmethod(fake.embedding_acreate)
+    openai.ChatCompletion.create = staticmethod(fake.chat_create)
+    openai.ChatCompletion.acreate = staticmethod(fake.chat_acreate)
+    current = fake
+    return fake
+
+
+def uninstall() -> None:
+    """Restore the real openai client methods."""
+    global _originals, current
+    if _originals is not None:
+        for (cls, name), method in _originals.items():
+            setattr(cls, name, method)
+    _originals, current = None, None
+
+
+@contextmanager
+def installed(**options):
+    """``with installed(chat_latency=0): ...`` runs the block against a FakeOpenAI."""
+    fake = install(FakeOpenAI(**options))
+    try:
+        yield fake
+    finally:
+        uninstall()
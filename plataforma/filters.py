@@ -0,0 +1,108 @@
+"""
+Metadata pre-filtering for the embedding index.
+
+Structured course fields stored with the index (``creditos``, ``modulos``,
+``disciplina``, ``caracter``, ``tipo``) are kept as columnar arrays: numeric
+columns as NumPy arrays and text columns as an inverted index of value ->
+boolean bitmap. A filter resolves to a row mask by combining bitmaps, so the
+vector and BM25 scoring only run on the rows that survive.
+
+Filters use Django-style lookups::
+
+    {"caracter": "MINIMO", "creditos": 5}
+    {"disciplina": ["ESTADISTICA", "COMPUTACION"], "creditos__gte": 10}
+
+A list matches any of its values. Multi-valued fields (``disciplina`` and
+``tipo``, stored as ``"A, B"``) match when any of their values does.
+"""
+import operator
+
+import numpy as np
+
+from .retrieval import VectorIndex
+
+NUMERIC_COLUMNS = ("creditos", "modulos")
+CATEGORICAL_COLUMNS = ("disciplina", "caracter", "tipo")
+
+LOOKUPS = {
+    "exact": operator.eq,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+
+
+def split_values(value) -> list[str]:
+    """Values of a (possibly multi-valued) text field, normalized to uppercase."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return []
+    return [part.strip().upper() for part in str(value).split(",") if part.strip()]
+
+
+class MetadataIndex:
+    """Columnar arrays and bitmap indexes over the metadata columns of an index."""
+
+    def __init__(self, metadata: dict, size: int):
+        self.size = size
+        self.numeric: dict[str, np.ndarray] = {}
+        self.bitmaps: dict[str, dict[str, np.ndarray]] = {}
+        for column in NUMERIC_COLUMNS:
+            if column in metadata:
+                self.numeric[column] = np.array(
+                    [np.nan if value is None else value for value in metadata[column]], dtype=np.float64
+                )
+        for column in CATEGORICAL_COLUMNS:
+            if column in metadata:
+                bitmaps: dict[str, np.ndarray] = {}
+                for row, value in enumerate(metadata[column]):
+                    for part in split_values(value):
+                        bitmaps.setdefault(part, np.zeros(size, dtype=bool))[row] = True
+                self.bitmaps[column] = bitmaps
+
+    def values(self, column: str) -> list:
+        """Distinct values of a column (e.g. to build a filter form)."""
+        if column in self.bitmaps:
+            return sorted(self.bitmaps[column])
+        return sorted({value for value in self.numeric[column].tolist() if not np.isnan(value)})
+
+    def mask(self, filters: dict) -> np.ndarray:
+        """Boolean mask of the rows matching every filter."""
+        mask = np.ones(self.size, dtype=bool)
+        for key, expected in filters.items():
+            column, _, lookup = key.partition("__")
+            lookup = lookup or "exact"
+            if lookup not in LOOKUPS:
+                raise ValueError(f"Unsupported lookup '{lookup}' in filter '{key}'")
+            options = expected if isinstance(expected, (list, tuple, set)) else [expected]
+
+            if column in self.numeric:
+                values = self.numeric[column]
+                compare = LOOKUPS[lookup]
+                matched = np.zeros(self.size, dtype=bool)
+                for option in options:
+                    matched |= compare(values, float(option))
+            elif column in self.bitmaps:
+                if lookup != "exact":
+                    raise ValueError(f"Lookup '{lookup}' is not supported for text field '{column}'")
+                bitmaps = self.bitmaps[column]
+                matched = np.zeros(self.size, dtype=bool)
+                for option in options:
+                    for value in split_values(option):
+                        if value in bitmaps:
+                            matched |= bitmaps[value]
+            else:
+                raise ValueError(f"The index has no filterable field '{column}'")
+            mask &= matched
+        return mask
+
+    def rows(self, filters: dict) -> np.ndarray:
+        """Row ids matching every filter."""
+        return np.flatnonzero(self.mask(filters))
+
+
+def metadata_index(index: VectorIndex) -> MetadataIndex:
+    """Metadata index of `index`, built once and kept on the index."""
+    if index.metadata_index is None:
+        index.metadata_index = MetadataIndex(index.metadata, len(index))
+    return index.metadata_index
@@ -0,0 +1,263 @@
+"""
+Lazy, hot-reloadable access to the embedding indexes used by the chats.
+
+The registry serves several named corpora (e.g. the MIA course catalog and the
+sercotec Capital Semilla bases) from the same deployment. Each corpus is loaded
+on first use (or from ``PlataformaConfig.ready`` when ``RAG_PRELOAD_INDEX`` is
+set and the corpus has ``preload``) and, on later calls, checks whether a newer
+version was published (manifest mtime/size). The request that notices it
+loads the new version while other requests keep being served, then swaps it in
+with a single reference assignment: requests that already hold the previous
+``LoadedIndex`` keep using it until they finish.
+
+Loaded corpora share a memory budget (``RAG_INDEX_MEMORY_BUDGET``, bytes of
+vectors and ANN structures): when loading one goes over it, the least recently
+used other corpora are unloaded and loaded again on their next use.
+"""
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from . import index_store, lexical
+from .retrieval import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(settings.BASE_DIR) / "plataforma"
+
+# Corpus por nombre. sources: rutas en orden de preferencia (se usa la primera que exista);
+# search: parámetros de la búsqueda aproximada, si el índice tiene una (p. ej. nprobe, rescore)
+DEFAULT_CORPORA = {
+    "mia": {
+        "sources": [DATA_DIR / "mia_data" / "mia_index.json", DATA_DIR / "mia_data" / "mia_embeddings.csv"],
+        "preload": True,
+    },
+    "sercotec": {
+        "sources": [DATA_DIR / "bases_sercotec_embeddings.csv"],
+    },
+}
+DEFAULT_CORPUS = "mia"
+
+
+class UnknownCorpus(KeyError):
+    pass
+
+
+@dataclass(frozen=True)
+class LoadedIndex:
+    """An index together with where it came from. Immutable once published."""
+    corpus: str
+    version: str
+    path: Path
+    index: VectorIndex = field(repr=False)
+    loaded_at: float = field(default_factory=time.time)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of vectors and ANN structures (what the memory budget counts)."""
+        ann = self.index.ann
+        return int(self.index.matrix.nbytes) + (ann.nbytes if ann is not None else 0)
+
+
+def _file_signature(path: Path) -> tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class CorpusIndex:
+    """One corpus: serves its preferred existing source and picks up new versions."""
+
+    def __init__(self, name: str, sources, check_interval: float = 2.0, search: dict | None = None,
+                 preload: bool = False):
+        self.name = name
+        self.sources = [Path(path) for path in sources]
+        self.check_interval = check_interval
+        self.search = dict(search or {})
+        self.preload = preload
+        self._current: LoadedIndex | None = None
+        self._signature = None
+        self._last_check = 0.0
+        self._reload_lock = threading.Lock()
+
+    def _select_source(self) -> Path:
+        for path in self.sources:
+            if path.exists():
+                return path
+        tried = ", ".join(str(path) for path in self.sources)
+        raise ImproperlyConfigured(
+            f"No se encontró ningún índice de embeddings para el corpus '{self.name}'. Rutas revisadas: {tried}. "
+            "Ejecuta generate_mia_embeddings.py para generarlo."
+        )
+
+    def _load(self, path: Path) -> LoadedIndex:
+        started = time.perf_counter()
+        if path.suffix == ".json":
+            index = index_store.load_index(path)
+            version = index.version
+        else:
+            index = index_store.load_csv_index(path)
+            version = f"csv-{path.stem}-{os.stat(path).st_mtime_ns}"
+            index.version = version
+        if index.ann is not None:
+            for key, value in self.search.items():
+                setattr(index.ann, key, value)
+        # El índice léxico se construye junto al vectorial, antes de publicar la versión
+        lexical.lexical_index(index)
+        loaded = LoadedIndex(corpus=self.name, version=version, path=path, index=index)
+        logger.info(
+            "Índice '%s' versión %s cargado desde %s (%d textos, %.0f ms)",
+            self.name, version, path, len(index), (time.perf_counter() - started) * 1000,
+        )
+        if path != self.sources[0]:
+            logger.warning("Usando índice de respaldo '%s' (%s): no existe %s", self.name, path, self.sources[0])
+        return loaded
+
+    def _is_stale(self) -> bool:
+        path = self._select_source()
+        if self._current is None or path != self._current.path:
+            return True
+        return _file_signature(path) != self._signature
+
+    def _publish(self) -> LoadedIndex:
+        # Debe llamarse con _reload_lock tomado
+        path = self._select_source()
+        signature = _file_signature(path)
+        loaded = self._load(path)
+        # Publicación atómica: una sola asignación de referencia
+        self._current, self._signature = loaded, signature
+        self._last_check = time.monotonic()
+        return loaded
+
+    def reload(self) -> LoadedIndex:
+        """Load the preferred source now and publish it."""
+        with self._reload_lock:
+            return self._publish()
+
+    @property
+    def loaded(self) -> LoadedIndex | None:
+        return self._current
+
+    def unload(self) -> None:
+        """Drop the published version; requests still holding it keep it alive until they finish."""
+        with self._reload_lock:
+            self._current, self._signature = None, None
+
+    def get(self) -> LoadedIndex:
+        """Return the current index, loading it or picking up a new version if needed."""
+        current = self._current
+        if current is None:
+            with self._reload_lock:
+                return self._current or self._publish()
+
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return current
+        self._last_check = now
+
+        try:
+            stale = self._is_stale()
+        except (OSError, ImproperlyConfigured):
+            # El archivo puede estar siendo reemplazado; se sigue sirviendo la versión actual
+            return current
+        if not stale or not self._reload_lock.acquire(blocking=False):
+            # Sin cambios, u otro hilo ya está cargando la nueva versión
+            return current
+        try:
+            return self._publish()
+        except Exception:
+            logger.exception("No se pudo recargar el índice '%s'; se mantiene la versión %s",
+                             self.name, current.version)
+            return current
+        finally:
+            self._reload_lock.release()
+
+
+class IndexRegistry:
+    """Named corpora sharing a memory budget."""
+
+    def __init__(self, corpora: dict, default: str, check_interval: float = 2.0, memory_budget: int | None = None):
+        self.corpora = {
+            name: CorpusIndex(
+                name,
+                config["sources"],
+                check_interval=config.get("check_interval", check_interval),
+                search=config.get("search"),
+                preload=config.get("preload", False),
+            )
+            for name, config in corpora.items()
+        }
+        self.default = default
+        self.memory_budget = memory_budget
+        self._last_used: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def corpus(self, name: str | None = None) -> CorpusIndex:
+        name = name or self.default
+        try:
+            return self.corpora[name]
+        except KeyError:
+            raise UnknownCorpus(name) from None
+
+    def get(self, name: str | None = None) -> LoadedIndex:
+        """Return the current index of corpus `name` (the default corpus if None)."""
+        corpus = self.corpus(name)
+        previous = corpus.loaded
+        loaded = corpus.get()
+        self._last_used[corpus.name] = time.monotonic()
+        if loaded is not previous:
+            self._enforce_budget(keep=corpus.name)
+        return loaded
+
+    def reload(self, name: str | None = None) -> LoadedIndex:
+        """Load the preferred source of corpus `name` now and publish it."""
+        corpus = self.corpus(name)
+        loaded = corpus.reload()
+        self._last_used[corpus.name] = time.monotonic()
+        self._enforce_budget(keep=corpus.name)
+        return loaded
+
+    def preload(self) -> None:
+        """Load the corpora configured with ``preload``."""
+        for corpus in self.corpora.values():
+            if corpus.preload:
+                self.get(corpus.name)
+
+    def memory_usage(self) -> dict[str, int]:
+        """Bytes counted against the budget by each loaded corpus."""
+        usage = {}
+        for name, corpus in self.corpora.items():
+            loaded = corpus.loaded
+            if loaded is not None:
+                usage[name] = loaded.nbytes
+        return usage
+
+    def _enforce_budget(self, keep: str) -> None:
+        if self.memory_budget is None:
+            return
+        with self._lock:
+            usage = self.memory_usage()
+            # Se descargan primero los corpus usados hace más tiempo
+            for name in sorted(usage, key=lambda name: self._last_used.get(name, 0.0)):
+                if sum(usage.values()) <= self.memory_budget:
+                    break
+                if name == keep:
+                    continue
+                self.corpora[name].unload()
+                logger.info("Corpus '%s' descargado por presupuesto de memoria (%d bytes)", name, usage.pop(name))
+            if sum(usage.values()) > self.memory_budget:
+                logger.warning("El corpus '%s' (%d bytes) no cabe en RAG_INDEX_MEMORY_BUDGET=%d",
+                               keep, usage.get(keep, 0), self.memory_budget)
+
+
+index_registry = IndexRegistry(
+    getattr(settings, "RAG_CORPORA", DEFAULT_CORPORA),
+    default=getattr(settings, "RAG_DEFAULT_CORPUS", DEFAULT_CORPUS),
+    check_interval=getattr(settings, "RAG_INDEX_CHECK_INTERVAL", 2.0),
+    memory_budget=getattr(settings, "RAG_INDEX_MEMORY_BUDGET", None),
+)
@@ -0,0 +1,194 @@
+"""
+On-disk format for embedding indexes.
+
+An index is published as these files in the same directory:
+
+- ``<name>-<version>.f32``: raw, row-major float32 matrix with unit-length rows.
+  Workers memory-map it, so loading does not parse or copy the vectors.
+- ``<name>-<version>.<type>.<array>.npy`` (optional): arrays of an ANN
+  structure built over those vectors (see ann.py), memory-mapped as well.
+- ``<name>.json``: manifest with the version, shape, embedding model, texts and
+  per-row metadata (e.g. ``course_code`` and ``n_tokens``, the token count of
+  each text under the ``tokenizer`` encoding). It is written last and atomically
+  (``os.replace``), so readers never see a manifest pointing at a half-written
+  vector file.
+
+Because everything large is memory-mapped read-only, every worker process on
+the host maps the same physical pages from the page cache instead of keeping
+its own copy (see memory.py for the per-worker self-check).
+
+The legacy ``text,embedding[,...]`` CSV format is still supported for import
+and export.
+"""
+import json
+import os
+import re
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from . import ann as ann_types
+from .retrieval import VectorIndex, normalize_rows
+
+INDEX_FORMAT = 1
+VECTOR_DTYPE = "float32"
+# Versión: fecha y hora UTC con microsegundos (ver save_index)
+VERSION_PATTERN = r"\d{8}T\d{6}\.\d{6}"
+
+
+def manifest_path(directory, name: str) -> Path:
+    return Path(directory) / f"{name}.json"
+
+
+def _write_atomic(path: Path, write) -> None:
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def save_index(
+        directory,
+        name: str,
+        texts: list[str],
+        embeddings,
+        metadata: dict | None = None,
+        model: str | None = None,
+        tokenizer: str | None = None,
+        keep_versions: int = 2,
+        ann: dict | None = None,
+) -> Path:
+    """Write a new version of an index and publish it. Returns the manifest path.
+
+    `ann` optionally builds an ANN structure over the vectors, e.g.
+    ``{"type": "ivf", "nlist": 1024, "nprobe": 16}``.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    matrix = normalize_rows(embeddings)
+    if len(texts) != matrix.shape[0]:
+        raise ValueError(f"Got {len(texts)} texts but {matrix.shape[0]} embeddings")
+
+    now = time.time()
+    # En UTC: con la hora local, al terminar el horario de verano una versión nueva quedaría antes que la anterior
+    version = time.strftime("%Y%m%dT%H%M%S", time.gmtime(now)) + f".{int(now * 1e6) % 1_000_000:06d}"
+    vectors_file = f"{name}-{version}.f32"
+    _write_atomic(directory / vectors_file, lambda f: f.write(matrix.tobytes(order="C")))
+
+    ann_entry = None
+    if ann:
+        structure = ann_types.build_ann(matrix, **ann)
+        ann_files = {}
+        for key, array in structure.arrays().items():
+            ann_files[key] = f"{name}-{version}.{structure.kind}.{key}.npy"
+            _write_atomic(directory / ann_files[key], lambda f: np.save(f, np.ascontiguousarray(array)))
+        ann_entry = {"type": structure.kind, "files": ann_files, "params": structure.params}
+
+    manifest = {
+        "format": INDEX_FORMAT,
+        "name": name,
+        "version": version,
+        "model": model,
+        "tokenizer": tokenizer,
+        "dtype": VECTOR_DTYPE,
+        "count": int(matrix.shape[0]),
+        "dim": int(matrix.shape[1]),
+        "vectors": vectors_file,
+        "texts": list(texts),
+        "metadata": {key: list(values) for key, values in (metadata or {}).items()},
+        "ann": ann_entry,
+    }
+    path = manifest_path(directory, name)
+    _write_atomic(path, lambda f: f.write(json.dumps(manifest, ensure_ascii=False).encode("utf-8")))
+
+    prune_versions(directory, name, keep=keep_versions)
+    return path
+
+
+def prune_versions(directory, name: str, keep: int = 2) -> None:
+    """Delete the files of old versions, keeping the `keep` most recently written ones.
+
+    The previous version is kept by default so workers that are still
+    serving requests from it are not affected, and the version the manifest
+    points to is never deleted. Only files named ``<name>-<version>`` are
+    considered, not those of other indexes whose name starts with `name`.
+    """
+    directory = Path(directory)
+    pattern = re.compile(rf"{re.escape(name)}-{VERSION_PATTERN}\.f32")
+    vector_files = sorted((path for path in directory.glob(f"{name}-*.f32") if pattern.fullmatch(path.name)),
+                          key=lambda path: (path.stat().st_mtime, path.name))
+    try:
+        current = read_manifest(manifest_path(directory, name))["vectors"]
+    except (OSError, ValueError):
+        current = None
+    for old in vector_files[:-keep] if keep > 0 else vector_files:
+        if old.name == current:
+            continue
+        # Vectores y archivos auxiliares de la misma versión
+        for path in directory.glob(f"{old.stem}.*"):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+def read_manifest(path) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != INDEX_FORMAT:
+        raise ValueError(f"Unsupported index format in {path}: {manifest.get('format')}")
+    return manifest
+
+
+def load_index(path) -> VectorIndex:
+    """Load an index from its manifest, memory-mapping the vector file read-only."""
+    path = Path(path)
+    manifest = read_manifest(path)
+    matrix = np.memmap(
+        path.parent / manifest["vectors"],
+        dtype=manifest["dtype"],
+        mode="r",
+        shape=(manifest["count"], manifest["dim"]),
+    )
+    index = VectorIndex(
+        manifest["texts"],
+        matrix,
+        metadata=manifest["metadata"],
+        normalized=True,
+        version=manifest["version"],
+        model=manifest.get("model"),
+        tokenizer=manifest.get("tokenizer"),
+    )
+    ann_entry = manifest.get("ann")
+    if ann_entry:
+        arrays = {key: np.load(path.parent / file, mmap_mode="r") for key, file in ann_entry["files"].items()}
+        index.ann = ann_types.load_ann(ann_entry["type"], arrays, ann_entry["params"])
+    return index
+
+
+def read_embeddings_csv(path) -> tuple[list[str], np.ndarray, dict]:
+    """Import a legacy embeddings CSV. Returns texts, an (n, dim) matrix and metadata columns."""
+    df = pd.read_csv(path)
+    # Los embeddings se guardan como listas JSON; json.loads es mucho más rápido que ast.literal_eval
+    embeddings = np.array([json.loads(value) for value in df["embedding"]], dtype=np.float32)
+    metadata = {column: df[column].tolist() for column in df.columns if column not in ("text", "embedding")}
+    return df["text"].tolist(), embeddings, metadata
+
+
+def load_csv_index(path) -> VectorIndex:
+    texts, embeddings, metadata = read_embeddings_csv(path)
+    return VectorIndex(texts, embeddings, metadata=metadata)
+
+
+def write_embeddings_csv(path, texts: list[str], embeddings, metadata: dict | None = None) -> Path:
+    """Export embeddings in the legacy CSV format."""
+    df = pd.DataFrame({"text": texts, "embedding": [list(map(float, row)) for row in np.asarray(embeddings)]})
+    for key, values in (metadata or {}).items():
+        df[key] = values
+    df.to_csv(path, index=False)
+    return Path(path)
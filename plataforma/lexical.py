@@ -0,0 +1,137 @@
+"""
+Lexical (BM25) retrieval over the same texts as the embedding index.
+
+Exact terms such as course codes (``EPG4001``), keywords or author names are
+matched through an in-memory inverted index instead of a dense embedding, and
+its ranking is fused with the vector ranking by reciprocal-rank fusion (RRF).
+A query that names a course code present in the index is answered from the
+inverted index alone, without calling the embedding API.
+"""
+import math
+import re
+import unicodedata
+
+import numpy as np
+
+from .retrieval import VectorIndex, top_k
+
+# Palabras vacías frecuentes en las preguntas; no aportan al ranking
+STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante como con cual cuales cuando de del desde donde el ella
+en entre es esta estas este esto estos hay la las le les lo los mas me mi muy no o para pero por que
+se segun ser si sin sobre son su sus tiene tienen un una unas uno unos y ya
+""".split())
+
+COURSE_CODE_RE = re.compile(r"\b([A-Za-z]{3})[\s-]?(\d{4})\b")
+CODE_IN_TEXT_RE = re.compile(r"Código: (\S+)")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase words without accents, minus stopwords."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [word for word in re.findall(r"\w+", text) if word not in STOPWORDS]
+
+
+def course_codes_in(query: str) -> list[str]:
+    """Course codes mentioned in a query, normalized (``epg 4001`` -> ``EPG4001``)."""
+    codes = []
+    for letters, digits in COURSE_CODE_RE.findall(query):
+        code = f"{letters.upper()}{digits}"
+        if code not in codes:
+            codes.append(code)
+    return codes
+
+
+class BM25Index:
+    """Okapi BM25 over an inverted index (term -> row ids and term frequencies)."""
+
+    def __init__(self, documents: list[str], course_codes: list[str] | None = None, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.size = len(documents)
+        postings: dict[str, dict[int, int]] = {}
+        lengths = np.zeros(self.size, dtype=np.float32)
+        for row, document in enumerate(documents):
+            terms = tokenize(document)
+            lengths[row] = len(terms)
+            for term in terms:
+                counts = postings.setdefault(term, {})
+                counts[row] = counts.get(row, 0) + 1
+        self.postings = {
+            term: (np.fromiter(counts.keys(), dtype=np.intp, count=len(counts)),
+                   np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+            for term, counts in postings.items()
+        }
+        average = lengths.mean() if self.size else 0.0
+        # Parte de la normalización por largo que no depende del término
+        self._length_norm = k1 * (1 - b + b * lengths / average) if average else np.full(self.size, k1)
+
+        # Filas de cada curso, para responder preguntas por código sin embedding
+        self.code_rows: dict[str, list[int]] = {}
+        for row, code in enumerate(course_codes or []):
+            if code:
+                self.code_rows.setdefault(str(code).upper(), []).append(row)
+
+    def idf(self, term: str) -> float:
+        rows, _ = self.postings.get(term, ((), None))
+        df = len(rows)
+        return math.log(1 + (self.size - df + 0.5) / (df + 0.5))
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every row; rows sharing no term with the query score 0."""
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            rows, tf = posting
+            scores[rows] += self.idf(term) * tf * (self.k1 + 1) / (tf + self._length_norm[rows])
+        return scores
+
+    def search(self, query: str, top_n: int = 100, rows=None) -> tuple[np.ndarray, np.ndarray]:
+        """Return (indices, scores) of the `top_n` best rows with a positive score.
+
+        When `rows` is given only those rows are considered.
+        """
+        scores = self.scores(query)
+        if rows is not None:
+            allowed = np.zeros(self.size, dtype=bool)
+            allowed[rows] = True
+            scores[~allowed] = 0
+        indices = top_k(scores, min(top_n, int(np.count_nonzero(scores))))
+        return indices, scores[indices]
+
+    def exact_matches(self, query: str, rows=None) -> list[int]:
+        """Rows of the courses whose code appears in `query`, in the order they are mentioned."""
+        allowed = None if rows is None else set(np.asarray(rows).tolist())
+        matches = []
+        for code in course_codes_in(query):
+            matches.extend(row for row in self.code_rows.get(code, []) if allowed is None or row in allowed)
+        return matches
+
+
+def lexical_index(index: VectorIndex) -> BM25Index:
+    """BM25 index over the texts of `index`, built once and kept on the index.
+
+    Keywords stored with the index (``palabras_clave``) are indexed along with
+    each text.
+    """
+    if index.lexical is None:
+        keywords = index.metadata.get("palabras_clave")
+        documents = [f"{text} {keywords[i]}" for i, text in enumerate(index.texts)] if keywords else index.texts
+        codes = index.metadata.get("course_code")
+        if codes is None:
+            # Índices importados sin metadata: el código viene en el texto
+            codes = [(CODE_IN_TEXT_RE.search(text) or [None, None])[1] for text in index.texts]
+        index.lexical = BM25Index(documents, course_codes=codes)
+    return index.lexical
+
+
+def reciprocal_rank_fusion(*rankings, k: int = 60) -> np.ndarray:
+    """Fuse rankings of row ids into one, scoring each row by sum(1 / (k + rank))."""
+    fused: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            fused[int(row)] = fused.get(int(row), 0.0) + 1.0 / (k + rank)
+    return np.array(sorted(fused, key=fused.get, reverse=True), dtype=np.intp)
@@ -0,0 +1,45 @@
+"""
+Memory of the embedding indexes in this process (see plataforma/memory.py).
+
+    python manage.py index_memory --touch         # lee todas las páginas antes de medir
+    python manage.py index_memory --corpus mia --json
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from plataforma.index_registry import UnknownCorpus, index_registry
+from plataforma.memory import index_memory_report
+
+
+class Command(BaseCommand):
+    help = "Memoria residente, compartida y copiada de los índices de embeddings cargados en este proceso"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--corpus", action="append", help="Corpus a cargar (por defecto, todos)")
+        parser.add_argument("--touch", action="store_true",
+                            help="Leer todas las páginas de los arreglos antes de medir, como una búsqueda exacta")
+        parser.add_argument("--json", action="store_true", help="Imprimir el reporte completo en JSON")
+
+    def handle(self, *args, **options):
+        for name in options["corpus"] or list(index_registry.corpora):
+            try:
+                index_registry.get(name)
+            except UnknownCorpus:
+                raise CommandError(f"Corpus desconocido: {name}")
+        report = index_memory_report(index_registry, touch=options["touch"])
+        if report is None:
+            raise CommandError("Autochequeo de memoria no disponible (sin /proc)")
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        mb = 1024 * 1024
+        for name, corpus in report["corpora"].items():
+            self.stdout.write(
+                f"📦 {name} ({corpus['version']}): {corpus['nbytes'] / mb:.1f} MB de índice, "
+                f"{corpus['rss'] / mb:.1f} MB residentes, {corpus['shared'] / mb:.1f} MB compartidos, "
+                f"{corpus['copied'] / mb:.1f} MB copiados{'' if corpus['mapped'] else ' (no mapeado: índice CSV)'}"
+            )
+        if report["process_rss"] is not None:
+            self.stdout.write(f"🧠 Proceso {report['pid']}: {report['process_rss'] / mb:.1f} MB residentes en total")
@@ -0,0 +1,27 @@
+"""
+Delete chat conversations (and their turns) that have been inactive for a while.
+
+    python manage.py prune_conversations             # más de RAG_CONVERSATION_RETENTION_DAYS días sin actividad
+    python manage.py prune_conversations --days 7
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from plataforma.conversations import delete_inactive
+
+
+class Command(BaseCommand):
+    help = "Borra las conversaciones del chat sin actividad (según updated_at) y sus turnos"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=float, default=getattr(settings, 'RAG_CONVERSATION_RETENTION_DAYS', 30),
+                            help="Días sin actividad (por defecto RAG_CONVERSATION_RETENTION_DAYS)")
+
+    def handle(self, *args, **options):
+        if options["days"] < 0:
+            raise CommandError("--days no puede ser negativo")
+        deleted = delete_inactive(timezone.now() - timedelta(days=options["days"]))
+        self.stdout.write(f"🧹 {deleted} conversaciones borradas")
@@ -0,0 +1,165 @@
+"""
+Per-process memory accounting of the loaded indexes (Linux only).
+
+Index vectors and ANN arrays are memory-mapped read-only files (see
+index_store.py), so every worker of a multi-process deployment (gunicorn,
+uWSGI, ...) maps the same physical pages from the page cache. This module
+reads ``/proc/self/smaps`` to check that this actually holds: for each
+loaded corpus it reports how many bytes of its arrays are resident in this
+process, how many of those are shared with other processes, and how many are
+copies that belong to this process alone (anonymous memory such as CSV
+indexes parsed into the heap, or written pages of a mapping), which no other
+worker can share.
+
+Workers only log the cheap report (what is resident and mapped right now)
+at startup. Reading every page to see what the searches would keep resident
+is left to ``python manage.py index_memory --touch``: doing it in every
+worker would page in the whole float32 matrix, which the quantized and PCA
+first stages exist to avoid.
+
+On systems without ``/proc`` every function returns None.
+"""
+import logging
+import os
+import re
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SMAPS_PATH = "/proc/self/smaps"
+STATUS_PATH = "/proc/self/status"
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+_MAPPING_RE = re.compile(r"^([0-9a-f]+)-([0-9a-f]+) \S+ \S+ \S+ \S+\s*(.*)$")
+
+
+def read_smaps(path: str = SMAPS_PATH) -> list[dict] | None:
+    """Mappings of this process: start/end address, file and SMAPS_FIELDS in bytes."""
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    mappings = []
+    for line in lines:
+        match = _MAPPING_RE.match(line)
+        if match:
+            start, end, pathname = match.groups()
+            mappings.append({"start": int(start, 16), "end": int(end, 16), "path": pathname})
+            continue
+        key, _, value = line.partition(":")
+        if mappings and key in SMAPS_FIELDS:
+            mappings[-1][key] = int(value.split()[0]) * 1024
+    return mappings
+
+
+def process_rss(path: str = STATUS_PATH) -> int | None:
+    """Resident set size of this process in bytes."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def touch_pages(array: np.ndarray, page_size: int = PAGE_SIZE) -> None:
+    """Read one byte per page of `array` so its mapped pages become resident."""
+    if array.nbytes and array.flags.c_contiguous:
+        int(array.reshape(-1).view(np.uint8)[::page_size].sum())
+
+
+def buffer_memory(array: np.ndarray, mappings: list[dict]) -> dict:
+    """Resident/shared/copied bytes of the mappings that hold `array`'s buffer.
+
+    Figures are per mapping, so a small array inside a larger heap mapping is
+    charged the whole mapping; only the vector-sized arrays matter here.
+    """
+    start = array.__array_interface__["data"][0]
+    end = start + array.nbytes
+    totals = dict.fromkeys(SMAPS_FIELDS, 0)
+    files = set()
+    copied = 0
+    for mapping in mappings:
+        if mapping["start"] < end and start < mapping["end"]:
+            for key in SMAPS_FIELDS:
+                totals[key] += mapping.get(key, 0)
+            if mapping["path"].startswith("/"):
+                files.add(mapping["path"])
+                # Mapeo de un archivo: las páginas limpias quedan en el page cache (compartibles); solo las escritas son copias
+                copied += mapping.get("Private_Dirty", 0)
+            else:
+                copied += mapping.get("Private_Clean", 0) + mapping.get("Private_Dirty", 0)
+    return {
+        "nbytes": int(array.nbytes),
+        "rss": totals["Rss"],
+        "pss": totals["Pss"],
+        "shared": totals["Shared_Clean"] + totals["Shared_Dirty"],
+        "copied": copied,
+        "files": sorted(files),
+    }
+
+
+def index_arrays(index) -> dict[str, np.ndarray]:
+    """The large arrays of a VectorIndex: its matrix and its ANN structure's arrays."""
+    arrays = {"matrix": index.matrix}
+    if index.ann is not None:
+        arrays.update({f"ann.{key}": array for key, array in index.ann.arrays().items()})
+    return arrays
+
+
+def index_memory_report(registry, touch: bool = False) -> dict | None:
+    """Memory of every loaded corpus of `registry` in this process.
+
+    With `touch`, every page of the arrays is read first, as a full scan
+    would: a freshly forked worker has no mapped page resident yet.
+    """
+    if not os.path.exists(SMAPS_PATH):
+        return None
+    loaded = {name: corpus.loaded for name, corpus in registry.corpora.items() if corpus.loaded is not None}
+    if touch:
+        for entry in loaded.values():
+            for array in index_arrays(entry.index).values():
+                touch_pages(np.asarray(array))
+    mappings = read_smaps()
+    if mappings is None:
+        return None
+    corpora = {}
+    for name, entry in loaded.items():
+        arrays = {key: buffer_memory(np.asarray(array), mappings) for key, array in index_arrays(entry.index).items()}
+        corpora[name] = {
+            "version": entry.version,
+            "nbytes": sum(array["nbytes"] for array in arrays.values()),
+            "rss": sum(array["rss"] for array in arrays.values()),
+            "shared": sum(array["shared"] for array in arrays.values()),
+            "copied": sum(array["copied"] for array in arrays.values()),
+            "mapped": all(array["files"] for array in arrays.values()),
+            "arrays": arrays,
+        }
+    return {"pid": os.getpid(), "process_rss": process_rss(), "corpora": corpora}
+
+
+def log_index_memory(registry, touch: bool = False) -> dict | None:
+    """Log (and return) index_memory_report, warning about indexes held as per-process copies."""
+    report = index_memory_report(registry, touch=touch)
+    if report is None:
+        logger.info("Autochequeo de memoria no disponible (sin /proc) en el proceso %d", os.getpid())
+        return None
+    mb = 1024 * 1024
+    for name, corpus in report["corpora"].items():
+        logger.info(
+            "Proceso %d, corpus '%s' (%s): %.1f MB de índice, %.1f MB residentes, %.1f MB compartidos, %.1f MB copiados",
+            report["pid"], name, corpus["version"], corpus["nbytes"] / mb, corpus["rss"] / mb,
+            corpus["shared"] / mb, corpus["copied"] / mb,
+        )
+        if not corpus["mapped"]:
+            logger.warning(
+                "El corpus '%s' no está mapeado desde un archivo (índice CSV); cada worker tendrá su propia copia. "
+                "Publícalo con generate_mia_embeddings.py para compartirlo entre procesos.", name,
+            )
+    if report["process_rss"] is not None:
+        logger.info("Proceso %d: %.1f MB residentes en total", report["pid"], report["process_rss"] / mb)
+    return report
@@ -0,0 +1,282 @@
+"""
+Per-stage timings of chat requests: ``Server-Timing`` header and Prometheus metrics.
+
+Code on the chat path wraps each stage in ``span("embedding")``,
+``span("vector")``, ... A request's spans are collected in the
+``RequestTimings`` bound to a context variable by ``server_timing_middleware``
+(see middleware.py), so spans recorded under ``sync_to_async`` count for the
+same request, and are returned as the ``Server-Timing`` header. Every span is
+also observed in the process-wide ``STAGE_SECONDS`` histogram, which the
+``prometheus_metrics`` view exports in the Prometheus text format together with token
+counts and cache hit rates.
+
+Spans recorded after the response started (the chat completion of a streamed
+answer) only reach the histograms. Metrics are kept per process: with several
+workers each one reports its own.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 3072, 4096, 8192, 16384)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 100)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter per combination of label values."""
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels[name] for name in self.labels), 0)
+
+    def items(self) -> list[tuple[tuple, float]]:
+        return sorted(self._values.items())
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self.items():
+            lines.append(f"{self.name}{_labels(self.labels, key)} {_number(value)}")
+        return lines
+
+
+class Gauge:
+    """Current value of something that goes up and down."""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._value = 0
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    def value(self) -> float:
+        return self._value
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {_number(self._value)}"]
+
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus style) per combination of label values."""
+
+    def __init__(self, name: str, help: str, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.labels = tuple(labels)
+        # Por serie: conteo por bucket (no acumulado), suma y cantidad
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def series(self) -> list[tuple]:
+        return sorted(self._series)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(labels[name] for name in self.labels))
+        return series[2] if series else 0
+
+    def quantile(self, q: float, **labels) -> float | None:
+        """Estimate of the `q` quantile, interpolating within buckets like PromQL's histogram_quantile."""
+        series = self._series.get(tuple(labels[name] for name in self.labels))
+        if not series or not series[2]:
+            return None
+        rank = q * series[2]
+        cumulative = 0
+        for i, count in enumerate(series[0]):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i]
+                if upper == float("inf"):
+                    return lower
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-2]
+
+    def summary(self, **labels) -> dict:
+        series = self._series.get(tuple(labels[name] for name in self.labels))
+        if not series:
+            return {"count": 0}
+        return {
+            "count": series[2],
+            "sum": series[1],
+            **{f"p{round(q * 100)}": self.quantile(q, **labels) for q in QUANTILES},
+        }
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key in self.series():
+            counts, total, count = self._series[key]
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _labels(self.labels + ("le",), key + (_number(bucket),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Duración de cada etapa del chat", LATENCY_BUCKETS, labels=("stage",))
+TOKENS = Histogram("rag_tokens", "Tokens por respuesta del chat", TOKEN_BUCKETS, labels=("kind",))
+CHAT_REQUESTS = Counter("rag_chat_requests_total", "Preguntas recibidas por el chat", labels=("mode",))
+# leader: generó la respuesta; follower: esperó la de otra pregunta idéntica en curso en el proceso;
+# remote: la recibió de otro worker (singleflight.DatabaseLocks)
+SINGLE_FLIGHT = Counter("rag_single_flight_total", "Preguntas agrupadas por single flight", labels=("role",))
+# Ver embedding_batcher.py
+EMBEDDING_BATCH_SIZE = Histogram("rag_embedding_batch_size", "Consultas por llamada a la API de embeddings",
+                                 BATCH_BUCKETS)
+EMBEDDING_QUEUE_DEPTH = Gauge("rag_embedding_queue_depth", "Consultas esperando el próximo lote de embeddings")
+
+
+class RequestTimings:
+    """Spans of one request, in the order they ended."""
+
+    def __init__(self):
+        self.spans: list[tuple[str, float]] = []
+
+    def add(self, name: str, seconds: float) -> None:
+        self.spans.append((name, seconds))
+
+    def totals(self) -> dict[str, float]:
+        totals: dict[str, float] = {}
+        for name, seconds in self.spans:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def header(self) -> str:
+        """``Server-Timing`` value, e.g. ``embedding;dur=120.5, search;dur=1.2`` (milliseconds)."""
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.totals().items())
+
+
+_current: ContextVar[RequestTimings | None] = ContextVar("rag_request_timings", default=None)
+
+
+def start_request():
+    """Bind a new RequestTimings to the current context. Returns (timings, token for end_request)."""
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def end_request(token) -> None:
+    _current.reset(token)
+
+
+def record(stage: str, seconds: float) -> None:
+    """Observe a finished stage in the histogram and in the current request, if any."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _current.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def span(stage: str):
+    """Time the block as `stage`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+def observe_tokens(prompt: int | None = None, completion: int | None = None) -> None:
+    """Observe the tokens of one answer (prompt and/or completion)."""
+    if prompt is not None:
+        TOKENS.observe(prompt, kind="prompt")
+    if completion is not None:
+        TOKENS.observe(completion, kind="completion")
+
+
+def observe_usage(response) -> None:
+    """Observe the token usage reported by a ChatCompletion response, if it has one."""
+    usage = response.get("usage") if hasattr(response, "get") else None
+    if usage:
+        observe_tokens(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+
+
+def render_prometheus(caches: dict[str, dict] | None = None) -> str:
+    """Every metric in the Prometheus text exposition format.
+
+    `caches` maps a cache name to its ``stats()`` (hits, misses, size, ...).
+    """
+    lines = (STAGE_SECONDS.render() + TOKENS.render() + CHAT_REQUESTS.render() + SINGLE_FLIGHT.render()
+             + EMBEDDING_BATCH_SIZE.render() + EMBEDDING_QUEUE_DEPTH.render())
+    if caches:
+        hits = ["# HELP rag_cache_hits_total Aciertos de cada cache", "# TYPE rag_cache_hits_total counter"]
+        misses = ["# HELP rag_cache_misses_total Fallos de cada cache", "# TYPE rag_cache_misses_total counter"]
+        ratio = ["# HELP rag_cache_hit_ratio Fracción de aciertos de cada cache", "# TYPE rag_cache_hit_ratio gauge"]
+        size = ["# HELP rag_cache_entries Entradas en memoria de cada cache", "# TYPE rag_cache_entries gauge"]
+        for name, stats in sorted(caches.items()):
+            label = _labels(("cache",), (name,))
+            hit_count = stats.get("hits", stats.get("l1_hits", 0) + stats.get("l2_hits", 0))
+            hits.append(f"rag_cache_hits_total{label} {hit_count}")
+            misses.append(f"rag_cache_misses_total{label} {stats.get('misses', 0)}")
+            ratio.append(f"rag_cache_hit_ratio{label} {_number(float(stats.get('hit_rate', 0.0)))}")
+            size.append(f"rag_cache_entries{label} {stats.get('size', 0)}")
+        lines += hits + misses + ratio + size
+    return "\n".join(lines) + "\n"
+
+
+def summary(caches: dict[str, dict] | None = None) -> dict:
+    """Count and p50/p95/p99 per stage and token kind, plus cache hit rates (for humans)."""
+    return {
+        "stages_seconds": {key[0]: STAGE_SECONDS.summary(stage=key[0]) for key in STAGE_SECONDS.series()},
+        "tokens": {key[0]: TOKENS.summary(kind=key[0]) for key in TOKENS.series()},
+        "chat_requests": {key[0]: value for key, value in CHAT_REQUESTS.items()},
+        "single_flight": {key[0]: value for key, value in SINGLE_FLIGHT.items()},
+        "embedding_batch_size": EMBEDDING_BATCH_SIZE.summary(),
+        "embedding_queue_depth": EMBEDDING_QUEUE_DEPTH.value(),
+        "caches": {name: {"hit_rate": stats.get("hit_rate", 0.0), "size": stats.get("size", 0)}
+                   for name, stats in (caches or {}).items()},
+    }
+
+
+def reset() -> None:
+    """Forget every observation (tests)."""
+    for metric in (STAGE_SECONDS, TOKENS, EMBEDDING_BATCH_SIZE):
+        metric._series.clear()
+    EMBEDDING_QUEUE_DEPTH.set(0)
+    for counter in (CHAT_REQUESTS, SINGLE_FLIGHT):
+        counter._values.clear()
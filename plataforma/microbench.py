@@ -0,0 +1,212 @@
+"""
+Micro-benchmarks of the RAG hot path, compared against a stored baseline.
+
+Cases:
+
+- ``strings_ranked_by_relatedness`` and ``query_message`` run on synthetic
+  corpora of 32 up to 100k chunks: the section chunks of the MIA catalog
+  replicated with vectors scattered around each course's real embedding.
+  The embedding API is stubbed with a fixed query vector.
+- ``num_tokens``, ``format_response`` and ``process_course_to_text`` run on
+  real catalog texts; they do not depend on the corpus size.
+
+Each case reports the time per call (best of several repeats), the peak
+memory allocated during one call and the memory it leaves allocated, both
+traced with tracemalloc. ``compare`` flags the metrics that got worse than
+the baseline by more than a tolerance.
+"""
+import json
+import platform
+import time
+import tracemalloc
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+from . import tokens
+from .courses import process_course_to_chunks, process_course_to_text
+from .retrieval import VectorIndex, normalize_rows
+
+DATA_DIR = Path(__file__).resolve().parent / "mia_data"
+BASELINE_PATH = DATA_DIR / "hotpath_baseline.json"
+SIZES = (32, 1_000, 10_000, 100_000)
+QUERY = "¿Qué cursos tratan sobre inferencia bayesiana?"
+QUERY_COURSE = "EPG4005"
+TOKEN_BUDGET = 4096 - 500
+# Tolerancias: aumento relativo permitido y aumento absoluto que se ignora (ruido). El tiempo
+# varía bastante en máquinas compartidas; en una dedicada conviene --time-tolerance 0.2
+TIME_TOLERANCE = 1.0
+MEMORY_TOLERANCE = 0.25
+TIME_SLACK_US = 5.0
+MEMORY_SLACK_BYTES = 64 * 1024
+
+ANSWER = (
+    "El curso Métodos Bayesianos (EPG4005) introduce la inferencia bayesiana. Además, compara el enfoque "
+    "bayesiano con la inferencia clásica. Los contenidos son: 1. Distribuciones a priori 2. Métodos MCMC "
+    "3. Modelos jerárquicos. Por otro lado, Métodos Bayesianos Avanzados (EPG4011) profundiza en modelos "
+    "no paramétricos. Finalmente, ambos cursos tienen 5 créditos. Evaluación: tareas y un proyecto final."
+)
+
+
+def load_catalog() -> dict:
+    files = sorted(DATA_DIR.glob("cursos_completo_*.json"), key=lambda p: p.stat().st_mtime)
+    with open(files[-1], encoding="utf-8") as f:
+        return json.load(f)
+
+
+def course_vectors() -> dict[str, np.ndarray]:
+    """Real embedding of each course, from the CSV index."""
+    from . import index_store
+
+    texts, embeddings, metadata = index_store.read_embeddings_csv(DATA_DIR / "mia_embeddings.csv")
+    return dict(zip(metadata["course_code"], normalize_rows(embeddings)))
+
+
+def synthetic_corpus(size: int, catalog: dict, vectors: dict, model: str, seed: int = 0) -> VectorIndex:
+    """`size` section chunks built like a published index (metadata, stored token counts).
+
+    Replicas of each catalog chunk get a distinct course code, a marker in the
+    text and a vector near the course's embedding.
+    """
+    base = [(code, section, text) for code, info in catalog.items()
+            for section, text in process_course_to_chunks(code, info) if code in vectors]
+    base_tokens = tokens.count_tokens([text for _, _, text in base], model)
+    rng = np.random.default_rng(seed)
+    dim = len(next(iter(vectors.values())))
+
+    texts, codes, sections, n_tokens = [], [], [], []
+    matrix = np.empty((size, dim), dtype=np.float32)
+    for row in range(size):
+        replica, i = divmod(row, len(base))
+        code, section, text = base[i]
+        suffix = f" [{replica}]" if replica else ""
+        texts.append(text + suffix)
+        codes.append(f"{code}.{replica}" if replica else code)
+        sections.append(section)
+        # Conteo aproximado: el sufijo empieza con espacio, así que se tokeniza aparte
+        n_tokens.append(base_tokens[i] + (tokens.num_tokens(suffix, model) if suffix else 0))
+        matrix[row] = vectors[code]
+    matrix += 0.02 * rng.standard_normal(matrix.shape, dtype=np.float32)
+    return VectorIndex(
+        texts, normalize_rows(matrix), normalized=True, version=f"synthetic-{size}",
+        metadata={"course_code": codes, "section": sections, "n_tokens": n_tokens},
+        tokenizer=tokens.encoding_for_model(model).name,
+    )
+
+
+def time_per_call(fn, repeat: int = 7, min_time: float = 0.2) -> float:
+    """Best time of `repeat` rounds, in seconds per call; each round lasts about `min_time` / `repeat`."""
+    started = time.perf_counter()
+    fn()
+    single = max(time.perf_counter() - started, 1e-7)
+    loops = max(1, int(min_time / repeat / single))
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        best = min(best, (time.perf_counter() - started) / loops)
+    return best
+
+
+def memory_per_call(fn) -> tuple[int, int]:
+    """(peak bytes allocated during one call, bytes still allocated after it)."""
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = fn()
+        after, peak = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    return peak - before, max(after - before, 0)
+
+
+def measure(fn, repeat: int = 7, min_time: float = 0.2) -> dict:
+    fn()  # Calentar caches (tokens por texto, índice léxico, ...)
+    peak, retained = memory_per_call(fn)
+    return {
+        "time_us": time_per_call(fn, repeat, min_time) * 1e6,
+        "peak_bytes": int(peak),
+        "retained_bytes": int(retained),
+    }
+
+
+def run_suite(sizes=SIZES, repeat: int = 7, min_time: float = 0.2, progress=None) -> dict:
+    """Measure every case. Returns ``{"meta": ..., "results": {"case@size": metrics}}``."""
+    from . import views
+
+    model = views.GPT_MODEL
+    catalog = load_catalog()
+    vectors = course_vectors()
+    query_vector = vectors[QUERY_COURSE].tolist()
+    course_code, course_info = QUERY_COURSE, catalog[QUERY_COURSE]
+    course_text = process_course_to_text(course_code, course_info)
+
+    results = {}
+
+    def record(key, fn):
+        results[key] = measure(fn, repeat, min_time)
+        if progress:
+            progress(key, results[key])
+
+    with mock.patch.object(views, "embed_query", return_value=query_vector):
+        record("num_tokens", lambda: views.num_tokens(course_text, model=model))
+        record("format_response", lambda: views.format_response(ANSWER))
+        record("process_course_to_text", lambda: process_course_to_text(course_code, course_info))
+        for size in sizes:
+            index = synthetic_corpus(size, catalog, vectors, model)
+            record(f"strings_ranked_by_relatedness@{size}",
+                   lambda: views.strings_ranked_by_relatedness(QUERY, index, top_n=100))
+            record(f"query_message@{size}", lambda: views.query_message(QUERY, index, model, TOKEN_BUDGET))
+            del index
+
+    return {
+        "meta": {
+            "python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+            "processor": platform.processor() or platform.machine(), "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, time_tolerance: float = TIME_TOLERANCE,
+            memory_tolerance: float = MEMORY_TOLERANCE) -> list[dict]:
+    """Metrics of `current` that regressed past `baseline`: ``[{"case", "metric", "baseline", "current", "ratio"}]``.
+
+    A metric regresses when it grows by more than its tolerance (relative) and
+    by more than a small absolute slack, so microsecond and few-KB noise on
+    tiny cases does not fail the run. Cases missing from the baseline are skipped.
+    """
+    checks = (("time_us", time_tolerance, TIME_SLACK_US),
+              ("peak_bytes", memory_tolerance, MEMORY_SLACK_BYTES),
+              ("retained_bytes", memory_tolerance, MEMORY_SLACK_BYTES))
+    regressions = []
+    for case, metrics in current["results"].items():
+        previous = baseline.get("results", {}).get(case)
+        if previous is None:
+            continue
+        for metric, tolerance, slack in checks:
+            old, new = previous.get(metric), metrics.get(metric)
+            if old is None or new is None:
+                continue
+            if new > old * (1 + tolerance) and new - old > slack:
+                regressions.append({"case": case, "metric": metric, "baseline": old, "current": new,
+                                    "ratio": new / old if old else float("inf")})
+    return regressions
+
+
+def load_baseline(path=BASELINE_PATH) -> dict | None:
+    path = Path(path)
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def save_baseline(results: dict, path=BASELINE_PATH) -> None:
+    Path(path).write_text(json.dumps(results, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
@@ -0,0 +1,41 @@
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+from . import metrics
+
+
+def add_server_timing(response, timings: metrics.RequestTimings, started: float):
+    """Add the request's spans (and its total) as a ``Server-Timing`` header, if any stage was timed."""
+    if timings.spans:
+        elapsed = time.perf_counter() - started
+        # En un stream, el total es hasta que empieza la respuesta; el resto solo llega a los histogramas
+        stage = "first_byte" if response.streaming else "total"
+        metrics.record(stage, elapsed)
+        response["Server-Timing"] = f"{timings.header()}, {stage};dur={elapsed * 1000:.1f}"
+    return response
+
+
+@sync_and_async_middleware
+def server_timing_middleware(get_response):
+    """Collect the timing spans of each request (see metrics.py) and return them as Server-Timing."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = time.perf_counter()
+            timings, token = metrics.start_request()
+            try:
+                response = await get_response(request)
+            finally:
+                metrics.end_request(token)
+            return add_server_timing(response, timings, started)
+    else:
+        def middleware(request):
+            started = time.perf_counter()
+            timings, token = metrics.start_request()
+            try:
+                response = get_response(request)
+            finally:
+                metrics.end_request(token)
+            return add_server_timing(response, timings, started)
+    return middleware
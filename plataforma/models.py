@@ -1,3 +1,43 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+
+class Conversation(models.Model):
+    """Chat conversation of a browser session (see conversations.py)."""
+    session_key = models.CharField(max_length=40, db_index=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+    # Turnos guardados y cuántos de ellos (los primeros) ya están compactados en el resumen
+    turn_count = models.PositiveIntegerField(default=0)
+    summarized_turns = models.PositiveIntegerField(default=0)
+    summary = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.session_key} ({self.turn_count} turnos)"
+
+
+class Turn(models.Model):
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='turns')
+    question = models.TextField()
+    answer = models.TextField()
+    n_tokens = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return self.question[:50]
+
+
+class SingleFlightLock(models.Model):
+    """Answer being generated by one worker for a question (see singleflight.DatabaseLocks)."""
+    key = models.CharField(max_length=64, unique=True)
+    owner = models.CharField(max_length=100)
+    answer = models.TextField(null=True, blank=True)
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.key[:12]} ({self.owner})"
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+# Con un índice (o un filtro) de menos filas que esto, recorrerlas todas es más barato que el ANN
+EXACT_SEARCH_MAX_ROWS = 10_000
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Return a contiguous float32 copy of `matrix` with unit-length rows.
+
+    Zero rows (e.g. failed embeddings) are left as zeros so they score 0
+    instead of NaN.
+    """
+    matrix = np.array(matrix, dtype=np.float32, order="C", ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Return the indices of the `k` highest scores, sorted from highest to lowest.
+
+    Uses a partial selection (argpartition) so only the k winners get sorted.
+    """
+    n = scores.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class VectorIndex:
+    """Exact cosine-similarity index over a pre-normalized float32 matrix."""
+
+    def __init__(
+            self,
+            texts,
+            embeddings,
+            metadata: dict | None = None,
+            normalized: bool = False,
+            version: str | None = None,
+            model: str | None = None,
+            tokenizer: str | None = None,
+    ):
+        self.texts = list(texts)
+        # A matrix that is already normalized (e.g. memory-mapped from disk) is used as is
+        self.matrix = embeddings if normalized else normalize_rows(embeddings)
+        self.metadata = dict(metadata or {})
+        self.version = version
+        self.model = model
+        # Encoding con el que se calcularon los `n_tokens` guardados en metadata
+        self.tokenizer = tokenizer
+        self.token_counts: dict[str, dict[str, int]] = {}
+        # Índices auxiliares construidos bajo demanda (ver lexical.py y filters.py)
+        self.lexical = None
+        self.metadata_index = None
+        # Primera etapa aproximada opcional (ver ann.py)
+        self.ann = None
+        if len(self.texts) != self.matrix.shape[0]:
+            raise ValueError(
+                f"Got {len(self.texts)} texts but {self.matrix.shape[0]} embeddings"
+            )
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> "VectorIndex":
+        """Build an index from a DataFrame with `text` and `embedding` (list) columns."""
+        metadata = {column: df[column].tolist() for column in df.columns if column not in ("text", "embedding")}
+        return cls(df["text"].tolist(), np.vstack(df["embedding"].to_numpy()), metadata=metadata)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def scores(self, query_embedding) -> np.ndarray:
+        """Cosine similarity of the query against every row, as one mat-vec product."""
+        query = normalize_rows(query_embedding)[0]
+        return self.matrix @ query
+
+    def search(
+            self, query_embedding, top_n: int = 100, rows=None, exact: bool | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return (indices, scores) of the `top_n` most related rows.
+
+        When `rows` is given (e.g. the rows left by a metadata filter) only
+        those are scored. If the index has an ANN structure only its candidates
+        are scored, unless `exact` is set. By default (`exact` None) the ANN is
+        skipped when there are at most EXACT_SEARCH_MAX_ROWS rows to score;
+        `exact=False` always uses it (benchmarks).
+        """
+        if exact is None:
+            exact = (len(self) if rows is None else len(rows)) <= EXACT_SEARCH_MAX_ROWS
+        use_ann = self.ann is not None and not exact
+        if rows is None and not use_ann:
+            scores = self.scores(query_embedding)
+            indices = top_k(scores, top_n)
+            return indices, scores[indices]
+        query = normalize_rows(query_embedding)[0]
+        if use_ann:
+            rows = self.ann.candidates(query, top_n, rows=rows)
+        rows = np.asarray(rows, dtype=np.intp)
+        scores = self.matrix[rows] @ query
+        best = top_k(scores, top_n)
+        return rows[best], scores[best]
+
+    def ranked_strings(
+            self, query_embedding, top_n: int = 100, rows=None
+    ) -> tuple[tuple[str, ...], tuple[float, ...]]:
+        """Return texts and relatednesses, sorted from most related to least."""
+        indices, scores = self.search(query_embedding, top_n, rows=rows)
+        strings = tuple(self.texts[i] for i in indices)
+        return strings, tuple(float(s) for s in scores)
+
+    def group(self, indices, column: str = "course_code") -> list[tuple[object, list[int]]]:
+        """Group row `indices` by a metadata column (e.g. the sections of each course).
+
+        Groups come in the order of their first row in `indices`, so a ranked
+        list gives groups ranked by their best row; rows keep their order
+        inside each group.
+        """
+        values = self.metadata[column]
+        groups: dict[object, list[int]] = {}
+        for i in indices:
+            groups.setdefault(values[i], []).append(int(i))
+        return list(groups.items())
+
+
+def as_vector_index(corpus) -> VectorIndex:
+    """Accept either a VectorIndex or a legacy embeddings DataFrame."""
+    if isinstance(corpus, VectorIndex):
+        return corpus
+    return VectorIndex.from_dataframe(corpus)
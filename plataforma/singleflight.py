@@ -0,0 +1,310 @@
+"""
+Single-flight coalescing of identical in-flight chat answers.
+
+While an answer is being generated for a key (the answer scope and the
+normalized question, see views.flight_key), other requests with the same key
+do not call OpenAI: they follow the leader's flight and receive the same
+events as they are produced (``("token", text)`` chunks when streaming, then
+``("done", answer)``). Flights are shared by the threads of a process (WSGI)
+and by their event loops (async views), so a follower never blocks its loop.
+
+With ``locks`` (``DatabaseLocks``) the leader of each process also takes a
+lock row in the database, so identical questions on other workers wait for
+its answer instead of generating their own. Followers on other workers
+receive the answer in one piece when it is done.
+
+If the leader's client disconnects before any event was produced, its
+followers start over (one of them becomes the new leader); errors raised
+while generating the answer are raised to every follower.
+"""
+import asyncio
+import hashlib
+import os
+import socket
+import threading
+import time
+from contextlib import aclosing, closing
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import metrics
+from .models import SingleFlightLock
+
+
+class LeaderGone(Exception):
+    """The leader stopped (its client disconnected) before finishing the answer."""
+
+
+class Flight:
+    """Events of one in-flight answer, readable by several threads and event loops."""
+
+    def __init__(self):
+        self.events: list[tuple[str, str]] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self._condition = threading.Condition()
+        # (loop, asyncio.Event) de los seguidores async que esperan el próximo evento
+        self._waiters: list = []
+
+    def _wake(self) -> None:
+        # Debe llamarse con _condition tomado
+        self._condition.notify_all()
+        for loop, wake in self._waiters:
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                pass  # El loop del seguidor ya se cerró
+        self._waiters = []
+
+    def publish(self, event: tuple[str, str]) -> None:
+        with self._condition:
+            self.events.append(event)
+            self._wake()
+
+    def finish(self, error: BaseException | None = None) -> None:
+        with self._condition:
+            self.done = True
+            self.error = error
+            self._wake()
+
+    def follow(self):
+        """Yield every event of the flight (blocking), then raise the leader's error if it failed."""
+        seen = 0
+        while True:
+            with self._condition:
+                while seen == len(self.events) and not self.done:
+                    self._condition.wait()
+                events, done, error = self.events[seen:], self.done, self.error
+            seen += len(events)
+            yield from events
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+    async def afollow(self):
+        """Async version of follow(): waits without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        seen = 0
+        while True:
+            with self._condition:
+                events, done, error = self.events[seen:], self.done, self.error
+                if not events and not done:
+                    wake = asyncio.Event()
+                    self._waiters.append((loop, wake))
+            if not events and not done:
+                await wake.wait()
+                continue
+            seen += len(events)
+            for event in events:
+                yield event
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+
+class DatabaseLocks:
+    """Cross-worker single flight through ``SingleFlightLock`` rows (one per in-flight key).
+
+    The leader's row expires after `ttl` seconds if it dies without releasing
+    it. A published answer stays readable for `linger` seconds so workers that
+    were polling get it.
+    """
+
+    def __init__(self, ttl: float = 120, linger: float = 10, poll_interval: float = 0.1):
+        self.ttl = ttl
+        self.linger = linger
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    @staticmethod
+    def row_key(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def step(self, key: str) -> tuple[bool, str | None]:
+        """One attempt to lead `key`.
+
+        Returns (True, None) if this worker now holds the lock, (False, answer)
+        if another worker published its answer and (False, None) to keep waiting.
+        """
+        now = timezone.now()
+        row_key = self.row_key(key)
+        SingleFlightLock.objects.filter(expires_at__lt=now).delete()
+        try:
+            with transaction.atomic():
+                SingleFlightLock.objects.create(key=row_key, owner=self.owner,
+                                                expires_at=now + timedelta(seconds=self.ttl))
+            return True, None
+        except IntegrityError:
+            pass
+        return False, SingleFlightLock.objects.filter(key=row_key).values_list("answer", flat=True).first()
+
+    def release(self, key: str, answer: str | None = None) -> None:
+        """Publish the answer for the waiting workers, or drop the lock if there is none."""
+        rows = SingleFlightLock.objects.filter(key=self.row_key(key), owner=self.owner)
+        if answer is None:
+            rows.delete()
+        else:
+            rows.update(answer=answer, expires_at=timezone.now() + timedelta(seconds=self.linger))
+
+
+class SingleFlight:
+    def __init__(self, enabled: bool = True, locks: DatabaseLocks | None = None):
+        self.enabled = enabled
+        self.locks = locks
+        self._flights: dict[str, Flight] = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: str) -> tuple[Flight, bool]:
+        """The flight of `key` and whether the caller leads it."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                metrics.SINGLE_FLIGHT.inc(role="follower")
+                return flight, False
+            flight = self._flights[key] = Flight()
+            metrics.SINGLE_FLIGHT.inc(role="leader")
+            return flight, True
+
+    def _finish(self, key: str, flight: Flight, error: BaseException | None = None) -> None:
+        # Primero se retira: las preguntas que llegan después ya encuentran la respuesta en el cache
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(error)
+
+    def _lead(self, key: str, events):
+        if self.locks is not None:
+            while True:
+                leader, answer = self.locks.step(key)
+                if leader:
+                    break
+                if answer is not None:
+                    metrics.SINGLE_FLIGHT.inc(role="remote")
+                    yield "token", answer
+                    yield "done", answer
+                    return
+                time.sleep(self.locks.poll_interval)
+
+        answer = None
+        try:
+            with closing(events()) as produced:
+                for event in produced:
+                    if event[0] == "done":
+                        answer = event[1]
+                    yield event
+        finally:
+            if self.locks is not None:
+                self.locks.release(key, answer)
+
+    async def _alead(self, key: str, events):
+        if self.locks is not None:
+            while True:
+                leader, answer = await sync_to_async(self.locks.step)(key)
+                if leader:
+                    break
+                if answer is not None:
+                    metrics.SINGLE_FLIGHT.inc(role="remote")
+                    yield "token", answer
+                    yield "done", answer
+                    return
+                await asyncio.sleep(self.locks.poll_interval)
+
+        answer = None
+        try:
+            # Cerrar explícitamente: así el stream de OpenAI se corta apenas se desconecta el cliente
+            async with aclosing(events()) as produced:
+                async for event in produced:
+                    if event[0] == "done":
+                        answer = event[1]
+                    yield event
+        finally:
+            if self.locks is not None:
+                await sync_to_async(self.locks.release)(key, answer)
+
+    def stream(self, key: str | None, events):
+        """Yield the events of `events()` (a generator function), sharing them with identical requests.
+
+        Without a key (or disabled) `events()` runs for this caller alone.
+        """
+        if key is None or not self.enabled:
+            yield from events()
+            return
+        while True:
+            flight, leader = self._join(key)
+            if leader:
+                break
+            emitted = False
+            try:
+                for event in flight.follow():
+                    emitted = True
+                    yield event
+                return
+            except LeaderGone:
+                if emitted:
+                    raise
+
+        try:
+            with closing(self._lead(key, events)) as leading:
+                for event in leading:
+                    flight.publish(event)
+                    yield event
+        except BaseException as error:
+            # GeneratorExit o cancelación: el cliente del líder se desconectó
+            self._finish(key, flight, error if isinstance(error, Exception) else LeaderGone())
+            raise
+        self._finish(key, flight)
+
+    async def astream(self, key: str | None, events):
+        """Async version of stream(); `events` is an async generator function."""
+        if key is None or not self.enabled:
+            async for event in events():
+                yield event
+            return
+        while True:
+            flight, leader = self._join(key)
+            if leader:
+                break
+            emitted = False
+            try:
+                async for event in flight.afollow():
+                    emitted = True
+                    yield event
+                return
+            except LeaderGone:
+                if emitted:
+                    raise
+
+        try:
+            async with aclosing(self._alead(key, events)) as leading:
+                async for event in leading:
+                    flight.publish(event)
+                    yield event
+        except BaseException as error:
+            self._finish(key, flight, error if isinstance(error, Exception) else LeaderGone())
+            raise
+        self._finish(key, flight)
+
+    def do(self, key: str | None, fn):
+        """Return ``fn()``, computed once for concurrent callers with the same key."""
+        def events():
+            yield "done", fn()
+
+        result = None
+        for event, result in self.stream(key, events):
+            pass
+        return result
+
+    async def ado(self, key: str | None, fn):
+        """Async version of do(); `fn` is a coroutine function."""
+        async def events():
+            yield "done", await fn()
+
+        result = None
+        async for event, result in self.astream(key, events):
+            pass
+        return result
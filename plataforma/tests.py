@@ -1,3 +1,1149 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import openai
+import pandas as pd
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import ann, evaluation, fake_openai, index_store, memory, metrics, microbench, tokens, views
+from .answer_cache import SemanticAnswerCache
+from .conversations import TOKENS_PER_MESSAGE, ConversationStore
+from .embedding_batcher import EmbeddingBatcher
+from .embedding_cache import QueryEmbeddingCache
+from .filters import metadata_index
+from .index_registry import IndexRegistry, UnknownCorpus
+from .middleware import server_timing_middleware
+from .models import Conversation, SingleFlightLock, Turn
+from .retrieval import VectorIndex
+from .singleflight import DatabaseLocks, SingleFlight
+
+_module_patches = []
+
+
+def isolate_caches(test=None):
+    """Give the views fresh in-memory embedding and answer caches (never the shared SQLite file).
+
+    With a test, the caches are restored when it ends.
+    """
+    patches = [
+        mock.patch.object(views, "query_embedding_cache", QueryEmbeddingCache(views.EMBEDDING_MODEL)),
+        mock.patch.object(views, "answer_cache", SemanticAnswerCache()),
+    ]
+    for patch in patches:
+        patch.start()
+        if test is not None:
+            test.addCleanup(patch.stop)
+    return patches
+
+
+def setUpModule():
+    _module_patches.extend(isolate_caches())
+
+
+def tearDownModule():
+    for patch in reversed(_module_patches):
+        patch.stop()
+    _module_patches.clear()
+
+
+def cosine(x, y) -> float:
+    """Relatedness of the original row-by-row search (1 - scipy's cosine distance)."""
+    return float(np.dot(x, y) / (np.linalg.norm(x) * np.linalg.norm(y)))
+
+
+class RetrievalTests(SimpleTestCase):
+
+    def test_strings_ranked_by_relatedness_keeps_its_return_contract(self):
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({"text": [f"texto {i}" for i in range(50)],
+                           "embedding": list(rng.standard_normal((50, 8)))})
+        query = rng.standard_normal(8)
+        expected = sorted(((text, cosine(query, embedding)) for text, embedding in zip(df.text, df.embedding)),
+                          key=lambda pair: pair[1], reverse=True)
+
+        strings, relatednesses = views.strings_ranked_by_relatedness("pregunta", df, top_n=5, query_embedding=query)
+        self.assertIsInstance(strings, tuple)
+        self.assertIsInstance(relatednesses, tuple)
+        self.assertEqual(strings, tuple(text for text, _ in expected[:5]))
+        self.assertTrue(all(isinstance(score, float) for score in relatednesses))
+        np.testing.assert_allclose(relatednesses, [score for _, score in expected[:5]], rtol=1e-5)
+
+        # Una función de similitud propia sigue el camino fila por fila con el mismo contrato
+        custom = views.strings_ranked_by_relatedness("pregunta", df, relatedness_fn=cosine, top_n=5,
+                                                     query_embedding=query)
+        self.assertEqual(custom[0], strings)
+        self.assertEqual(len(views.strings_ranked_by_relatedness("pregunta", df, query_embedding=query)[0]), 50)
+
+
+def catalog_index() -> VectorIndex:
+    """Six courses with structured metadata and random 16-dim vectors."""
+    courses = [
+        ("EPG4001", "Redes neuronales profundas", 10, "MINIMO", "COMPUTACION"),
+        ("EPG4002", "Series de tiempo", 5, "OPTATIVO", "ESTADISTICA"),
+        ("EPG4003", "Bases de datos", 10, "OPTATIVO", "COMPUTACION"),
+        ("EPG4004", "Inferencia bayesiana", 10, "MINIMO", "ESTADISTICA, COMPUTACION"),
+        ("EPG4005", "Visión por computador con redes neuronales", 15, "OPTATIVO", "COMPUTACION"),
+        ("EPG4006", "Ética de la inteligencia artificial", 5, "MINIMO", "HUMANIDADES"),
+    ]
+    texts = [f"Curso: {name.upper()} Código: {code} Descripción: {name}" for code, name, *_ in courses]
+    metadata = {
+        "course_code": [course[0] for course in courses],
+        "creditos": [course[2] for course in courses],
+        "caracter": [course[3] for course in courses],
+        "disciplina": [course[4] for course in courses],
+    }
+    return VectorIndex(texts, np.random.default_rng(0).standard_normal((len(texts), 16)), metadata=metadata)
+
+
+class HybridSearchTests(SimpleTestCase):
+
+    def test_course_code_questions_are_answered_lexically_without_embedding(self):
+        index = catalog_index()
+        with mock.patch.object(views, "embed_query", side_effect=AssertionError("API llamada")):
+            rows = views.ranked_rows("¿Cuántos créditos tiene epg 4003?", index, top_n=3)
+        self.assertEqual(index.metadata["course_code"][rows[0]], "EPG4003")
+
+    def test_repeated_course_code_questions_are_answered_from_the_cache(self):
+        isolate_caches(self)
+        index = catalog_index()
+        with fake_openai.installed(dim=16, embedding_latency=0, chat_latency=0, token_latency=0) as fake:
+            answer = views.ask("¿Cuántos créditos tiene EPG4003?", index)
+            self.assertEqual(views.ask("¿cuántos créditos  tiene EPG4003?", index), answer)
+            self.assertEqual(asyncio.run(views.aask("¿Cuántos créditos tiene EPG4003?", index)), answer)
+            views.ask("¿Qué requisitos tiene EPG4003?", index)
+        self.assertEqual(fake.calls["chat"], 2)
+        self.assertEqual(fake.calls["embedding"], 0)
+
+    def test_vector_and_bm25_rankings_are_fused(self):
+        index = catalog_index()
+        query_embedding = index.matrix[1]
+        rows = views.ranked_rows("redes neuronales", index, query_embedding=query_embedding)
+        # El mejor por vector (EPG4002) y los que nombran las palabras (EPG4001, EPG4005) encabezan el ranking
+        self.assertEqual(set(rows[:3].tolist()), {0, 1, 4})
+        self.assertEqual(sorted(rows.tolist()), list(range(len(index))))
+
+
+class MetadataFilterTests(SimpleTestCase):
+
+    def test_bitmaps_and_numeric_lookups_combine(self):
+        index = catalog_index()
+        filters = metadata_index(index)
+        self.assertEqual(filters.rows({"caracter": "minimo"}).tolist(), [0, 3, 5])
+        self.assertEqual(filters.rows({"caracter": "MINIMO", "creditos__gte": 10}).tolist(), [0, 3])
+        # Los campos con varios valores coinciden con cualquiera; una lista es un "o"
+        self.assertEqual(filters.rows({"disciplina": "computacion"}).tolist(), [0, 2, 3, 4])
+        self.assertEqual(filters.rows({"disciplina": ["ESTADISTICA", "HUMANIDADES"]}).tolist(), [1, 3, 5])
+        self.assertEqual(filters.rows({"caracter": "LIBRE"}).tolist(), [])
+        with self.assertRaises(ValueError):
+            filters.rows({"semestre": 1})
+        with self.assertRaises(ValueError):
+            filters.rows({"caracter__gte": "A"})
+
+    def test_searches_only_score_matching_rows(self):
+        index = catalog_index()
+        filters = {"creditos": 5}
+        strings, _ = views.strings_ranked_by_relatedness("x", index, query_embedding=index.matrix[0], filters=filters)
+        self.assertEqual(set(strings), {index.texts[1], index.texts[5]})
+        rows = views.ranked_rows("redes neuronales", index, query_embedding=index.matrix[0], filters=filters)
+        self.assertEqual(sorted(rows.tolist()), [1, 5])
+        # Una pregunta por un código que el filtro excluye no lo devuelve
+        with mock.patch.object(views, "embed_query", return_value=index.matrix[0]):
+            self.assertNotIn(0, views.ranked_rows("¿Qué es EPG4001?", index, filters=filters).tolist())
+        self.assertEqual(len(views.ranked_rows("x", index, filters={"caracter": "LIBRE"})), 0)
+
+
+class RetrievalMetricsTests(SimpleTestCase):
+
+    def test_ranked_courses_collapses_sections(self):
+        codes = ["AAA1000", "BBB2000", "AAA1000", None, "CCC3000"]
+        self.assertEqual(evaluation.ranked_courses([2, 0, 3, 1, 4], codes), ["AAA1000", "BBB2000", "CCC3000"])
+
+    def test_recall_and_reciprocal_rank(self):
+        ranked = ["AAA1000", "BBB2000", "CCC3000"]
+        self.assertEqual(evaluation.recall_at_k(ranked, ["BBB2000", "DDD4000"], 1), 0.0)
+        self.assertEqual(evaluation.recall_at_k(ranked, ["BBB2000", "DDD4000"], 3), 0.5)
+        self.assertEqual(evaluation.reciprocal_rank(ranked, ["CCC3000"]), 1 / 3)
+        self.assertEqual(evaluation.reciprocal_rank(ranked, ["DDD4000"]), 0.0)
+
+    def test_gold_set_matches_catalog(self):
+        gold = evaluation.load_gold()
+        questions = [item["question"] for item in gold]
+        self.assertEqual(len(questions), len(set(questions)))
+        expected = {code for item in gold for code in item["expected"]}
+        self.assertLessEqual(expected, evaluation.catalog_codes())
+
+    def test_recorded_embeddings_round_trip(self):
+        embeddings = evaluation.RecordedEmbeddings("test-model")
+        create = mock.Mock(side_effect=lambda text: [1.0, float(len(text))])
+        self.assertEqual(embeddings.record(["uno", "dos"], create), ["uno", "dos"])
+        self.assertEqual(embeddings.record(["uno", "tres"], create), ["tres"])
+        self.assertEqual(create.call_count, 3)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "fixture.json"
+            embeddings.save(path)
+            loaded = evaluation.RecordedEmbeddings.load(path)
+        self.assertEqual(loaded.model, "test-model")
+        np.testing.assert_array_equal(loaded.get("tres"), np.array([1.0, 4.0], dtype=np.float32))
+        self.assertIsNone(loaded.get("cuatro"))
+        self.assertIsNone(evaluation.RecordedEmbeddings.load(Path(directory) / "fixture.json"))
+
+
+def synthetic_index() -> tuple[VectorIndex, np.ndarray]:
+    """Four courses (TST1000..TST1003) with random 16-dim vectors, and the raw vectors."""
+    rng = np.random.default_rng(0)
+    topics = ["redes neuronales", "series de tiempo", "bases de datos", "inferencia bayesiana"]
+    texts = [f"Curso: {topic.upper()} Código: TST{1000 + i} Descripción: {topic}" for i, topic in enumerate(topics)]
+    matrix = rng.standard_normal((len(texts), 16)).astype(np.float32)
+    index = VectorIndex(texts, matrix, metadata={"course_code": [f"TST{1000 + i}" for i in range(len(texts))]},
+                        version="test")
+    return index, matrix
+
+
+class RetrievalBenchmarkTests(SimpleTestCase):
+
+    def test_run_replays_fixture_without_calling_the_api(self):
+        index, matrix = synthetic_index()
+        gold = [
+            {"question": "¿Qué curso trata de redes neuronales?", "expected": ["TST1000"]},
+            {"question": "Quiero aprender sobre almacenamiento", "expected": ["TST1002"]},
+            {"question": "¿Cuántos créditos tiene TST1003?", "expected": ["TST1003"]},
+        ]
+        # Cada pregunta se "grabó" cerca del vector de su curso esperado
+        embeddings = evaluation.RecordedEmbeddings("test-model", {
+            gold[0]["question"]: (matrix[0] + 0.01).tolist(),
+            gold[1]["question"]: (matrix[2] + 0.01).tolist(),
+        })
+
+        with mock.patch("plataforma.views.embed_query", side_effect=AssertionError("API llamada")):
+            results = evaluation.run(index, gold, embeddings, ks=(1, 3))
+
+        self.assertEqual(results["methods"]["vector"]["questions"], 2)
+        self.assertEqual(results["methods"]["vector"]["recall@1"], 1.0)
+        # La pregunta por código se resuelve con el índice léxico, como en el chat
+        self.assertEqual(results["methods"]["hybrid"]["questions"], 3)
+        self.assertEqual(results["methods"]["hybrid"]["recall@3"], 1.0)
+        self.assertEqual(results["methods"]["bm25"]["questions"], 3)
+        self.assertEqual(results["context"]["tokens"]["n"], 3)
+        self.assertEqual(results["context"]["recall"], 1.0)
+        self.assertEqual(results["latency_ms"]["vector"]["n"], 2)
+        json.dumps(results)
+
+    def test_compare_reports_metric_deltas(self):
+        index, _ = synthetic_index()
+        gold = [{"question": "bases de datos", "expected": ["TST1002"]}]
+        results = evaluation.run(index, gold, None, ks=(1,))
+        baseline = json.loads(json.dumps(results))
+        baseline["methods"]["bm25"]["recall@1"] = 0.5
+        self.assertEqual(evaluation.compare(results, baseline)["bm25.recall@1"], 0.5)
+
+    def test_bm25_recall_on_mia_catalog(self):
+        path = evaluation.DATA_DIR / "mia_embeddings.csv"
+        if not path.exists():
+            self.skipTest("No existe mia_embeddings.csv")
+        results = evaluation.run(index_store.load_csv_index(path), evaluation.load_gold(), None)
+        self.assertGreaterEqual(results["methods"]["bm25"]["recall@10"], 0.9)
+
+
+class AnnTests(SimpleTestCase):
+
+    def test_ivf_probes_lists_until_it_has_top_n_candidates(self):
+        matrix = np.random.default_rng(0).standard_normal((32, 16)).astype(np.float32)
+        index = VectorIndex([str(i) for i in range(32)], matrix)
+        index.ann = ann.IVFIndex.build(index.matrix)
+        self.assertEqual(index.ann.nprobe, 1)
+        for query in ann.sample_queries(index.matrix, 20):
+            self.assertGreaterEqual(len(index.ann.candidates(query, 10)), 10)
+            self.assertGreaterEqual(len(index.ann.candidates(query, 10, rows=np.arange(0, 32, 2))), 10)
+            # Un índice chico se recorre entero aunque tenga ANN
+            np.testing.assert_array_equal(index.search(query, 10)[0], index.search(query, 10, exact=True)[0])
+        self.assertGreaterEqual(ann.evaluate(index, k=10, n_queries=50)["recall@10"], 0.5)
+
+    @staticmethod
+    def low_rank_index(n: int = 2000, dim: int = 64, rank: int = 16) -> VectorIndex:
+        """Vectors near a `rank`-dimensional subspace, like real embeddings (most variance in few axes)."""
+        rng = np.random.default_rng(0)
+        matrix = rng.standard_normal((n, rank)) @ rng.standard_normal((rank, dim))
+        return VectorIndex([str(i) for i in range(n)], matrix + 0.05 * rng.standard_normal((n, dim)))
+
+    def assert_agrees_with_exact_search(self, index, k: int = 10):
+        queries = ann.sample_queries(index.matrix, 50)
+        for query in queries:
+            exact_rows, _ = index.search(query, k, exact=True)
+            rows, scores = index.search(query, k, exact=False)
+            self.assertEqual(rows[0], exact_rows[0])
+            # Los candidatos se reevalúan con los vectores completos: los puntajes son los exactos
+            np.testing.assert_allclose(scores, index.matrix[rows] @ query, rtol=1e-5)
+        self.assertGreaterEqual(ann.evaluate(index, k=k, n_queries=50)[f"recall@{k}"], 0.95)
+
+    def test_quantized_shortlists_agree_with_exact_top_k(self):
+        index = self.low_rank_index()
+        for kind in ("float16", "int8"):
+            index.ann = ann.build_ann(index.matrix, kind, rescore=4)
+            self.assert_agrees_with_exact_search(index)
+
+    def test_pca_shortlist_agrees_with_exact_top_k(self):
+        index = self.low_rank_index()
+        index.ann = ann.build_ann(index.matrix, "pca", dim=16, rescore=4)
+        self.assertGreater(index.ann.variance_kept, 0.95)
+        self.assert_agrees_with_exact_search(index)
+        # Con la mitad de las dimensiones necesarias el reranking exacto recupera lo que pierde la proyección
+        sweep = {row["dim"]: row for row in ann.pca_sweep(index.matrix, (8,), k=10, n_queries=50)}
+        self.assertGreater(sweep[8]["recall@10_reranked"], sweep[8]["recall@10_reduced"])
+
+
+def section_index() -> VectorIndex:
+    """The `catalog_index` courses chunked by section, each chunk headed by its course as in --chunking section."""
+    courses = catalog_index()
+    texts, codes, sections = [], [], []
+    for code, text in zip(courses.metadata["course_code"], courses.texts):
+        name = text.split(" Código: ")[0].removeprefix("Curso: ")
+        for section, body in [("general", f"Créditos: {len(name)}"), ("descripcion", f"Descripción: {name} " * 3),
+                              ("requisitos", f"Requisitos: {code} aprobado o {name.lower()}")]:
+            header = f"Curso: {name} Código: {code}"
+            texts.append(f"{header} {body}")
+            codes.append(code)
+            sections.append(section)
+    embeddings = np.random.default_rng(1).standard_normal((len(texts), 16))
+    return VectorIndex(texts, embeddings, metadata={"course_code": codes, "section": sections})
+
+
+def reencoding_query_message(query: str, strings, model: str, token_budget: int) -> str:
+    """query_message before the additive packing: re-encode the whole message for every added article."""
+    message = views.INTRODUCTION
+    question = f"\n\nPregunta: {query}"
+    for string in strings:
+        next_article = f"{views.ARTICLE_HEAD}{string}{views.ARTICLE_TAIL}"
+        if views.num_tokens(message + next_article + question, model=model) > token_budget:
+            break
+        message += next_article
+    return message + question
+
+
+class QueryMessagePackingTests(SimpleTestCase):
+    model = views.GPT_MODEL
+    budgets = range(150, 6000, 170)
+
+    def corpora(self):
+        paths = [evaluation.DATA_DIR / "mia_embeddings.csv",
+                 Path(views.__file__).parent / "bases_sercotec_embeddings.csv"]
+        corpora = [index_store.load_csv_index(path) for path in paths if path.exists()]
+        if not corpora:
+            self.skipTest("No existen los CSV de embeddings")
+        return corpora
+
+    def test_additive_packing_matches_reencoding_loop(self):
+        rng = np.random.default_rng(0)
+        query = "¿Qué curso trata de redes neuronales?"
+        for index in self.corpora():
+            # Artículos reales en orden aleatorio, más textos cortos que ponen a prueba las uniones del BPE
+            article_sets = [[index.texts[i] for i in rng.permutation(len(index))[:25]] for _ in range(3)]
+            article_sets.append(["a", '"""', "¿?", "🙂 curso", " ", "EPG4001"] * 4)
+            for strings in article_sets:
+                articles = [f"{views.ARTICLE_HEAD}{string}{views.ARTICLE_TAIL}" for string in strings]
+                counts = views.estimated_article_tokens(index, strings, self.model)
+                for budget in self.budgets:
+                    self.assertEqual(
+                        tokens.pack_within_budget(views.INTRODUCTION, articles, counts, f"\n\nPregunta: {query}",
+                                                  budget, self.model, joints_per_piece=3),
+                        reencoding_query_message(query, strings, self.model, budget),
+                    )
+
+    def test_query_message_matches_reencoding_loop(self):
+        for index in self.corpora():
+            for row, query in [(0, "¿Qué curso trata de series de tiempo?"), (len(index) // 2, "requisitos")]:
+                query_embedding = index.matrix[row]
+                ranked = views.ranked_rows(query, index, query_embedding=query_embedding)
+                strings = [index.texts[i] for i in ranked]
+                for budget in self.budgets:
+                    self.assertEqual(
+                        views.query_message(query, index, self.model, budget, query_embedding=query_embedding),
+                        reencoding_query_message(query, strings, self.model, budget),
+                    )
+
+
+    def test_section_message_matches_reencoding_loop_without_repeated_headers(self):
+        index = section_index()
+        query = "redes neuronales"
+        question = f"\n\nPregunta: {query}"
+        for row in (0, 7, 16):
+            query_embedding = index.matrix[row]
+            ranked = views.ranked_rows(query, index, query_embedding=query_embedding)
+            for budget in range(80, 900, 9):
+                expected = views.INTRODUCTION + question
+                for selected in range(1, len(ranked) + 1):
+                    courses = views.group_sections(index, ranked[:selected])
+                    message = views.INTRODUCTION + "".join(
+                        f"{views.ARTICLE_HEAD}{course}{views.ARTICLE_TAIL}" for course in courses) + question
+                    if views.num_tokens(message, model=self.model) > budget:
+                        break
+                    expected = message
+                message = views.section_query_message(query, index, self.model, budget,
+                                                      query_embedding=query_embedding)
+                self.assertEqual(message, expected)
+                for code in index.metadata["course_code"]:
+                    self.assertLessEqual(message.count(f"Código: {code} "), 1)
+
+
+def embedding_script():
+    """The generate_mia_embeddings.py script as a module, imported without printing its dotenv banner."""
+    with contextlib.redirect_stdout(StringIO()):
+        import generate_mia_embeddings
+    return generate_mia_embeddings
+
+
+class EmbeddingScriptTests(SimpleTestCase):
+
+    @staticmethod
+    def catalog() -> dict:
+        courses = [("EPG4001", "Redes neuronales"), ("EPG4002", "Series de tiempo"), ("EPG4003", "Bases de datos")]
+        return {code: {"metadata": {"nombre": name, "codigo": code, "creditos": 10},
+                       "descripcion": f"Curso de {name.lower()} del magíster, con proyectos aplicados.",
+                       "metodologias": ["Clases expositivas", "Laboratorios"]}
+                for code, name in courses}
+
+    def run_script(self, directory, catalog: dict, fail_on: str | None = None, **options):
+        """Run create_embeddings_index over `catalog` in `directory`, one text per batch.
+
+        Returns the published index and the texts sent to the API; batches with
+        a text containing `fail_on` always hit the rate limit. The printed
+        report is left in `self.output`.
+        """
+        script = embedding_script()
+        directory = Path(directory)
+        embedded, output = [], StringIO()
+        self.output = output
+
+        def create(input, model=None, **kwargs):
+            if fail_on is not None and any(fail_on in text for text in input):
+                raise openai.error.RateLimitError("límite de prueba")
+            embedded.extend(input)
+            return fake.embedding_create(input, model=model)
+
+        make_batches = script.make_batches
+        with fake_openai.installed(dim=16, embedding_latency=0) as fake, \
+                mock.patch.object(openai.Embedding, "create", side_effect=create), \
+                mock.patch.multiple(script, DATA_DIR=directory, CSV_PATH=directory / "mia_embeddings.csv",
+                                    CHECKPOINT_PATH=directory / ".embeddings_checkpoint.jsonl"), \
+                mock.patch.object(script, "load_mia_data", return_value=catalog), \
+                mock.patch.object(script, "make_batches", side_effect=lambda items: make_batches(items, max_items=1)), \
+                mock.patch.object(script.time, "sleep"), \
+                contextlib.redirect_stdout(output):
+            path = script.create_embeddings_index(**options)
+        return index_store.load_index(path), embedded
+
+    def test_unchanged_catalog_is_not_embedded_again(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first, embedded = self.run_script(directory, self.catalog())
+            self.assertEqual(len(embedded), 3)
+            second, embedded = self.run_script(directory, self.catalog())
+            self.assertEqual(embedded, [])
+            self.assertEqual(second.texts, first.texts)
+            np.testing.assert_allclose(second.matrix, first.matrix, atol=1e-6)
+
+    def test_changed_course_re_embeds_only_its_rows(self):
+        with tempfile.TemporaryDirectory() as directory:
+            catalog = self.catalog()
+            first, embedded = self.run_script(directory, catalog, chunking="section")
+            self.assertEqual(len(embedded), len(first))
+
+            catalog["EPG4002"]["descripcion"] = "Curso de series de tiempo y pronóstico con modelos ARIMA."
+            second, embedded = self.run_script(directory, catalog, chunking="section")
+            codes = second.metadata["course_code"]
+            changed = [text for text, code in zip(second.texts, codes) if text not in first.texts]
+            self.assertEqual(embedded, changed)
+            self.assertEqual(len(embedded), 1)
+            self.assertIn("ARIMA", embedded[0])
+            # Las demás filas reutilizan su vector anterior
+            for row, text in enumerate(second.texts):
+                if text in first.texts:
+                    np.testing.assert_allclose(second.matrix[row], first.matrix[first.texts.index(text)], atol=1e-6)
+
+
+    def test_only_transient_errors_are_retried(self):
+        script = embedding_script()
+        batch = [("h", "Redes neuronales")]
+        with fake_openai.installed(dim=16, embedding_latency=0) as fake, mock.patch.object(script.time, "sleep"), \
+                contextlib.redirect_stdout(StringIO()):
+            limited = [openai.error.RateLimitError("límite"), openai.error.RateLimitError("límite")]
+            with mock.patch.object(openai.Embedding, "create",
+                                   side_effect=[*limited, fake.embedding_create(["Redes neuronales"])]) as create:
+                self.assertEqual(len(script.embed_batch(batch)), 1)
+            self.assertEqual(create.call_count, 3)
+
+            failures = [openai.error.InvalidRequestError("demasiado largo", "input"),
+                        {"data": [{"index": 0, "embedding": [0.0] * 16}]}]
+            for failure in failures:
+                with mock.patch.object(openai.Embedding, "create", side_effect=[failure]) as create:
+                    with self.assertRaises((openai.error.InvalidRequestError, script.EmbeddingError)):
+                        script.embed_batch(batch)
+                self.assertEqual(create.call_count, 1)
+
+    def test_interrupted_run_resumes_from_the_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            script = embedding_script()
+            with self.assertRaises(script.EmbeddingError):
+                self.run_script(directory, self.catalog(), fail_on="Series")
+            checkpoint = Path(directory) / ".embeddings_checkpoint.jsonl"
+            self.assertEqual(len(checkpoint.read_text(encoding="utf-8").splitlines()), 2)
+
+            index, embedded = self.run_script(directory, self.catalog())
+            self.assertEqual(len(embedded), 1)
+            self.assertIn("Series de tiempo", embedded[0])
+            self.assertEqual(len(index), 3)
+            self.assertIn("1 embebidos con la API, 2 recuperados del checkpoint", self.output.getvalue())
+            self.assertFalse(checkpoint.exists())
+
+
+class FakeOpenAITests(SimpleTestCase):
+
+    def test_installed_fake_answers_embeddings_and_chat(self):
+        original = openai.Embedding.create
+        with fake_openai.installed(embedding_latency=0, chat_latency=0, token_latency=0) as fake:
+            first = openai.Embedding.create(model="m", input=["redes neuronales", "redes neuronales"])
+            self.assertEqual(first["data"][0]["embedding"], first["data"][1]["embedding"])
+            self.assertAlmostEqual(float(np.linalg.norm(first["data"][0]["embedding"])), 1.0, places=5)
+
+            messages = [{"role": "user", "content": "Contexto\n\nPregunta: ¿Qué es EPG4001?"}]
+            answer = openai.ChatCompletion.create(model="m", messages=messages)["choices"][0]["message"]["content"]
+            streamed = "".join(chunk["choices"][0]["delta"].get("content", "")
+                               for chunk in openai.ChatCompletion.create(model="m", messages=messages, stream=True))
+            self.assertEqual(streamed, answer)
+            self.assertIn("¿Qué es EPG4001?", answer)
+            self.assertEqual(fake.calls, {"embedding": 1, "chat": 2, "errors": 0})
+        self.assertEqual(openai.Embedding.create, original)
+
+    def test_error_rate_raises_rate_limit_errors(self):
+        with fake_openai.installed(embedding_latency=0, error_rate=1.0):
+            with self.assertRaises(openai.error.RateLimitError):
+                openai.Embedding.create(model="m", input="hola")
+
+
+class MicrobenchTests(SimpleTestCase):
+
+    def test_compare_flags_regressions_past_tolerance_and_slack(self):
+        baseline = {"results": {"case": {"time_us": 100.0, "peak_bytes": 1_000_000, "retained_bytes": 1_000}}}
+        current = {"results": {
+            "case": {"time_us": 250.0, "peak_bytes": 1_200_000, "retained_bytes": 60_000},
+            "new_case": {"time_us": 1.0, "peak_bytes": 0, "retained_bytes": 0},
+        }}
+        regressions = microbench.compare(current, baseline, time_tolerance=1.0, memory_tolerance=0.25)
+        # retained_bytes creció x60 pero menos que MEMORY_SLACK_BYTES; peak_bytes creció menos que la tolerancia
+        self.assertEqual([(r["case"], r["metric"]) for r in regressions], [("case", "time_us")])
+        self.assertEqual(microbench.compare(current, baseline, time_tolerance=2.0), [])
+
+    def test_memory_per_call_measures_temporary_and_retained_allocations(self):
+        kept = []
+        peak, retained = microbench.memory_per_call(lambda: kept.append(np.ones(100_000)) or np.ones(200_000).sum())
+        self.assertGreaterEqual(peak, 2_400_000)
+        self.assertGreaterEqual(retained, 800_000)
+        self.assertLess(retained, 1_600_000)
+
+    def test_suite_memory_matches_stored_baseline(self):
+        baseline = microbench.load_baseline()
+        if baseline is None:
+            self.skipTest("No existe la línea base de micro-benchmarks")
+        results = microbench.run_suite(sizes=(32,), repeat=1, min_time=0.001)
+        self.assertEqual(
+            set(results["results"]),
+            {"num_tokens", "format_response", "process_course_to_text",
+             "strings_ranked_by_relatedness@32", "query_message@32"},
+        )
+        # El tiempo depende de la máquina; la memoria por llamada no
+        self.assertEqual(microbench.compare(results, baseline, time_tolerance=float("inf")), [])
+
+
+class SemanticAnswerCacheTests(SimpleTestCase):
+
+    @staticmethod
+    def at_similarity(similarity: float) -> list[float]:
+        """A unit vector with cosine `similarity` to [1, 0]."""
+        return [similarity, float(np.sqrt(1 - similarity ** 2))]
+
+    def test_lookup_hits_only_at_or_above_the_threshold_in_the_same_scope(self):
+        cache = SemanticAnswerCache(threshold=0.97)
+        cache.store("¿Qué es EPG4001?", [1.0, 0.0], "respuesta", "mia@v1")
+        self.assertEqual(cache.lookup(self.at_similarity(0.98), "mia@v1").answer, "respuesta")
+        self.assertIsNone(cache.lookup(self.at_similarity(0.96), "mia@v1"))
+        # Otra versión del índice (u otro modelo) no reutiliza respuestas
+        self.assertIsNone(cache.lookup([1.0, 0.0], "mia@v2"))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_entries_expire_and_the_least_recently_used_is_evicted(self):
+        cache = SemanticAnswerCache(threshold=0.97, ttl=60, max_entries=2)
+        cache.store("a", [1.0, 0.0], "A", "s")
+        cache.store("b", [0.0, 1.0], "B", "s")
+        cache.lookup([1.0, 0.0], "s")
+        cache.store("c", [-1.0, 0.0], "C", "s")
+        self.assertIsNone(cache.lookup([0.0, 1.0], "s"))
+        self.assertEqual(cache.lookup([1.0, 0.0], "s").answer, "A")
+
+        with mock.patch("plataforma.answer_cache.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.lookup([1.0, 0.0], "s"))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_scopes_with_different_dimensions_share_the_cache(self):
+        cache = SemanticAnswerCache(threshold=0.97)
+        cache.store("¿Qué es EPG4001?", [1.0, 0.0], "MIA", "mia@v1")
+        cache.store("¿Qué es un fondo?", [0.0, 0.0, 1.0], "SERCOTEC", "sercotec@v1")
+        self.assertEqual(cache.lookup([1.0, 0.0], "mia@v1").answer, "MIA")
+        self.assertEqual(cache.lookup([0.0, 0.0, 1.0], "sercotec@v1").answer, "SERCOTEC")
+        self.assertIsNone(cache.lookup([0.0, 0.0, 1.0], "mia@v1"))
+
+
+class IndexRegistryTests(SimpleTestCase):
+
+    def publish(self, directory, name: str, texts: list[str]) -> Path:
+        matrix = np.random.default_rng(len(texts)).standard_normal((len(texts), 8))
+        return index_store.save_index(directory, name, texts, matrix)
+
+    def test_new_versions_are_swapped_in_while_old_references_keep_working(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.publish(directory, "mia", ["uno", "dos"])
+            registry = IndexRegistry({"mia": {"sources": [path]}}, default="mia", check_interval=0)
+            held = registry.get()
+            self.assertIs(registry.get("mia"), held)
+
+            self.publish(directory, "mia", ["uno", "dos", "tres"])
+            current = registry.get()
+            self.assertIsNot(current, held)
+            self.assertNotEqual(current.version, held.version)
+            self.assertEqual(len(current.index), 3)
+            # Una petición que todavía tiene la versión anterior la sigue usando completa
+            self.assertEqual(set(held.index.ranked_strings(np.ones(8), top_n=5)[0]), {"uno", "dos"})
+            with self.assertRaises(UnknownCorpus):
+                registry.get("otro")
+
+    def test_prune_keeps_the_published_version_and_other_indexes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            other = index_store.load_index(self.publish(directory, "mia-extra", ["x"]))
+            # Nombre posterior pero escrita antes (una versión en hora local antes de terminar el horario de verano)
+            stale = Path(directory) / "mia-29991231T235959.000000.f32"
+            stale.write_bytes(b"")
+            os.utime(stale, (0, 0))
+            path = self.publish(directory, "mia", ["uno"])
+            index_store.prune_versions(directory, "mia", keep=1)
+
+            current = index_store.read_manifest(path)["vectors"]
+            self.assertEqual(sorted(p.name for p in Path(directory).glob("*.f32")),
+                             sorted([current, f"mia-extra-{other.version}.f32"]))
+            self.assertEqual(index_store.load_index(path).texts, ["uno"])
+
+    def test_memory_budget_unloads_the_least_recently_used_corpus(self):
+        with tempfile.TemporaryDirectory() as directory:
+            corpora = {name: {"sources": [self.publish(directory, name, ["a", "b"])]} for name in ("mia", "sercotec")}
+            registry = IndexRegistry(corpora, default="mia", check_interval=0)
+            registry.memory_budget = registry.get("mia").nbytes
+            registry.get("sercotec")
+            self.assertEqual(set(registry.memory_usage()), {"sercotec"})
+            self.assertEqual(len(registry.get("mia").index), 2)
+            self.assertEqual(set(registry.memory_usage()), {"mia"})
+
+    def test_startup_memory_report_does_not_page_in_the_index(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.publish(directory, "mia", ["uno", "dos"])
+            registry = IndexRegistry({"mia": {"sources": [path]}}, default="mia")
+            registry.get()
+            with mock.patch.object(memory, "touch_pages") as touch_pages:
+                report = memory.log_index_memory(registry)
+                if report is None:
+                    self.skipTest("Sin /proc")
+                touch_pages.assert_not_called()
+                memory.index_memory_report(registry, touch=True)
+                touch_pages.assert_called()
+            self.assertTrue(report["corpora"]["mia"]["mapped"])
+
+
+class QueryEmbeddingCacheTests(SimpleTestCase):
+
+    def test_vectors_are_keyed_by_dimension_and_checked_before_use(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = QueryEmbeddingCache("test-model", path=Path(directory) / "cache.sqlite3")
+            cache.put("Redes  neuronales", [1.0] * 16)
+            self.assertIsNone(cache.get("redes neuronales", 1536))
+            np.testing.assert_array_equal(cache.get("redes neuronales", 16), np.ones(16, dtype=np.float32))
+
+            # Otro worker lee el SQLite; una fila con otra forma se descarta en vez de devolverse
+            other = QueryEmbeddingCache("test-model", path=cache.path)
+            with other._connection() as connection:
+                connection.execute("UPDATE query_embeddings SET embedding = ?", (np.ones(8, np.float32).tobytes(),))
+            self.assertIsNone(other.get("redes neuronales", 16))
+            self.assertEqual(other._connection().execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0], 0)
+            self.assertEqual(other.stats()["misses"], 1)
+
+    def test_sqlite_tier_evicts_least_recently_used_rows(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = QueryEmbeddingCache("test-model", path=Path(directory) / "cache.sqlite3", max_rows=2)
+            for i in range(3):
+                cache.put(f"consulta {i}", [float(i)] * 4)
+            connection = cache._connection()
+            connection.execute("UPDATE query_embeddings SET last_used = created_at + ?", (1,))
+            connection.execute("UPDATE query_embeddings SET last_used = 0 WHERE key = ?",
+                               (cache.key("consulta 1", 4),))
+            connection.commit()
+            self.assertEqual(cache.evict(), 1)
+            rows = {row[0] for row in connection.execute("SELECT key FROM query_embeddings")}
+            self.assertEqual(rows, {cache.key("consulta 0", 4), cache.key("consulta 2", 4)})
+
+    def test_files_with_the_old_schema_are_recreated(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "cache.sqlite3"
+            with sqlite3.connect(path) as connection:
+                connection.execute("CREATE TABLE query_embeddings (key TEXT PRIMARY KEY, model TEXT NOT NULL, "
+                                   "embedding BLOB NOT NULL, created_at REAL NOT NULL)")
+                connection.execute("INSERT INTO query_embeddings VALUES ('k', 'test-model', x'00', 0)")
+            connection.close()
+            cache = QueryEmbeddingCache("test-model", path=path)
+            self.assertIsNone(cache.get("hola", 16))
+            cache.put("hola", [1.0] * 16)
+            self.assertIsNotNone(QueryEmbeddingCache("test-model", path=path).get("hola", 16))
+
+
+class MetricsTests(SimpleTestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        isolate_caches(self)
+
+    def test_metrics_endpoint_is_gated_by_setting_address_and_staff(self):
+        factory = RequestFactory()
+
+        def status(address="127.0.0.1", user=None):
+            request = factory.get("/metrics/", REMOTE_ADDR=address)
+            request.user = user or AnonymousUser()
+            return views.prometheus_metrics(request).status_code
+
+        staff = mock.Mock(is_authenticated=True, is_staff=True)
+        with override_settings(RAG_METRICS_ENABLED=False):
+            self.assertEqual(status(user=staff), 404)
+        with override_settings(RAG_METRICS_ENABLED=True, RAG_METRICS_ALLOWED_IPS=["127.0.0.1"]):
+            self.assertEqual(status(), 200)
+            self.assertEqual(status("203.0.113.7"), 403)
+            self.assertEqual(status("203.0.113.7", mock.Mock(is_authenticated=True, is_staff=False)), 403)
+            self.assertEqual(status("203.0.113.7", staff), 200)
+
+    def test_histogram_quantiles_and_prometheus_text(self):
+        histogram = metrics.Histogram("test_seconds", "Prueba", (0.1, 1), labels=("stage",))
+        for value in (0.05, 0.05, 0.5, 2.0):
+            histogram.observe(value, stage="search")
+        self.assertEqual(histogram.count(stage="search"), 4)
+        self.assertAlmostEqual(histogram.quantile(0.5, stage="search"), 0.1)
+        self.assertAlmostEqual(histogram.quantile(0.75, stage="search"), 1.0)
+        self.assertEqual(histogram.quantile(0.99, stage="search"), 1.0)
+        self.assertIsNone(histogram.quantile(0.5, stage="chat"))
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{stage="search",le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{stage="search",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count{stage="search"} 4', lines)
+
+    def test_ask_records_each_stage(self):
+        index, _ = synthetic_index()
+        timings, token = metrics.start_request()
+        try:
+            with fake_openai.installed(dim=16, embedding_latency=0, chat_latency=0, token_latency=0):
+                views.ask("¿Qué curso trata de series de tiempo?", index)
+        finally:
+            metrics.end_request(token)
+        self.assertEqual(list(timings.totals()), ["embedding", "answer_cache", "lexical", "vector", "pack", "chat",
+                                                  "format"])
+        self.assertEqual(metrics.STAGE_SECONDS.count(stage="chat"), 1)
+        self.assertEqual(metrics.TOKENS.count(kind="completion"), 1)
+
+        text = metrics.render_prometheus({"answer": {"hits": 3, "misses": 1, "hit_rate": 0.75, "size": 2}})
+        self.assertIn('rag_stage_seconds_count{stage="embedding"} 1', text)
+        self.assertIn('rag_cache_hit_ratio{cache="answer"} 0.75', text)
+
+    def test_middleware_sets_server_timing_only_when_stages_were_timed(self):
+        def view(request):
+            if request.path == "/timed/":
+                metrics.record("search", 0.0025)
+            return HttpResponse("ok")
+
+        middleware = server_timing_middleware(view)
+        timed = middleware(RequestFactory().get("/timed/"))
+        self.assertRegex(timed["Server-Timing"], r"^search;dur=2\.5, total;dur=\d+\.\d$")
+        self.assertFalse(middleware(RequestFactory().get("/plain/")).has_header("Server-Timing"))
+
+
+class ConversationStoreTests(TestCase):
+    model = "gpt-3.5-turbo-0125"
+
+    def setUp(self):
+        isolate_caches(self)
+
+    def test_window_keeps_recent_turns_and_summarizes_older_ones(self):
+        store = ConversationStore(self.model, token_budget=120, summary_budget=60)
+        conversation_id = store.start("sesion")
+        for i in range(4):
+            store.append(conversation_id, f"¿Qué es EPG400{i}?", f"EPG400{i} es un curso. " + "Detalle. " * 10)
+
+        window = store.window(conversation_id)
+        self.assertEqual(window.turn_count, 4)
+        self.assertLessEqual(sum(n for _, _, n in window.turns), 120)
+        self.assertEqual(window.turns[-1][0], "¿Qué es EPG4003?")
+        self.assertIn("- ¿Qué es EPG4000? (cursos: EPG4000)", window.summary)
+
+        messages = window.messages()
+        self.assertEqual(messages[0]["role"], "system")
+        self.assertEqual([m["role"] for m in messages[1:]], ["user", "assistant"] * len(window.turns))
+
+        # Otro worker (sin la conversación en memoria) reconstruye la misma ventana desde la base de datos
+        other = ConversationStore(self.model, token_budget=120, summary_budget=60)
+        self.assertEqual(other.window(conversation_id), window)
+        self.assertEqual(other.stats()["misses"], 1)
+
+    def test_summary_is_bounded_and_stale_windows_are_reloaded(self):
+        store = ConversationStore(self.model, token_budget=1, summary_budget=20, check_interval=0)
+        other = ConversationStore(self.model, token_budget=1, summary_budget=20, check_interval=0)
+        conversation_id = store.start("sesion")
+        self.assertEqual(other.history(conversation_id), [])
+        for i in range(5):
+            store.append(conversation_id, f"Pregunta número {i} sobre cursos", "Respuesta.")
+
+        self.assertEqual(store.window(conversation_id).turns, [])
+        summary = other.window(conversation_id).summary
+        self.assertTrue(summary.endswith("- Pregunta número 4 sobre cursos"))
+        self.assertNotIn("número 0", summary)
+        self.assertEqual(Conversation.objects.get(pk=conversation_id).summarized_turns, 5)
+        self.assertEqual(store.history(12345), [])
+
+    def test_append_builds_on_turns_saved_by_other_workers(self):
+        store = ConversationStore(self.model, token_budget=1000, check_interval=0)
+        other = ConversationStore(self.model, token_budget=1000, check_interval=60)
+        conversation_id = store.start("sesion")
+        self.assertEqual(other.history(conversation_id), [])
+        store.append(conversation_id, "¿Qué es EPG4001?", "Un curso.")
+
+        # Dentro de check_interval el otro worker no consulta la base de datos...
+        with self.assertNumQueries(0):
+            self.assertEqual(other.window(conversation_id).turns, [])
+        # ...pero al guardar su turno parte de los que ya están guardados
+        window = other.append(conversation_id, "¿Y EPG4002?", "Otro curso.")
+        self.assertEqual([question for question, _, _ in window.turns], ["¿Qué es EPG4001?", "¿Y EPG4002?"])
+        self.assertEqual(store.window(conversation_id), window)
+        self.assertEqual(Conversation.objects.get(pk=conversation_id).turn_count, 2)
+        self.assertIsNone(store.append(12345, "pregunta", "respuesta"))
+
+    def test_empty_conversations_are_reused_and_inactive_ones_pruned(self):
+        store = ConversationStore(self.model)
+        conversation_id = store.start("sesion")
+        self.assertEqual(store.start("sesion", current=conversation_id), conversation_id)
+        store.append(conversation_id, "¿Qué es EPG4001?", "Un curso.")
+        newer = store.start("sesion", current=conversation_id)
+        self.assertNotEqual(newer, conversation_id)
+
+        Conversation.objects.filter(pk=conversation_id).update(updated_at=timezone.now() - timedelta(days=31))
+        out = StringIO()
+        call_command("prune_conversations", "--days", "30", stdout=out)
+        self.assertIn("1 conversaciones borradas", out.getvalue())
+        self.assertEqual(list(Conversation.objects.values_list("pk", flat=True)), [newer])
+        self.assertFalse(Turn.objects.exists())
+
+    def test_history_messages_count_their_overhead_against_the_budget(self):
+        index = catalog_index()
+        history = [{"role": role, "content": "Sí."} for _ in range(20) for role in ("user", "assistant")]
+        budget = 400
+        messages = views.build_messages("¿Qué es EPG4001?", index, self.model, budget,
+                                        query_embedding=index.matrix[0], history=history)
+        used = sum(tokens.num_tokens(m["content"], self.model) + TOKENS_PER_MESSAGE for m in messages[1:-1])
+        self.assertLessEqual(used + tokens.num_tokens(messages[-1]["content"], self.model), budget)
+
+    def test_chat_sends_only_the_new_question_and_keeps_history_on_the_server(self):
+        user = get_user_model().objects.create_user(username="historia@example.com", password="clave")
+        self.client.force_login(user)
+        with fake_openai.installed(embedding_latency=0, chat_latency=0, token_latency=0) as fake, \
+                mock.patch.object(openai.ChatCompletion, "acreate", side_effect=fake.chat_acreate) as acreate:
+            self.client.post("/capital-semilla-chat/", {"query": "init"})
+            first = self.client.post("/capital-semilla-chat/", {"query": "¿Qué cursos hay de bases de datos?"}).json()
+            self.client.post("/capital-semilla-chat/", {"query": "¿Y cuántos créditos tienen?"})
+
+        conversation = Conversation.objects.get(session_key=self.client.session.session_key)
+        self.assertEqual(conversation.turn_count, 2)
+        self.assertEqual(conversation.user, user)
+        messages = acreate.call_args_list[1].kwargs["messages"]
+        self.assertEqual([m["role"] for m in messages], ["system", "user", "assistant", "user"])
+        self.assertEqual(messages[1]["content"], "¿Qué cursos hay de bases de datos?")
+        self.assertEqual(messages[2]["content"], first["response"])
+
+
+class ChatStreamTests(TestCase):
+    query = "¿Qué cursos hay de bases de datos?"
+
+    def setUp(self):
+        isolate_caches(self)
+        self.user = get_user_model().objects.create_user(username="stream@example.com", password="clave")
+
+    def assert_event_stream(self, response, chunks: list[bytes]):
+        """Checks an SSE chat response and returns its final answer."""
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = []
+        for chunk in chunks:
+            # Cada evento llega en su propio chunk, a medida que se genera
+            event, data, blank = chunk.decode("utf-8").split("\n", 2)
+            self.assertEqual(blank, "\n")
+            events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+        names = [event for event, _ in events]
+        self.assertEqual(names[0], "meta")
+        self.assertEqual(names[-1], "done")
+        self.assertGreater(names.count("token"), 1)
+        self.assertEqual(set(names[1:-1]), {"token"})
+        return events[-1][1]["response"]
+
+    def assert_turn_saved(self, answer: str):
+        conversation = Conversation.objects.get(user=self.user)
+        self.assertEqual(conversation.turn_count, 1)
+        self.assertEqual(list(conversation.turns.values_list("question", "answer")), [(self.query, answer)])
+
+    def test_wsgi_stream_sends_incremental_events_and_saves_the_turn(self):
+        self.client.force_login(self.user)
+        with fake_openai.installed(embedding_latency=0, chat_latency=0, token_latency=0):
+            response = self.client.post("/capital-semilla-chat/", {"query": self.query, "stream": "1"})
+            self.assertTrue(response.streaming)
+            self.assertFalse(Conversation.objects.filter(turn_count__gt=0).exists())
+            answer = self.assert_event_stream(response, list(response.streaming_content))
+        self.assert_turn_saved(answer)
+
+    async def test_asgi_stream_sends_incremental_events_and_saves_the_turn(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        with fake_openai.installed(embedding_latency=0, chat_latency=0, token_latency=0):
+            response = await self.async_client.post(
+                "/capital-semilla-chat/", {"query": self.query}, headers={"accept": "text/event-stream"}
+            )
+            self.assertTrue(response.streaming)
+            chunks = [chunk async for chunk in response.streaming_content]
+        answer = self.assert_event_stream(response, chunks)
+        await sync_to_async(self.assert_turn_saved)(answer)
+
+
+class SingleFlightTests(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        isolate_caches(self)
+
+    def test_concurrent_threads_share_one_computation(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls, results = [], []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return "respuesta"
+
+        threads = [threading.Thread(target=lambda: results.append(flight.do("clave", compute))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while metrics.SINGLE_FLIGHT.value(role="follower") < 4 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ["respuesta"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.do("clave", lambda: "nueva"), "nueva")
+
+    def test_async_followers_replay_the_stream_and_share_errors(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def produce():
+            calls.append(1)
+            for word in ("uno ", "dos"):
+                await asyncio.sleep(0.01)
+                yield "token", word
+            yield "done", "uno dos"
+
+        async def failing():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise RuntimeError("fallo")
+            yield
+
+        async def consume(events):
+            return [event async for event in flight.astream("clave", events)]
+
+        async def main():
+            streams = await asyncio.gather(*(consume(produce) for _ in range(3)))
+            errors = await asyncio.gather(*(consume(failing) for _ in range(3)), return_exceptions=True)
+            return streams, errors
+
+        streams, errors = asyncio.run(main())
+        self.assertEqual(streams, [[("token", "uno "), ("token", "dos"), ("done", "uno dos")]] * 3)
+        self.assertTrue(all(isinstance(error, RuntimeError) for error in errors))
+        self.assertEqual(len(calls), 2)
+
+    def test_follower_takes_over_when_the_leader_disconnects_before_answering(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def answer():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "respuesta"
+
+        async def main():
+            leader = asyncio.ensure_future(flight.ado("clave", answer))
+            await asyncio.sleep(0.01)
+            follower = asyncio.ensure_future(flight.ado("clave", answer))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await follower
+
+        self.assertEqual(asyncio.run(main()), "respuesta")
+        self.assertEqual(len(calls), 2)
+
+    def test_database_locks_hand_the_answer_to_other_workers(self):
+        first, second = DatabaseLocks(), DatabaseLocks()
+        second.owner = "otro-worker:1"
+        self.assertEqual(first.step("clave"), (True, None))
+        self.assertEqual(second.step("clave"), (False, None))
+        first.release("clave", "respuesta")
+        self.assertEqual(second.step("clave"), (False, "respuesta"))
+        self.assertEqual(SingleFlight(locks=second).do("clave", mock.Mock(side_effect=AssertionError)), "respuesta")
+
+        # El lock de un worker que murió vence y otro lo toma
+        SingleFlightLock.objects.update(answer=None, expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(second.step("clave"), (True, None))
+        second.release("clave")
+        self.assertFalse(SingleFlightLock.objects.exists())
+
+    def test_identical_questions_share_one_chat_completion(self):
+        index, _ = synthetic_index()
+        query = "¿Qué curso enseña redes neuronales?"
+
+        async def main():
+            return await asyncio.gather(*(views.aask(query, index) for _ in range(5)))
+
+        with fake_openai.installed(dim=16, embedding_latency=0.01, chat_latency=0.05, token_latency=0) as fake:
+            answers = asyncio.run(main())
+        self.assertEqual(len(set(answers)), 1)
+        self.assertEqual(fake.calls["chat"], 1)
+        self.assertEqual(metrics.SINGLE_FLIGHT.value(role="follower"), 4)
+
+    def test_follow_up_questions_share_answers_only_within_the_same_window(self):
+        index, _ = synthetic_index()
+        query = "¿Y cuántos créditos tiene?"
+        first = [{"role": "user", "content": "¿Qué es TST1000?"}, {"role": "assistant", "content": "Un curso."}]
+        second = [{"role": "user", "content": "¿Qué es TST1001?"}, {"role": "assistant", "content": "Otro curso."}]
+        self.assertEqual(views.flight_key(query, index, "m", None, first),
+                         views.flight_key("¿y cuántos  créditos tiene?", index, "m", None, list(first)))
+        self.assertNotEqual(views.flight_key(query, index, "m", None, first),
+                            views.flight_key(query, index, "m", None, second))
+        self.assertNotEqual(views.flight_key(query, index, "m", None, first), views.flight_key(query, index, "m", None))
+
+        async def main():
+            return await asyncio.gather(*(views.aask(query, index, history=first) for _ in range(3)))
+
+        with fake_openai.installed(dim=16, embedding_latency=0.01, chat_latency=0.05, token_latency=0) as fake:
+            answers = asyncio.run(main())
+            self.assertEqual(fake.calls["chat"], 1)
+            self.assertEqual(views.ask(query, index, history=first), answers[0])
+            self.assertEqual(fake.calls["chat"], 1)
+            views.ask(query, index, history=second)
+            self.assertEqual(fake.calls["chat"], 2)
+        self.assertEqual(len(set(answers)), 1)
+
+
+class EmbeddingBatcherTests(SimpleTestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        isolate_caches(self)
+
+    def test_queries_arriving_during_a_call_share_the_next_one(self):
+        release = threading.Event()
+        calls = []
+
+        def create_batch(texts):
+            calls.append(texts)
+            if len(calls) == 1:
+                release.wait(5)
+            return [[float(len(text))] for text in texts]
+
+        batcher = EmbeddingBatcher(create_batch, window=0.05)
+        first = batcher.submit("uno")
+        deadline = time.monotonic() + 5
+        while not calls and time.monotonic() < deadline:
+            time.sleep(0.001)
+        # La primera consulta llegó sola: se envió sin esperar la ventana
+        self.assertEqual(calls, [["uno"]])
+        rest = [batcher.submit(text) for text in ["dos", "tres", "dos"]]
+        release.set()
+
+        self.assertEqual([future.result(5) for future in [first] + rest], [[3.0], [3.0], [4.0], [3.0]])
+        self.assertEqual(calls, [["uno"], ["dos", "tres"]])
+        self.assertEqual(metrics.EMBEDDING_BATCH_SIZE.summary()["count"], 2)
+        self.assertEqual(metrics.EMBEDDING_BATCH_SIZE.summary()["sum"], 3)
+
+    def test_a_lone_query_does_not_wait_for_the_window(self):
+        batcher = EmbeddingBatcher(lambda texts: [[1.0] for _ in texts], window=5)
+        started = time.monotonic()
+        self.assertEqual(asyncio.run(batcher.aembed("uno")), [1.0])
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_batches_are_capped_at_max_batch(self):
+        sizes = []
+
+        def create_batch(texts):
+            sizes.append(len(texts))
+            return [[0.0] for _ in texts]
+
+        batcher = EmbeddingBatcher(create_batch, window=0.05, max_batch=2, max_concurrent=1)
+        futures = [batcher.submit(f"consulta {i}") for i in range(5)]
+        for future in futures:
+            future.result(5)
+        # La primera puede salir sola, sin esperar a las demás
+        self.assertEqual(sum(sizes), 5)
+        self.assertEqual(max(sizes), 2)
+        self.assertLessEqual(len(sizes), 3)
+
+    def test_errors_reach_every_caller(self):
+        batcher = EmbeddingBatcher(mock.Mock(side_effect=openai.error.RateLimitError("lento")), window=0.05)
+        futures = [batcher.submit(text) for text in ["uno", "dos"]]
+        for future in futures:
+            with self.assertRaises(openai.error.RateLimitError):
+                future.result(5)
+
+        # Una respuesta con menos vectores que textos también falla en todos en vez de dejarlos esperando
+        short = EmbeddingBatcher(lambda texts: [[1.0]] * (len(texts) - 1), window=0.05, timeout=5)
+        futures = [short.submit(text) for text in ["uno", "dos", "tres"]]
+        for future in futures:
+            with self.assertRaises(ValueError):
+                future.result(5)
+
+    def test_concurrent_views_embed_in_few_requests(self):
+        queries = [f"consulta {i}" for i in range(6)]
+
+        async def main():
+            return await asyncio.gather(*(views.aembed_query(query, 16) for query in queries))
+
+        with fake_openai.installed(dim=16, embedding_latency=0.01) as fake, \
+                mock.patch.object(views, "embedding_batcher",
+                                  EmbeddingBatcher(views.create_query_embeddings, window=0.05)):
+            embeddings = asyncio.run(main())
+        # La primera consulta sale sola; las demás se juntan mientras tanto
+        self.assertLessEqual(fake.calls["embedding"], 2)
+        self.assertEqual(len({tuple(embedding) for embedding in embeddings}), 6)
@@ -0,0 +1,104 @@
+"""
+Token counting helpers shared by the chat views and the index builder.
+"""
+from functools import lru_cache
+
+import tiktoken
+
+# Los conteos aditivos pueden diferir del conteo exacto en unos pocos tokens
+# donde se unen dos textos (el BPE puede fusionar caracteres a ambos lados).
+SLACK_PER_JOINT = 3
+
+
+@lru_cache(maxsize=None)
+def encoding_for_model(model: str) -> tiktoken.Encoding:
+    """tiktoken encoding for `model`, created once per process."""
+    return tiktoken.encoding_for_model(model)
+
+
+def num_tokens(text: str, model: str) -> int:
+    """Return the number of tokens in a string."""
+    return len(encoding_for_model(model).encode(text))
+
+
+def count_tokens(texts: list[str], model: str) -> list[int]:
+    """Token count of each text."""
+    return [len(tokens) for tokens in encoding_for_model(model).encode_batch(texts)]
+
+
+def token_counts_by_text(index, model: str) -> dict[str, int]:
+    """Token count of every text in `index` for `model`'s encoding.
+
+    Uses the counts stored at build time (``n_tokens``) when they were made with
+    the same encoding; otherwise (e.g. an index imported from CSV) counts them
+    once and keeps the result on the index.
+    """
+    encoding = encoding_for_model(model)
+    counts = index.token_counts.get(encoding.name)
+    if counts is None:
+        stored = index.metadata.get("n_tokens")
+        if stored is not None and index.tokenizer == encoding.name:
+            values = stored
+        else:
+            values = count_tokens(index.texts, model)
+        counts = index.token_counts[encoding.name] = dict(zip(index.texts, values))
+    return counts
+
+
+def count_within_budget(
+        head: str,
+        pieces: list[str],
+        piece_tokens: list[int],
+        tail: str,
+        token_budget: int,
+        model: str,
+        joints_per_piece: int = 1,
+        render=None,
+) -> int:
+    """Return how many leading `pieces` fit between `head` and `tail` within `token_budget`.
+
+    Gives the same result as re-encoding ``head + pieces[:i + 1] + tail`` for
+    every i and stopping at the first one over budget, but in a single additive
+    pass over `piece_tokens` (estimated tokens of each piece). The exact
+    encoding is only used when the estimate is within the joint slack of the
+    budget. `joints_per_piece` is the number of places where separately counted
+    texts meet inside each piece, plus its joint with the previous one.
+    `render(n)`, if given, returns the text actually sent with the first n
+    pieces (e.g. regrouped) for that exact check.
+    """
+    parts = [head]
+    used = num_tokens(head, model) + num_tokens(tail, model)
+    joints = 1
+    for n, (piece, tokens) in enumerate(zip(pieces, piece_tokens), start=1):
+        estimate = used + tokens
+        joints += joints_per_piece
+        slack = joints * SLACK_PER_JOINT
+        if estimate + slack <= token_budget:
+            fits = True
+        elif estimate - slack > token_budget:
+            fits = False
+        else:
+            text = render(n) if render else "".join(parts) + piece + tail
+            fits = num_tokens(text, model) <= token_budget
+        if not fits:
+            break
+        parts.append(piece)
+        used = estimate
+    return len(parts) - 1
+
+
+def pack_within_budget(
+        head: str,
+        pieces: list[str],
+        piece_tokens: list[int],
+        tail: str,
+        token_budget: int,
+        model: str,
+        joints_per_piece: int = 1,
+) -> str:
+    """Return `head` + the longest prefix of `pieces` that fits `token_budget` + `tail`.
+
+    See `count_within_budget`.
+    """
+    fitting = count_within_budget(head, pieces, piece_tokens, tail, token_budget, model, joints_per_piece)
+    return "".join([head, *pieces[:fitting], tail])
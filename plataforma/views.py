@@ -1,24 +1,39 @@
 import os
-import ast
+import hashlib
+import json
+import logging
 import openai
+import numpy as np
 import pandas as pd
 import sys
-import tiktoken
-from scipy import spatial
 import re
 import smtplib
+from contextlib import aclosing, closing
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from django.http import HttpResponse, JsonResponse
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.conf import settings
 from profiles.models import Profile, Company, CustomUser
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
+from .answer_cache import SemanticAnswerCache
+from .conversations import TOKENS_PER_MESSAGE, ConversationStore
+from .embedding_batcher import EmbeddingBatcher
+from .embedding_cache import QueryEmbeddingCache, normalize_query
+from .filters import metadata_index
+from .index_registry import UnknownCorpus, index_registry
+from . import lexical, metrics, tokens
+from .retrieval import VectorIndex, as_vector_index
+from .singleflight import DatabaseLocks, SingleFlight
 
 # Create your views here.
 
+logger = logging.getLogger(__name__)
+
 # API key
 openai.organization = os.getenv('OPENAI_ORG')
 openai.api_key = os.getenv('OPENAI_API_KEY')
@@ -32,67 +47,260 @@ EMBEDDING_MODEL = "text-embedding-ada-002"
 
 def num_tokens(text: str, model: str = GPT_MODEL) -> int:
     """Return the number of tokens in a string."""
-    encoding = tiktoken.encoding_for_model(model)
-    return len(encoding.encode(text))
+    return tokens.num_tokens(text, model)
 
 
 # CAMBIO 1: Usar datos MIA en lugar de sercotec
-try:
-    df = pd.read_csv("./plataforma/mia_data/mia_embeddings.csv")
-    print("✅ Cargados datos MIA UC")
-except FileNotFoundError:
-    # Fallback a datos originales si no existen los de MIA
-    df = pd.read_csv("./plataforma/bases_sercotec_embeddings.csv")
-    print("⚠️ Usando datos sercotec (MIA no encontrado)")
+# Los índices se cargan bajo demanda y se recargan al publicarse una nueva versión.
+# MIA es el corpus por defecto; sercotec se pide con corpus="sercotec" (ver index_registry.DEFAULT_CORPORA)
+
+
+# Cache de embeddings de preguntas (LRU en memoria + SQLite compartido entre workers)
+query_embedding_cache = QueryEmbeddingCache(
+    EMBEDDING_MODEL,
+    max_entries=getattr(settings, 'RAG_EMBEDDING_CACHE_SIZE', 1024),
+    path=getattr(settings, 'RAG_EMBEDDING_CACHE_PATH', None),
+    max_rows=getattr(settings, 'RAG_EMBEDDING_CACHE_MAX_ROWS', 100_000),
+)
+
+
+# Cache semántico de respuestas: preguntas casi idénticas no vuelven a llamar a ChatCompletion
+answer_cache = SemanticAnswerCache(
+    threshold=getattr(settings, 'RAG_ANSWER_CACHE_THRESHOLD', 0.97),
+    ttl=getattr(settings, 'RAG_ANSWER_CACHE_TTL', 3600),
+    max_entries=getattr(settings, 'RAG_ANSWER_CACHE_SIZE', 256),
+)
+
+
+# Historia de cada conversación en el servidor: ventana de turnos recientes y resumen de los anteriores
+conversation_store = ConversationStore(
+    GPT_MODEL,
+    token_budget=getattr(settings, 'RAG_HISTORY_TOKEN_BUDGET', 1000),
+    summary_budget=getattr(settings, 'RAG_HISTORY_SUMMARY_BUDGET', 200),
+    max_entries=getattr(settings, 'RAG_CONVERSATION_CACHE_SIZE', 1000),
+    check_interval=getattr(settings, 'RAG_CONVERSATION_CHECK_INTERVAL', 1.0),
+)
+CONVERSATION_SESSION_KEY = 'rag_conversation'
+
+
+# Preguntas idénticas simultáneas comparten una sola respuesta (en el proceso y, opcionalmente, entre workers)
+single_flight = SingleFlight(
+    enabled=getattr(settings, 'RAG_SINGLE_FLIGHT', True),
+    locks=DatabaseLocks(ttl=getattr(settings, 'RAG_SINGLE_FLIGHT_LOCK_TTL', 120))
+    if getattr(settings, 'RAG_SINGLE_FLIGHT_DB', False) else None,
+)
+
+
+def create_query_embeddings(texts: list[str]) -> list[list[float]]:
+    """Embeddings of several queries in one API call, in the order of `texts`."""
+    response = openai.Embedding.create(
+        model=EMBEDDING_MODEL,
+        input=texts,
+    )
+    return [item["embedding"] for item in sorted(response["data"], key=lambda item: item["index"])]
 
-# convert embeddings from CSV str type back to list type
-df['embedding'] = df['embedding'].apply(ast.literal_eval)
+
+# Las consultas que llegan juntas (dentro de la ventana, en ms) se embeben en una sola llamada a la API;
+# con ventana 0 cada consulta hace su propia llamada
+EMBEDDING_BATCH_WINDOW_MS = getattr(settings, 'RAG_EMBEDDING_BATCH_WINDOW_MS', 5)
+embedding_batcher = EmbeddingBatcher(
+    create_query_embeddings,
+    window=EMBEDDING_BATCH_WINDOW_MS / 1000,
+    max_batch=getattr(settings, 'RAG_EMBEDDING_BATCH_SIZE', 100),
+    max_concurrent=getattr(settings, 'RAG_EMBEDDING_BATCH_CONCURRENCY', 4),
+) if EMBEDDING_BATCH_WINDOW_MS > 0 else None
+
+
+def embed_query(query: str, dim: int):
+    """Return the embedding of a query, going to the OpenAI API only on a cache miss.
+
+    `dim` is the dimension of the index the embedding will be compared with.
+    """
+    def create(text):
+        if embedding_batcher is not None:
+            return embedding_batcher.embed(text)
+        response = openai.Embedding.create(
+            model=EMBEDDING_MODEL,
+            input=text,
+        )
+        return response["data"][0]["embedding"]
+
+    return query_embedding_cache.get_or_create(query, create, dim)
 
 
 # search function
 def strings_ranked_by_relatedness(
         query: str,
-        df: pd.DataFrame,
-        relatedness_fn=lambda x, y: 1 - spatial.distance.cosine(x, y),
-        top_n: int = 100
-) -> tuple[list[str], list[float]]:
-    """Returns a list of strings and relatednesses, sorted from most related to least."""
-    query_embedding_response = openai.Embedding.create(
-        model=EMBEDDING_MODEL,
-        input=query,
-    )
-    query_embedding = query_embedding_response["data"][0]["embedding"]
+        df: VectorIndex | pd.DataFrame,
+        relatedness_fn=None,
+        top_n: int = 100,
+        query_embedding=None,
+        filters: dict | None = None,
+) -> tuple[tuple[str, ...], tuple[float, ...]]:
+    """Returns a list of strings and relatednesses, sorted from most related to least.
+
+    By default scores the whole corpus with a single matrix-vector product over
+    pre-normalized embeddings and keeps the `top_n` best with a partial sort.
+    A custom `relatedness_fn(query_embedding, row_embedding)` falls back to
+    scoring row by row. Pass `query_embedding` when it is already known.
+    `filters` (see filters.py) restricts the scoring to the matching courses.
+    """
+    index = as_vector_index(df)
+    if query_embedding is None:
+        query_embedding = embed_query(query, index.dim)
+    rows = filter_rows(index, filters)
+    if relatedness_fn is None:
+        return index.ranked_strings(query_embedding, top_n=top_n, rows=rows)
+
     strings_and_relatednesses = [
-        (row["text"], relatedness_fn(query_embedding, row["embedding"]))
-        for i, row in df.iterrows()
+        (index.texts[i], relatedness_fn(query_embedding, index.matrix[i]))
+        for i in (range(len(index)) if rows is None else rows)
     ]
+    if not strings_and_relatednesses:
+        return (), ()
     strings_and_relatednesses.sort(key=lambda x: x[1], reverse=True)
     strings, relatednesses = zip(*strings_and_relatednesses)
     return strings[:top_n], relatednesses[:top_n]
 
 
+# CAMBIO 2: Mensaje adaptado para MIA UC
+INTRODUCTION = 'Usa la siguiente información del catálogo de cursos del Magíster en Inteligencia Artificial (MIA) de la Universidad Católica para responder la pregunta. Si la respuesta no se encuentra en la información, escribe "No pude encontrar una respuesta."'
+ARTICLE_HEAD = '\n\nInformación del curso:\n"""\n'
+ARTICLE_TAIL = '\n"""'
+
+
+def filter_rows(index: VectorIndex, filters: dict | None):
+    """Row ids of `index` that match `filters`, or None to keep every row."""
+    if not filters:
+        return None
+    return metadata_index(index).rows(filters)
+
+
+def ranked_rows(
+        query: str,
+        index: VectorIndex,
+        top_n: int = 100,
+        query_embedding=None,
+        filters: dict | None = None,
+):
+    """Row ids of `index` ranked for `query`, fusing the vector and BM25 rankings (RRF).
+
+    A query that names a course code of the index is resolved lexically when no
+    embedding is given: that course's rows come first, followed by the other
+    BM25 hits, and the embedding API is not called. Only rows matching
+    `filters` are scored.
+    """
+    with metrics.span("lexical"):
+        rows = filter_rows(index, filters)
+        if rows is not None and len(rows) == 0:
+            return np.empty(0, dtype=np.intp)
+        bm25 = lexical.lexical_index(index)
+        lexical_rows, _ = bm25.search(query, top_n, rows=rows)
+        exact = bm25.exact_matches(query, rows=rows)
+        if exact and query_embedding is None:
+            seen = set(exact)
+            rest = [row for row in lexical_rows if row not in seen]
+            return np.array(exact + rest, dtype=np.intp)[:top_n]
+
+    if query_embedding is None:
+        query_embedding = embed_query(query, index.dim)
+    with metrics.span("vector"):
+        vector_rows, _ = index.search(query_embedding, top_n, rows=rows)
+        return lexical.reciprocal_rank_fusion(vector_rows, lexical_rows)[:top_n]
+
+
 def query_message(
         query: str,
-        df: pd.DataFrame,
+        df: VectorIndex | pd.DataFrame,
         model: str,
-        token_budget: int
+        token_budget: int,
+        query_embedding=None,
+        filters: dict | None = None,
 ) -> str:
-    """Return a message for GPT, with relevant source texts pulled from a dataframe."""
-    strings, relatednesses = strings_ranked_by_relatedness(query, df)
-    # CAMBIO 2: Mensaje adaptado para MIA UC
-    introduction = 'Usa la siguiente información del catálogo de cursos del Magíster en Inteligencia Artificial (MIA) de la Universidad Católica para responder la pregunta. Si la respuesta no se encuentra en la información, escribe "No pude encontrar una respuesta."'
-    question = f"\n\nPregunta: {query}"
-    message = introduction
-    for string in strings:
-        next_article = f'\n\nInformación del curso:\n"""\n{string}\n"""'
-        if (
-                num_tokens(message + next_article + question, model=model)
-                > token_budget
-        ):
-            break
-        else:
-            message += next_article
-    return message + question
+    """Return a message for GPT, with relevant source texts pulled from a dataframe.
+
+    Articles are packed in one additive pass using the per-text token counts
+    stored with the index; the result is the same prompt as re-counting the
+    whole message for every added article.
+    """
+    index = as_vector_index(df)
+    if "section" in index.metadata and "course_code" in index.metadata:
+        return section_query_message(query, index, model, token_budget, query_embedding=query_embedding,
+                                     filters=filters)
+    strings = [index.texts[i] for i in ranked_rows(query, index, query_embedding=query_embedding, filters=filters)]
+    with metrics.span("pack"):
+        question = f"\n\nPregunta: {query}"
+        articles = [f'{ARTICLE_HEAD}{string}{ARTICLE_TAIL}' for string in strings]
+
+        article_tokens = estimated_article_tokens(index, strings, model)
+        # 3 uniones por artículo: con el anterior, encabezado|texto y texto|cierre
+        return tokens.pack_within_budget(INTRODUCTION, articles, article_tokens, question, token_budget, model,
+                                         joints_per_piece=3)
+
+
+def estimated_article_tokens(index: VectorIndex, strings, model: str) -> list[int]:
+    """Tokens of each text wrapped as an article, from the counts stored with the index."""
+    text_tokens = tokens.token_counts_by_text(index, model)
+    overhead = num_tokens(ARTICLE_HEAD, model=model) + num_tokens(ARTICLE_TAIL, model=model)
+    return [
+        overhead + (text_tokens[string] if string in text_tokens else num_tokens(string, model=model))
+        for string in strings
+    ]
+
+
+def course_header(text: str, course_code) -> str:
+    """Leading "Curso: X Código: Y " that a section chunk repeats from its course ("" if none)."""
+    match = re.match(rf"(?:Curso: .*? )?Código: {re.escape(str(course_code))} ", text)
+    return match.group(0) if match else ""
+
+
+def group_sections(index: VectorIndex, rows) -> list[str]:
+    """Texts of `rows` joined by course, keeping the course header only on its first section."""
+    courses = []
+    for code, group in index.group(rows):
+        first, *rest = (index.texts[i] for i in group)
+        courses.append('\n'.join([first, *(text[len(course_header(text, code)):] for text in rest)]))
+    return courses
+
+
+def section_query_message(
+        query: str,
+        index: VectorIndex,
+        model: str,
+        token_budget: int,
+        query_embedding=None,
+        filters: dict | None = None,
+) -> str:
+    """`query_message` for an index chunked by section.
+
+    Sections are selected in relevance order, exactly as whole courses are, and
+    then grouped back by course so each course appears once with only its
+    relevant sections. A section joined to its course costs its stored tokens
+    minus the article wrapper and the repeated header it no longer carries.
+    """
+    ranked = ranked_rows(query, index, query_embedding=query_embedding, filters=filters)
+    with metrics.span("pack"):
+        strings = [index.texts[i] for i in ranked]
+        question = f"\n\nPregunta: {query}"
+        article_tokens = estimated_article_tokens(index, strings, model)
+        wrapper = num_tokens(ARTICLE_HEAD, model=model) + num_tokens(ARTICLE_TAIL, model=model)
+        newline = num_tokens('\n', model=model)
+        codes = index.metadata["course_code"]
+        seen = set()
+        for n, (i, string) in enumerate(zip(ranked, strings)):
+            if codes[i] in seen:
+                header = course_header(string, codes[i])
+                article_tokens[n] += newline - wrapper - (num_tokens(header, model=model) if header else 0)
+            seen.add(codes[i])
+
+        def message(selected: int) -> str:
+            courses = group_sections(index, ranked[:selected])
+            return INTRODUCTION + "".join(f'{ARTICLE_HEAD}{course}{ARTICLE_TAIL}' for course in courses) + question
+
+        # Las uniones nuevas (salto de línea, encabezado recortado) quedan dentro de las 3 por sección
+        selected = tokens.count_within_budget(INTRODUCTION, strings, article_tokens, question, token_budget, model,
+                                              joints_per_piece=3, render=message)
+        return message(selected)
 
 
 def format_response(response_text: str) -> str:
@@ -154,21 +362,8 @@ def format_response(response_text: str) -> str:
     return formatted_text
 
 
-def ask(
-        query: str,
-        df: pd.DataFrame = df,
-        model: str = GPT_MODEL,
-        token_budget: int = 4096 - 500,
-        print_message: bool = False,
-        profile: Profile = None,
-) -> str:
-    """Answers a query using GPT and a dataframe of relevant texts and embeddings."""
-    message = query_message(query, df, model=model, token_budget=token_budget)
-    if print_message:
-        print(message)
-
-    # CAMBIO 3: Mensaje de sistema mejorado para respuestas estructuradas
-    system_message = """Eres un asistente del catálogo de cursos UC. Ayudas con información sobre cursos, créditos, contenidos y bibliografía.
+# CAMBIO 3: Mensaje de sistema mejorado para respuestas estructuradas
+SYSTEM_MESSAGE = """Eres un asistente del catálogo de cursos UC. Ayudas con información sobre cursos, créditos, contenidos y bibliografía.
 
 IMPORTANTE: Estructura tus respuestas de manera clara y organizada:
 - Usa párrafos separados para diferentes temas
@@ -177,28 +372,416 @@ IMPORTANTE: Estructura tus respuestas de manera clara y organizada:
 - Usa un lenguaje claro y profesional
 - Separa las ideas principales en párrafos distintos"""
 
-    if profile is not None:
-        system_message += f" Saluda a {profile.name} por su nombre."
 
-    messages = [
-        {"role": "system", "content": system_message},
+def build_messages(
+        query: str,
+        df: VectorIndex,
+        model: str,
+        token_budget: int,
+        print_message: bool = False,
+        query_embedding=None,
+        filters: dict | None = None,
+        history: list[dict] | None = None,
+) -> list[dict]:
+    """Return the ChatCompletion messages for a query.
+
+    `history` (previous turns, see conversations.py) goes between the system
+    message and the question; its tokens, including the role and separators
+    of each message, are taken from the context budget.
+    """
+    history = history or []
+    if history:
+        token_budget -= sum(tokens.count_tokens([m["content"] for m in history], model))
+        token_budget -= len(history) * TOKENS_PER_MESSAGE
+    message = query_message(query, df, model=model, token_budget=token_budget, query_embedding=query_embedding,
+                            filters=filters)
+    if print_message:
+        print(message)
+
+    return [
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        *history,
         {"role": "user", "content": message},
     ]
 
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=messages,
-        temperature=0.7  # Reducido para respuestas más consistentes
+
+def answer_scope(index: VectorIndex, model: str, filters: dict | None, history: list[dict] | None = None) -> str:
+    """Cache scope of an answer: index version, chat model, filters and the conversation window it follows.
+
+    A follow-up question is only answered from the cache (or joins a flight)
+    with exactly the same summary and recent turns.
+    """
+    scope = f"{index.version}:{model}"
+    if filters:
+        scope += ":" + json.dumps(filters, sort_keys=True, default=list)
+    if history:
+        scope += ":" + hashlib.sha256(json.dumps(history, ensure_ascii=False).encode("utf-8")).hexdigest()
+    return scope
+
+
+def resolve_index(df: VectorIndex | pd.DataFrame | None, corpus: str | None = None) -> VectorIndex:
+    """`df` as a VectorIndex, or the served index of `corpus` if `df` is None."""
+    if df is None:
+        with metrics.span("index"):
+            df = index_registry.get(corpus).index
+    return as_vector_index(df)
+
+
+def lookup_answer(
+        query: str,
+        df: VectorIndex | pd.DataFrame | None,
+        model: str,
+        filters: dict | None = None,
+        corpus: str | None = None,
+        history: list[dict] | None = None,
+):
+    """Resolve the index (of `corpus` if no `df` is given) and look the query up in `answer_cache`.
+
+    Returns (index, query_embedding, cache scope, cached answer or None).
+    """
+    df = resolve_index(df, corpus)
+    scope = answer_scope(df, model, filters, history)
+    if lexical.lexical_index(df).exact_matches(query, rows=filter_rows(df, filters)):
+        # Pregunta por código de curso: se resuelve con el índice léxico, sin embedding (cache por texto)
+        with metrics.span("answer_cache"):
+            return df, None, scope, answer_cache.lookup_text(query, scope)
+    with metrics.span("embedding"):
+        query_embedding = embed_query(query, df.dim)
+    with metrics.span("answer_cache"):
+        cached = answer_cache.lookup(query_embedding, scope)
+    return df, query_embedding, scope, cached
+
+
+def store_answer(query: str, query_embedding, answer: str, scope: str) -> None:
+    """Keep an answer in `answer_cache` (by its normalized text if it was resolved without an embedding)."""
+    answer_cache.store(query, query_embedding, answer, scope)
+
+
+def flight_key(query: str, index: VectorIndex, model: str, filters: dict | None, history=None) -> str:
+    """Single-flight key of a question: its answer scope (with its conversation window) and normalized text."""
+    return f"{answer_scope(index, model, filters, history)}\0{normalize_query(query)}"
+
+
+def ask(
+        query: str,
+        df: VectorIndex | pd.DataFrame | None = None,
+        model: str = GPT_MODEL,
+        token_budget: int = 4096 - 500,
+        print_message: bool = False,
+        profile: Profile = None,
+        filters: dict | None = None,
+        corpus: str | None = None,
+        history: list[dict] | None = None,
+) -> str:
+    """Answers a query using GPT and a dataframe of relevant texts and embeddings.
+
+    `filters` restricts the context to matching courses, e.g.
+    ``{"caracter": "MINIMO", "creditos": 5}`` (see filters.py). Without `df`
+    the index of `corpus` is used (``RAG_DEFAULT_CORPUS`` if None).
+    Near-duplicate questions answered against the same index version and model
+    are served from `answer_cache`, and identical questions asked while one is
+    being answered wait for that answer (`single_flight`). The personalized
+    greeting is added afterwards so answers can be shared between users.
+
+    `history` holds the previous turns of the conversation as ChatCompletion
+    messages (see ConversationStore.history). Follow-up questions share
+    cached answers and flights only with the same window (see answer_scope).
+    """
+    df = resolve_index(df, corpus)
+    answer = single_flight.do(
+        flight_key(query, df, model, filters, history),
+        lambda: answer_query(query, df, model, token_budget, print_message, filters, history),
     )
+    return greet(answer, profile)
+
+
+def answer_query(query, df, model, token_budget, print_message=False, filters=None, history=None) -> str:
+    """Answer of ask() for a resolved index, without the greeting."""
+    df, query_embedding, scope, cached = lookup_answer(query, df, model, filters, history=history)
+    if cached is not None:
+        return cached.answer
+
+    messages = build_messages(query, df, model, token_budget, print_message, query_embedding, filters, history)
+
+    with metrics.span("chat"):
+        response = openai.ChatCompletion.create(
+            model=model,
+            messages=messages,
+            temperature=0.7  # Reducido para respuestas más consistentes
+        )
+    metrics.observe_usage(response)
 
     response_message = response["choices"][0]["message"]["content"]
 
     # Formatear la respuesta antes de devolverla
-    formatted_response = format_response(response_message)
+    with metrics.span("format"):
+        formatted_response = format_response(response_message)
+    store_answer(query, query_embedding, formatted_response, scope)
+
+    return formatted_response
+
+
+def ask_stream(
+        query: str,
+        df: VectorIndex | pd.DataFrame | None = None,
+        model: str = GPT_MODEL,
+        token_budget: int = 4096 - 500,
+        print_message: bool = False,
+        profile: Profile = None,
+        filters: dict | None = None,
+        corpus: str | None = None,
+        history: list[dict] | None = None,
+):
+    """Streaming version of ask().
+
+    Yields ("token", text) events as the completion is generated and a final
+    ("done", formatted_answer) event with the same text ask() would return.
+    """
+    df = resolve_index(df, corpus)
+    greeting = greet("", profile)
+    if greeting:
+        yield "token", greeting
+
+    streamed = False
+    events = single_flight.stream(
+        flight_key(query, df, model, filters, history),
+        lambda: answer_query_stream(query, df, model, token_budget, print_message, filters, history),
+    )
+    with closing(events):
+        for event, text in events:
+            if event == "token":
+                streamed = True
+                yield "token", text
+            else:
+                if not streamed:
+                    # Se esperó una pregunta idéntica respondida sin streaming: llega completa
+                    yield "token", text
+                yield "done", greet(text, profile)
+
+
+def answer_query_stream(query, df, model, token_budget, print_message=False, filters=None, history=None):
+    """Events of ask_stream() for a resolved index, without the greeting."""
+    df, query_embedding, scope, cached = lookup_answer(query, df, model, filters, history=history)
+    if cached is not None:
+        yield "token", cached.answer
+        yield "done", cached.answer
+        return
+
+    messages = build_messages(query, df, model, token_budget, print_message, query_embedding, filters, history)
+
+    chunks = []
+    with metrics.span("chat"):
+        response = openai.ChatCompletion.create(
+            model=model,
+            messages=messages,
+            temperature=0.7,  # Reducido para respuestas más consistentes
+            stream=True,
+        )
+        for chunk in response:
+            content = chunk["choices"][0].get("delta", {}).get("content")
+            if content:
+                chunks.append(content)
+                yield "token", content
+    # Sin usage en streaming: cada chunk trae un token
+    metrics.observe_tokens(completion=len(chunks))
+
+    # El formato se aplica sobre la respuesta completa
+    with metrics.span("format"):
+        formatted_response = format_response("".join(chunks))
+    store_answer(query, query_embedding, formatted_response, scope)
+
+    yield "done", formatted_response
+
+
+##########################################
+# Versión async (ASGI): las llamadas a OpenAI no bloquean un hilo y la
+# búsqueda vectorial corre fuera del event loop
+##########################################
+
+async def aembed_query(query: str, dim: int):
+    """Async version of embed_query()."""
+    # La capa SQLite del cache hace I/O bloqueante
+    embedding = await sync_to_async(query_embedding_cache.get, thread_sensitive=False)(query, dim)
+    if embedding is None:
+        if embedding_batcher is not None:
+            vector = await embedding_batcher.aembed(query)
+        else:
+            response = await openai.Embedding.acreate(
+                model=EMBEDDING_MODEL,
+                input=query,
+            )
+            vector = response["data"][0]["embedding"]
+        embedding = await sync_to_async(query_embedding_cache.put, thread_sensitive=False)(query, vector)
+    return embedding
+
+
+async def aresolve_index(df: VectorIndex | pd.DataFrame | None, corpus: str | None = None) -> VectorIndex:
+    """Async version of resolve_index()."""
+    if df is None:
+        with metrics.span("index"):
+            df = (await sync_to_async(index_registry.get, thread_sensitive=False)(corpus)).index
+    if not isinstance(df, VectorIndex):
+        df = await sync_to_async(as_vector_index, thread_sensitive=False)(df)
+    return df
+
+
+async def alookup_answer(
+        query: str,
+        df: VectorIndex | pd.DataFrame | None,
+        model: str,
+        filters: dict | None = None,
+        corpus: str | None = None,
+        history: list[dict] | None = None,
+):
+    """Async version of lookup_answer()."""
+    df = await aresolve_index(df, corpus)
+    scope = answer_scope(df, model, filters, history)
+    bm25 = df.lexical or await sync_to_async(lexical.lexical_index, thread_sensitive=False)(df)
+    if bm25.exact_matches(query, rows=filter_rows(df, filters)):
+        with metrics.span("answer_cache"):
+            return df, None, scope, answer_cache.lookup_text(query, scope)
+    with metrics.span("embedding"):
+        query_embedding = await aembed_query(query, df.dim)
+    with metrics.span("answer_cache"):
+        cached = answer_cache.lookup(query_embedding, scope)
+    return df, query_embedding, scope, cached
+
+
+async def aask(
+        query: str,
+        df: VectorIndex | pd.DataFrame | None = None,
+        model: str = GPT_MODEL,
+        token_budget: int = 4096 - 500,
+        print_message: bool = False,
+        profile: Profile = None,
+        filters: dict | None = None,
+        corpus: str | None = None,
+        history: list[dict] | None = None,
+) -> str:
+    """Async version of ask()."""
+    df = await aresolve_index(df, corpus)
+    answer = await single_flight.ado(
+        flight_key(query, df, model, filters, history),
+        lambda: aanswer_query(query, df, model, token_budget, print_message, filters, history),
+    )
+    return greet(answer, profile)
+
+
+async def aanswer_query(query, df, model, token_budget, print_message=False, filters=None, history=None) -> str:
+    """Async version of answer_query()."""
+    df, query_embedding, scope, cached = await alookup_answer(query, df, model, filters, history=history)
+    if cached is not None:
+        return cached.answer
+
+    messages = await sync_to_async(build_messages, thread_sensitive=False)(
+        query, df, model, token_budget, print_message, query_embedding, filters, history
+    )
+
+    with metrics.span("chat"):
+        response = await openai.ChatCompletion.acreate(
+            model=model,
+            messages=messages,
+            temperature=0.7  # Reducido para respuestas más consistentes
+        )
+    metrics.observe_usage(response)
+
+    with metrics.span("format"):
+        formatted_response = format_response(response["choices"][0]["message"]["content"])
+    store_answer(query, query_embedding, formatted_response, scope)
 
     return formatted_response
 
 
+async def aask_stream(
+        query: str,
+        df: VectorIndex | pd.DataFrame | None = None,
+        model: str = GPT_MODEL,
+        token_budget: int = 4096 - 500,
+        print_message: bool = False,
+        profile: Profile = None,
+        filters: dict | None = None,
+        corpus: str | None = None,
+        history: list[dict] | None = None,
+):
+    """Async version of ask_stream(). Closing the generator closes the upstream stream."""
+    df = await aresolve_index(df, corpus)
+    greeting = greet("", profile)
+    if greeting:
+        yield "token", greeting
+
+    streamed = False
+    events = single_flight.astream(
+        flight_key(query, df, model, filters, history),
+        lambda: aanswer_query_stream(query, df, model, token_budget, print_message, filters, history),
+    )
+    # Los generadores async no se cierran solos al dejar de leerlos
+    async with aclosing(events):
+        async for event, text in events:
+            if event == "token":
+                streamed = True
+                yield "token", text
+            else:
+                if not streamed:
+                    yield "token", text
+                yield "done", greet(text, profile)
+
+
+async def aanswer_query_stream(query, df, model, token_budget, print_message=False, filters=None, history=None):
+    """Async version of answer_query_stream()."""
+    df, query_embedding, scope, cached = await alookup_answer(query, df, model, filters, history=history)
+    if cached is not None:
+        yield "token", cached.answer
+        yield "done", cached.answer
+        return
+
+    messages = await sync_to_async(build_messages, thread_sensitive=False)(
+        query, df, model, token_budget, print_message, query_embedding, filters, history
+    )
+
+    chunks = []
+    with metrics.span("chat"):
+        response = await openai.ChatCompletion.acreate(
+            model=model,
+            messages=messages,
+            temperature=0.7,  # Reducido para respuestas más consistentes
+            stream=True,
+        )
+        try:
+            async for chunk in response:
+                content = chunk["choices"][0].get("delta", {}).get("content")
+                if content:
+                    chunks.append(content)
+                    yield "token", content
+        finally:
+            # Si el cliente se desconecta se deja de leer la respuesta de OpenAI
+            if hasattr(response, "aclose"):
+                await response.aclose()
+    metrics.observe_tokens(completion=len(chunks))
+
+    with metrics.span("format"):
+        formatted_response = format_response("".join(chunks))
+    store_answer(query, query_embedding, formatted_response, scope)
+
+    yield "done", formatted_response
+
+
+def greet(answer: str, profile: Profile = None) -> str:
+    """Prepend a greeting with the user's name to a (shareable) answer."""
+    if profile is not None and profile.name:
+        return f"¡Hola, {profile.name}!\n\n{answer}"
+    return answer
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def wants_stream(request) -> bool:
+    """Whether the client asked for a server-sent events response."""
+    return request.POST.get('stream') == '1' or 'text/event-stream' in request.headers.get('Accept', '')
+
+
 ##########################################
 
 def index(request):
@@ -226,15 +809,12 @@ def index(request):
     return render(request, 'index.html')
 
 
-@csrf_exempt
-def capital_semilla_chat(request, *args, **kwargs):
+async def capital_semilla_chat(request, *args, **kwargs):
     if request.method == 'POST':
-        user = request.user
-        if user.is_authenticated:
+        user = await sync_to_async(authenticated_user)(request)
+        if user is not None:
             query = request.POST.get('query')
-            historic_questions = request.POST.get('historic_questions')
-            historic_answers = request.POST.get('historic_answers')
-            profile = Profile.objects.filter(user=request.user).first()
+            profile = await Profile.objects.filter(user=user).afirst()
 
             # Determinar el nombre del usuario
             if profile and profile.name:
@@ -244,21 +824,46 @@ def capital_semilla_chat(request, *args, **kwargs):
 
             # Si es una petición especial para obtener solo el nombre
             if query == "init":
+                # Cada carga de la página empieza una conversación nueva en el servidor
+                await sync_to_async(start_conversation)(request, user)
                 return JsonResponse({
                     'response': '',
                     'user_name': user_name,
                     'init': True
                 })
 
-            # Procesar pregunta normal
+            # Procesar pregunta normal, fijando la versión del índice para toda la petición
+            try:
+                with metrics.span("index"):
+                    served = await sync_to_async(index_registry.get, thread_sensitive=False)(
+                        request.POST.get('corpus') or None
+                    )
+            except UnknownCorpus as e:
+                return JsonResponse({
+                    'response': f"No existe el corpus '{e.args[0]}'.",
+                    'user_name': user_name
+                }, status=400)
+            # El cliente solo envía la pregunta nueva; la historia se guarda en el servidor
+            conversation_id, history = await sync_to_async(session_conversation)(request, user)
+            metrics.CHAT_REQUESTS.inc(mode='stream' if wants_stream(request) else 'json')
+            if wants_stream(request):
+                if isinstance(request, ASGIRequest):
+                    return astream_chat(query, served, profile, user_name, conversation_id, history)
+                # Bajo WSGI un iterador síncrono permite seguir enviando por partes
+                return stream_chat(query, served, profile, user_name, conversation_id, history)
+
             if profile is not None:
-                response = ask(query, profile=profile)
+                response = await aask(query, df=served.index, profile=profile, history=history)
             else:
-                response = ask(query)
+                response = await aask(query, df=served.index, history=history)
+            await sync_to_async(remember_turn)(conversation_id, query, response, profile)
+            logger.info("Chat respondido con corpus '%s' versión %s", served.corpus, served.version)
 
             return JsonResponse({
                 'response': response,
-                'user_name': user_name
+                'user_name': user_name,
+                'corpus': served.corpus,
+                'index_version': served.version,
             })
         else:
             return JsonResponse({
@@ -267,7 +872,124 @@ def capital_semilla_chat(request, *args, **kwargs):
             })
 
     # Para GET request
-    return render(request, 'capital_semilla_chat.html')
+    return await sync_to_async(render)(request, 'capital_semilla_chat.html')
+
+
+# csrf_exempt envuelve la vista en una función síncrona en Django 4.2; basta con el atributo
+capital_semilla_chat.csrf_exempt = True
+
+
+def metrics_access(request) -> int | None:
+    """HTTP status that denies `request` access to /metrics/, or None if it may read them.
+
+    404 unless RAG_METRICS_ENABLED (by default, only with DEBUG); 403 unless the
+    client address is in RAG_METRICS_ALLOWED_IPS or the user is staff.
+    """
+    if not getattr(settings, 'RAG_METRICS_ENABLED', settings.DEBUG):
+        return 404
+    if request.META.get('REMOTE_ADDR') in getattr(settings, 'RAG_METRICS_ALLOWED_IPS', ('127.0.0.1', '::1')):
+        return None
+    if request.user.is_authenticated and request.user.is_staff:
+        return None
+    return 403
+
+
+def prometheus_metrics(request):
+    """Chat metrics in the Prometheus text format (``?format=json`` for count/p50/p95/p99 per stage)."""
+    status = metrics_access(request)
+    if status is not None:
+        return HttpResponse(status=status)
+    caches = {
+        'embedding': query_embedding_cache.stats(),
+        'answer': answer_cache.stats(),
+        'conversation': conversation_store.stats(),
+    }
+    if request.GET.get('format') == 'json':
+        return JsonResponse(metrics.summary(caches))
+    return HttpResponse(metrics.render_prometheus(caches), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def authenticated_user(request):
+    """Return request.user if authenticated, else None (touches the session, so call it from sync code)."""
+    return request.user if request.user.is_authenticated else None
+
+
+def start_conversation(request, user) -> int:
+    """Start a new server-side conversation for the session (or keep its current one if empty) and return its id."""
+    conversation_id = conversation_store.start(request.session.session_key or '', user,
+                                               current=request.session.get(CONVERSATION_SESSION_KEY))
+    request.session[CONVERSATION_SESSION_KEY] = conversation_id
+    return conversation_id
+
+
+def session_conversation(request, user):
+    """(id, history messages) of the session's conversation, starting one if it has none."""
+    conversation_id = request.session.get(CONVERSATION_SESSION_KEY)
+    if conversation_id is not None:
+        window = conversation_store.window(conversation_id)
+        if window is not None:
+            return conversation_id, window.messages()
+    return start_conversation(request, user), []
+
+
+def remember_turn(conversation_id, query, answer, profile=None) -> None:
+    """Save a turn of the conversation, without the personalized greeting."""
+    conversation_store.append(conversation_id, query, answer.removeprefix(greet("", profile)))
+
+
+def stream_chat(query, served, profile, user_name, conversation_id, history):
+    """Relay the answer to the browser token by token as server-sent events."""
+    def events():
+        yield sse_event('meta', {
+            'user_name': user_name,
+            'corpus': served.corpus,
+            'index_version': served.version,
+        })
+        try:
+            for event, text in ask_stream(query, df=served.index, profile=profile, history=history):
+                if event == 'token':
+                    yield sse_event('token', {'text': text})
+                else:
+                    # Antes del último evento: si el cliente se desconecta después, el turno ya quedó guardado
+                    remember_turn(conversation_id, query, text, profile)
+                    yield sse_event('done', {'response': text, 'user_name': user_name})
+            logger.info("Chat (stream) respondido con corpus '%s' versión %s", served.corpus, served.version)
+        except Exception:
+            logger.exception("Error generando respuesta en streaming")
+            yield sse_event('error', {'response': "Lo siento, ocurrió un error al procesar tu pregunta."})
+
+    return event_stream_response(events())
+
+
+def astream_chat(query, served, profile, user_name, conversation_id, history):
+    """Async version of stream_chat(), used under ASGI."""
+    async def events():
+        yield sse_event('meta', {
+            'user_name': user_name,
+            'corpus': served.corpus,
+            'index_version': served.version,
+        })
+        try:
+            async for event, text in aask_stream(query, df=served.index, profile=profile, history=history):
+                if event == 'token':
+                    yield sse_event('token', {'text': text})
+                else:
+                    await sync_to_async(remember_turn)(conversation_id, query, text, profile)
+                    yield sse_event('done', {'response': text, 'user_name': user_name})
+            logger.info("Chat (stream) respondido con corpus '%s' versión %s", served.corpus, served.version)
+        except Exception:
+            logger.exception("Error generando respuesta en streaming")
+            yield sse_event('error', {'response': "Lo siento, ocurrió un error al procesar tu pregunta."})
+
+    return event_stream_response(events())
+
+
+def event_stream_response(events) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Evita que nginx acumule el stream antes de enviarlo
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 def generate_strategies_prompt(tematica, nivel):